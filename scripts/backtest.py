@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+
+from .panel import INDICATORS, compact, panel_indicator, panel_signals
+
+
+# Backtest vectorizado de las señales de los indicadores (las mismas que usan las métricas de metrics_calculation)
+# cada señal se convierte en una serie de posiciones (1 largo, -1 corto, 0 fuera) y se mantiene forecast_horizon barras:
+# la exposición de cada barra es la media de las posiciones de las últimas forecast_horizon señales
+# (fh carteras escalonadas), y se aplica al return de la barra siguiente
+# todo se calcula a la vez para todos los tickers del panel y todos los parámetros de cada indicador
+# a diferencia de las métricas, no se eliminan los outliers: una estrategia no puede saltarse las barras extremas
+
+
+# barras por año para anualizar el sharpe
+BARS_PER_YEAR = 252
+
+
+# reglas de cada indicador para pasar de sus señales (las de metrics_calculation) a posiciones
+# sma y ppo siguen la tendencia, rsi y bbands apuestan por la vuelta a la media y el macd tiene las dos zonas
+RULES = {
+    'sma': {'trend': lambda signals: np.where(signals[0], 1, -1)},
+    'rsi': {'reversal': lambda signals: signals[1].astype('int') - signals[0].astype('int')},
+    'macd': {
+        'pro-trend': lambda signals: (signals[0] & signals[1]).astype('int') - (~signals[0] & ~signals[1]).astype('int'),
+        'anti-trend': lambda signals: (signals[0] & ~signals[1]).astype('int') - (~signals[0] & signals[1]).astype('int'),
+    },
+    'ppo': {'trend': lambda signals: np.where(signals[0], 1, -1)},
+    'bbands': {'reversal': lambda signals: signals[1].astype('int') - signals[0].astype('int')},
+}
+
+# métricas del backtest
+METRICS = ['total_return', 'sharpe', 'max_drawdown', 'hit_rate', 'turnover', 'exposure']
+
+# métricas en las que un valor menor es mejor (al elegir el parámetro del walk-forward)
+LOWER_IS_BETTER = {'max_drawdown', 'turnover'}
+
+
+# función para obtener la salida de un indicador que indica si ya está definido (sin NaN del inicio)
+def indicator_defined(indicator, values, i):
+    if indicator in ['macd', 'bbands']:
+        values = values[2] if indicator == 'macd' else values[0]
+
+    return ~np.isnan(values[i])
+
+
+# función para desplazar un array hacia la derecha en el último eje, rellenando con fill
+def shift(values, periods, fill=0.0):
+    shifted = np.full(values.shape, fill, dtype='float')
+    if periods < values.shape[-1]:
+        shifted[..., periods:] = values[..., :values.shape[-1] - periods]
+    return shifted
+
+
+# función para obtener las posiciones de todas las estrategias (indicador, parámetro, regla) sobre las filas compactadas
+# de cada ticker; no dependen del horizonte temporal, así que se calculan una sola vez
+def strategy_positions(close, valid, params):
+    strategies = []
+    positions = []
+    for indicator in INDICATORS:
+        parameters = params[f'{indicator}_timeperiods']
+        if not parameters:
+            continue
+
+        values = panel_indicator(close, indicator, parameters)
+        for i, parameter in enumerate(parameters):
+            with np.errstate(invalid='ignore'):
+                signals = [np.asarray(signal, dtype='bool') for signal in panel_signals(indicator, close, values, i)]
+            defined = indicator_defined(indicator, values, i) & valid
+            for rule, position in RULES[indicator].items():
+                strategies.append((indicator, parameter, rule))
+                positions.append(np.where(defined, position(signals), 0).astype('int8'))
+
+    return strategies, np.stack(positions)
+
+
+# función para calcular las series por barra del backtest de un horizonte temporal para todo el panel
+# devuelve arrays (estrategia x ticker x fila) sobre las filas compactadas de cada ticker (0 en las filas no válidas)
+# cost es el coste por unidad de cambio en la exposición (p.ej. 0.001 = 10 puntos básicos)
+def backtest_arrays(close, valid, positions, forecast_horizon, cost=0.0):
+    # exposición: media de las posiciones de las últimas forecast_horizon barras
+    cumulative = np.cumsum(positions, axis=-1, dtype='float')
+    exposure = (cumulative - shift(cumulative, forecast_horizon)) / forecast_horizon
+    exposure *= valid
+
+    # return de cada barra respecto a la anterior y return a forecast_horizon barras (para los aciertos)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.nan_to_num(close / shift(close, 1, np.nan) - 1)
+        future_returns = np.full(close.shape, np.nan)
+        future_returns[:, :-forecast_horizon] = close[:, forecast_horizon:] / close[:, :-forecast_horizon] - 1
+
+    turnover = np.abs(exposure - shift(exposure, 1)) * valid
+    pnl = shift(exposure, 1) * returns - cost * turnover
+
+    trades = (positions != 0) & ~np.isnan(future_returns)
+    hits = trades & (positions == np.sign(future_returns))
+
+    return {
+        'pnl': pnl,
+        'turnover': turnover,
+        'exposure': np.abs(exposure),
+        'trades': trades,
+        'hits': hits,
+        'bars': valid,
+    }
+
+
+# función para pasar las series de backtest_arrays al calendario común del panel (0 en los días sin barra),
+# para poder cortarlas por fechas en el walk-forward
+def to_calendar(arrays, valid, mask):
+    def calendar(values):
+        result = np.zeros(values.shape[:1] + mask.shape, dtype=values.dtype)
+        result[:, mask] = values[:, valid]
+        return result
+
+    calendar_arrays = {name: calendar(values) for name, values in arrays.items() if name != 'bars'}
+    calendar_arrays['bars'] = mask
+    return calendar_arrays
+
+
+# función para calcular las métricas del backtest en un tramo de fechas (rows) a partir de las series por barra
+# devuelve un diccionario métrica -> array (estrategia x ticker)
+def backtest_metrics(arrays, rows=slice(None)):
+    pnl = arrays['pnl'][..., rows]
+    bars = arrays['bars'][:, rows].sum(axis=-1)
+
+    log_equity = np.cumsum(np.log1p(pnl), axis=-1)
+    drawdown = 1 - np.exp(log_equity - np.maximum.accumulate(log_equity, axis=-1))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = pnl.sum(axis=-1) / bars
+        variance = ((pnl - mean[..., None]) ** 2 * arrays['bars'][:, rows]).sum(axis=-1) / (bars - 1)
+
+        return {
+            'total_return': np.expm1(log_equity[..., -1]) if pnl.shape[-1] > 0 else np.full(pnl.shape[:-1], np.nan),
+            'sharpe': np.where(variance > 0, mean / np.sqrt(variance) * np.sqrt(BARS_PER_YEAR), np.nan),
+            'max_drawdown': drawdown.max(axis=-1, initial=0.0),
+            'hit_rate': arrays['hits'][..., rows].sum(axis=-1) / arrays['trades'][..., rows].sum(axis=-1),
+            'turnover': arrays['turnover'][..., rows].sum(axis=-1) / bars,
+            'exposure': arrays['exposure'][..., rows].sum(axis=-1) / bars,
+        }
+
+
+# función para pasar las métricas (estrategia x ticker) a formato largo
+def long_frame(tickers, forecast_horizon, strategies, metrics):
+    n_strategies, n_tickers = len(strategies), len(tickers)
+    frames = []
+    for metric, values in metrics.items():
+        frames.append(pd.DataFrame(data={
+            'ticker': np.tile(tickers, n_strategies),
+            'forecast_horizon': forecast_horizon,
+            'indicator': np.repeat([indicator for indicator, _, _ in strategies], n_tickers),
+            'parameter': np.repeat(np.array([parameter for _, parameter, _ in strategies], dtype='object'), n_tickers),
+            'strategy': np.repeat([rule for _, _, rule in strategies], n_tickers),
+            'metric': metric,
+            'value': values.ravel(),
+        }))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# función para hacer el backtest de todas las estrategias, tickers y horizontes temporales del panel
+# el resultado está en formato largo (ticker, forecast_horizon, indicator, parameter, strategy, metric, value)
+def backtest(panel, params, cost=0.0):
+    fields, valid = compact({'close': panel.field('close')}, panel.mask())
+    strategies, positions = strategy_positions(fields['close'], valid, params)
+
+    frames = []
+    for fh in params['forecast_horizons']:
+        arrays = backtest_arrays(fields['close'], valid, positions, fh, cost)
+        frames.append(long_frame(panel.tickers, fh, strategies, backtest_metrics(arrays)))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# función para obtener los tramos de entrenamiento y test del walk-forward sobre n fechas
+# las fechas se dividen en n_splits + 1 bloques; en cada split se entrena con todos los bloques anteriores y se prueba en el siguiente
+def walk_forward_splits(n_dates, n_splits=4):
+    bounds = np.linspace(0, n_dates, n_splits + 2).astype('int')
+    return [(slice(0, bounds[k]), slice(bounds[k], bounds[k + 1])) for k in range(1, n_splits + 1)]
+
+
+# función para obtener el final del entrenamiento con embargo: en cada ticker se quitan sus últimas forecast_horizon barras
+# anteriores al test, cuyo return a forecast_horizon barras (aciertos) usa precios del test
+# mask es la máscara (ticker x fecha) de las barras de cada ticker en el calendario del panel
+def embargo_end(mask, test_start, forecast_horizon):
+    end = test_start
+    for rows in mask:
+        bars = np.flatnonzero(rows[:test_start])
+        if len(bars):
+            end = min(end, bars[max(len(bars) - forecast_horizon, 0)])
+
+    return end
+
+
+# función para hacer un walk-forward: en cada split se elige, para cada (ticker, indicador, regla), el parámetro con mejor
+# metric en entrenamiento (el mayor, o el menor en las de LOWER_IS_BETTER) y se dan sus métricas en test
+# entre el entrenamiento y el test de cada horizonte se dejan forecast_horizon barras de embargo (ver embargo_end)
+def walk_forward(panel, params, n_splits=4, metric='sharpe', cost=0.0):
+    if metric not in METRICS:
+        raise ValueError(f'métrica desconocida: {metric}')
+    sign = -1 if metric in LOWER_IS_BETTER else 1
+
+    mask = panel.mask()
+    fields, valid = compact({'close': panel.field('close')}, mask)
+    strategies, positions = strategy_positions(fields['close'], valid, params)
+
+    groups = {}
+    for i, (indicator, _, rule) in enumerate(strategies):
+        groups.setdefault((indicator, rule), []).append(i)
+
+    frames = []
+    for fh in params['forecast_horizons']:
+        arrays = to_calendar(backtest_arrays(fields['close'], valid, positions, fh, cost), valid, mask)
+
+        for split, (train, test) in enumerate(walk_forward_splits(len(panel.dates), n_splits)):
+            train = slice(train.start, embargo_end(mask, test.start, fh))
+            train_metrics = backtest_metrics(arrays, train)
+            test_metrics = backtest_metrics(arrays, test)
+
+            for (indicator, rule), members in groups.items():
+                score = np.nan_to_num(sign * train_metrics[metric][members], nan=-np.inf)
+                best = np.asarray(members)[np.argmax(score, axis=0)]
+                tickers = np.arange(len(panel.tickers))
+
+                selected = {f'train_{metric}': train_metrics[metric][best, tickers]}
+                selected.update({name: values[best, tickers] for name, values in test_metrics.items()})
+                for name, values in selected.items():
+                    frames.append(pd.DataFrame(data={
+                        'ticker': panel.tickers,
+                        'forecast_horizon': fh,
+                        'split': split,
+                        'test_start': panel.dates[test.start],
+                        'indicator': indicator,
+                        'strategy': rule,
+                        'parameter': [strategies[i][1] for i in best],
+                        'metric': name,
+                        'value': values,
+                    }))
+
+    return pd.concat(frames, ignore_index=True)
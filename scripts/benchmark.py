@@ -0,0 +1,358 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from . import data_preparation
+from . import metrics_calculation
+from .indicator_cache import IndicatorCache
+from .price_cache import PriceCache
+from .resampling import Resampler
+
+
+# parámetros del estudio (notebook parte3), los mismos que usa el benchmark de metrics_calculation
+PARAMS = {
+    'forecast_horizons': [1, 2, 3, 5, 10, 15, 20, 30],
+    'sma_timeperiods': [14, 20, 50, 100],
+    'rsi_timeperiods': [14, 28, 42],
+    'macd_timeperiods': [{'fastperiod': 12, 'slowperiod': 26, 'signalperiod': 9}],
+    'ppo_timeperiods': [{'fastperiod': 12, 'slowperiod': 26}],
+    'bbands_timeperiods': [20, 30]
+}
+
+# fichero con los resultados de referencia del benchmark
+BASELINE_PATH = 'data/benchmark_baseline.json'
+
+# crecimiento mínimo del pico de memoria (MB) para considerarlo una regresión
+MEMORY_SLACK_MB = 1.0
+
+
+# función para generar precios OHLCV sintéticos con el mismo formato que yfinance (paseo aleatorio geométrico)
+# para historias muy largas conviene freq='min' (barras intradía), con 'B' no caben más de ~2M de días
+def synthetic_prices(n_rows, seed=0, start_date='2000-01-03', freq='B', drift=0.0003, volatility=0.02):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start_date, periods=n_rows, freq=freq, tz='America/New_York', name='Date')
+
+    close = 100 * np.exp(np.cumsum(rng.normal(drift, volatility, n_rows)))
+    spread = rng.uniform(0, 0.01, (2, n_rows))
+
+    return pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.005, n_rows)),
+        'High': close * (1 + spread[0]),
+        'Low': close * (1 - spread[1]),
+        'Close': close,
+        'Volume': rng.integers(100_000, 10_000_000, n_rows),
+        'Dividends': 0.0,
+        'Stock Splits': 0.0,
+    }, index=index)
+
+
+# implementación original de drop_outliers (fila a fila), se mantiene como referencia de tiempos y de equivalencia
+# (tests/test_data_preparation.py)
+def drop_outliers_reference(stock_prices):
+    outliers = stock_prices.join(stock_prices.returns.rolling(window=21).agg(['mean', 'std']))
+    def indentify_outliers(row, n_sigmas=3):
+        x = row['returns']
+        mu = row['mean']
+        sigma = row['std']
+
+        if (x > mu + n_sigmas*sigma) | (x < mu - n_sigmas*sigma):
+            return 1
+        else:
+            return 0
+    outliers['outlier'] = outliers.apply(indentify_outliers, axis=1)
+    stock_prices = stock_prices[outliers['outlier'] == 0]
+
+    return stock_prices
+
+
+# implementación original de get_position (lista por comprensión), se mantiene como referencia de tiempos y de
+# equivalencia (tests/test_data_preparation.py)
+def get_position_reference(returns):
+    mean_returns = np.mean(np.abs(returns))
+    return np.array([ret >= 0 if np.abs(ret) > mean_returns else 2 for ret in returns], dtype='object').astype('int')
+
+
+# función para preparar un dataframe con returns a partir de precios sintéticos
+def synthetic_returns(n_rows, seed=0, forecast_horizon=1):
+    stock_prices = data_preparation.clean_data(synthetic_prices(n_rows, seed, freq='min', drift=0.0, volatility=0.001))
+    stock_prices['returns'] = data_preparation.get_returns(stock_prices.close, forecast_horizon)
+    return stock_prices
+
+
+# función para medir el tiempo medio de una llamada
+def time_call(function, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+# función para medir cómo escalan drop_outliers y get_position con el número de filas
+# las versiones originales solo se miden hasta reference_limit filas porque tardan demasiado
+def scaling_benchmark(sizes=(10_000, 100_000, 1_000_000, 10_000_000), reference_limit=100_000):
+    results = {'function': [], 'rows': [], 'seconds': [], 'rows_per_second': []}
+
+    def record(name, rows, seconds):
+        results['function'].append(name)
+        results['rows'].append(rows)
+        results['seconds'].append(seconds)
+        results['rows_per_second'].append(rows / seconds)
+
+    for n_rows in sizes:
+        stock_prices = synthetic_returns(n_rows)
+        repeat = 3 if n_rows <= 1_000_000 else 1
+
+        record('drop_outliers', n_rows, time_call(data_preparation.drop_outliers, stock_prices, repeat=repeat))
+        record('get_position', n_rows, time_call(data_preparation.get_position, stock_prices.returns, repeat=repeat))
+
+        if n_rows <= reference_limit:
+            record('drop_outliers_reference', n_rows, time_call(drop_outliers_reference, stock_prices, repeat=1))
+            record('get_position_reference', n_rows, time_call(get_position_reference, stock_prices.returns, repeat=1))
+
+    return pd.DataFrame(data=results)
+
+
+# función para medir el tiempo (mínimo de repeat llamadas) y el pico de memoria (con tracemalloc, en otra llamada) de una función
+# antes se hace una llamada sin medir para que las importaciones diferidas (scipy) y las cachés no cuenten en el tiempo
+def measure(function, *args, repeat=3):
+    function(*args)
+    seconds = time_call(function, *args, repeat=repeat)
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak
+
+
+# función para crear una caché de precios offline con n_tickers tickers sintéticos de n_rows barras
+# explore_stocks lee los precios de ella igual que de yfinance, sin acceder a la red
+def synthetic_cache(path, n_tickers, n_rows):
+    cache = PriceCache(path, offline=True)
+    tickers = [f'SYN{i}' for i in range(n_tickers)]
+
+    for seed, ticker in enumerate(tickers):
+        stock_prices = synthetic_prices(n_rows, seed)
+        dates = stock_prices.index.tz_localize(None)
+        cache.store(ticker, stock_prices, dates[0], dates[-1] + pd.Timedelta(days=1))
+
+    return cache, tickers
+
+
+# función para ejecutar la batería de benchmarks de data_preparation y metrics_calculation con datos sintéticos
+# las funciones de un horizonte se miden sobre un ticker de n_rows barras y explore_stocks sobre n_tickers tickers
+def benchmark_suite(n_rows=5_000, n_tickers=4, forecast_horizon=5, params=PARAMS, executor='serial', repeat=3):
+    results = {'function': [], 'rows': [], 'seconds': [], 'rows_per_second': [], 'peak_memory_mb': []}
+
+    def record(name, rows, function, *args, repeat=repeat):
+        seconds, peak = measure(function, *args, repeat=repeat)
+        results['function'].append(name)
+        results['rows'].append(rows)
+        results['seconds'].append(seconds)
+        results['rows_per_second'].append(rows / seconds)
+        results['peak_memory_mb'].append(peak / 2 ** 20)
+
+    stock_prices = data_preparation.clean_data(synthetic_prices(n_rows))
+    with_returns = stock_prices.copy()
+    with_returns['returns'] = data_preparation.get_returns(with_returns.close, forecast_horizon)
+    price_change = data_preparation.create_price_change_vars(stock_prices.copy(), forecast_horizon)
+    targets = data_preparation.create_target_features(price_change.copy(), forecast_horizon)
+
+    record('get_returns', n_rows, data_preparation.get_returns, stock_prices.close, forecast_horizon)
+    record('drop_outliers', n_rows, data_preparation.drop_outliers, with_returns)
+    record('get_position', n_rows, data_preparation.get_position, with_returns.returns)
+    # create_target_features solo añade columnas a su entrada, así que se puede repetir sobre el mismo dataframe
+    record('create_target_features', len(price_change), data_preparation.create_target_features, price_change, forecast_horizon)
+
+    for indicator in ['sma', 'rsi', 'macd', 'ppo', 'bbands']:
+        function = getattr(metrics_calculation, f'calculate_{indicator}_metrics')
+        for parameter in params[f'{indicator}_timeperiods']:
+            record(f'calculate_{indicator}_metrics[{parameter}]', len(targets), function, targets, parameter)
+
+    record('calculate_fh_metrics', n_rows, lambda: metrics_calculation.calculate_fh_metrics(stock_prices.copy(), forecast_horizon, params))
+
+    # explore_stocks recorre todos los horizontes de todos los tickers, así que se mide una sola vez
+    with tempfile.TemporaryDirectory() as path:
+        cache, tickers = synthetic_cache(path, n_tickers, n_rows)
+        record('explore_stocks', n_tickers * n_rows, metrics_calculation.explore_stocks,
+               tickers, '1900-01-01', None, params, executor, None, cache, repeat=1)
+
+    return pd.DataFrame(data=results)
+
+
+# función para medir la memoria (MB) del dataframe de un ticker en cada fase, en el modo normal y en el lean
+# 'indicators' es el dataframe del horizonte después de calcular todos los indicadores de params y 'indicator_cache'
+# la memoria de los indicadores de cache_indicators (IndicatorCache sobre la serie completa)
+def lean_memory(n_rows=5_000, forecast_horizon=5, params=PARAMS):
+    results = {'frame': [], 'default_mb': [], 'lean_mb': []}
+    memory = {}
+
+    for lean in [False, True]:
+        stock_prices = data_preparation.clean_data(synthetic_prices(n_rows), lean)
+        price_change = data_preparation.create_price_change_vars(stock_prices.copy(), forecast_horizon, lean)
+        targets = data_preparation.create_target_features(price_change.copy(), forecast_horizon, lean)
+        indicators = targets.copy()
+        for indicator, function in metrics_calculation.CALCULATE_METRICS.items():
+            for parameter in params[f'{indicator}_timeperiods']:
+                function(indicators, parameter, lean=lean)
+        cache = IndicatorCache(stock_prices.close, metrics_calculation.indicator_dtype(lean)).warm(params)
+
+        memory[lean] = {
+            'clean_data': data_preparation.frame_memory(stock_prices),
+            'create_price_change_vars': data_preparation.frame_memory(price_change),
+            'create_target_features': data_preparation.frame_memory(targets),
+            'indicators': data_preparation.frame_memory(indicators),
+            'indicator_cache': sum(series.nbytes for values in cache._series.values()
+                                   for series in (values if isinstance(values, tuple) else (values,))),
+        }
+
+    for frame in memory[False]:
+        results['frame'].append(frame)
+        results['default_mb'].append(memory[False][frame] / 2 ** 20)
+        results['lean_mb'].append(memory[True][frame] / 2 ** 20)
+
+    results = pd.DataFrame(data=results)
+    results['ratio'] = results['lean_mb'] / results['default_mb']
+    return results
+
+
+# función para comparar las métricas de explore_stocks en el modo normal y en el lean (mismas filas, en el mismo orden)
+# devuelve por métrica el número de valores, cuántos cambian (más de 1e-9), la diferencia absoluta máxima
+# y cuántos pasan de NaN a número o al revés
+def lean_drift(stocks_metrics, lean_metrics):
+    if not stocks_metrics.drop(columns='value').equals(lean_metrics.drop(columns='value')):
+        raise AssertionError('el modo lean no da las mismas filas que el normal')
+
+    difference = (stocks_metrics['value'] - lean_metrics['value']).abs()
+    drift = pd.DataFrame(data={
+        'metric': stocks_metrics['metric'],
+        'changed': difference > 1e-9,
+        'max_abs_diff': difference.fillna(0.0),
+        'nan_mismatch': stocks_metrics['value'].isna() != lean_metrics['value'].isna(),
+    })
+
+    return drift.groupby('metric', sort=False).agg(
+        values=('changed', 'size'), changed=('changed', 'sum'), max_abs_diff=('max_abs_diff', 'max'),
+        nan_mismatch=('nan_mismatch', 'sum'))
+
+
+# función para medir cuánto desvía el modo lean las métricas de explore_stocks sobre n_tickers tickers sintéticos de
+# n_rows barras (la tolerancia se comprueba en tests/test_metrics_calculation.py)
+def lean_accuracy(n_rows=5_000, n_tickers=4, params=PARAMS, **kwargs):
+    with tempfile.TemporaryDirectory() as path:
+        cache, tickers = synthetic_cache(path, n_tickers, n_rows)
+        stocks_metrics = metrics_calculation.explore_stocks(tickers, '1900-01-01', None, params, cache=cache, **kwargs)
+        lean_metrics = metrics_calculation.explore_stocks(tickers, '1900-01-01', None, params, cache=cache, lean=True, **kwargs)
+
+    return lean_drift(stocks_metrics, lean_metrics)
+
+
+# función para medir el rechazo de los p-values por remuestreo de la sma bajo la hipótesis nula: sobre paseos aleatorios
+# sin deriva las señales de la sma no predicen los future_returns, así que cada p-value debería quedar por debajo de level
+# en una fracción level de los ensayos (cada ensayo es un ticker sintético con otra semilla)
+# devuelve la fracción de rechazos por horizonte, periodo y p-value (permutación y bootstrap); los de Mann-Whitney no se
+# incluyen porque son NaN con los últimos future_returns a NaN
+# con horizontes largos quedan pocas observaciones efectivas y los tests por bloques son algo liberales (con 5.000 barras
+# y fh=20 rechazan un 7-10% a nivel 5%, con fh=1 un 5%); sin bloques rechazan ~50% con fh=20 (ver tests/test_resampling.py)
+def resampling_calibration(n_trials=100, n_rows=5_000, forecast_horizons=(5, 10, 20), sma_timeperiods=(5, 20, 50, 200),
+                           level=0.05, n_resamples=500, **kwargs):
+    params = {'sma_timeperiods': list(sma_timeperiods), 'rsi_timeperiods': [], 'macd_timeperiods': [],
+              'ppo_timeperiods': [], 'bbands_timeperiods': []}
+    rejections = []
+    with Resampler(n_resamples, **kwargs) as resampler:
+        for seed in range(n_trials):
+            stock_prices = data_preparation.clean_data(synthetic_prices(n_rows, seed, drift=0.0))
+            for forecast_horizon in forecast_horizons:
+                fh_metrics = pd.DataFrame(data=metrics_calculation.calculate_fh_metrics(
+                    stock_prices.copy(), forecast_horizon, params, resampler=resampler))
+                fh_metrics = fh_metrics[(fh_metrics['indicator'] == 'sma')
+                                        & fh_metrics['metric'].str.endswith(('permutation_p-value', 'bootstrap_p-value'))]
+                rejections.append(fh_metrics.assign(forecast_horizon=forecast_horizon, rejected=fh_metrics['value'] < level))
+
+    rejections = pd.concat(rejections)
+    return rejections.pivot_table(index=['forecast_horizon', 'parameter'], columns='metric', values='rejected',
+                                  aggfunc='mean', sort=False)
+
+
+# función para guardar los resultados de referencia junto con la configuración con la que se obtuvieron
+def save_baseline(results, config, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump({'config': config, 'results': results.to_dict(orient='records')}, f, indent=2)
+
+
+# función para comparar los resultados con los de referencia
+# una función es una regresión si su rendimiento (rows/s) cae más de tolerance respecto a la referencia o si su pico de
+# memoria crece más de memory_tolerance (por defecto tolerance) y más de MEMORY_SLACK_MB (para no marcar picos pequeños)
+def compare_baseline(results, path=BASELINE_PATH, tolerance=0.25, memory_tolerance=None):
+    memory_tolerance = tolerance if memory_tolerance is None else memory_tolerance
+    with open(path) as f:
+        baseline = json.load(f)
+
+    baseline = pd.DataFrame(data=baseline['results'])[['function', 'rows', 'rows_per_second', 'peak_memory_mb']]
+    comparison = results.merge(baseline, on=['function', 'rows'], how='left', suffixes=('', '_baseline'))
+    comparison['speedup'] = comparison['rows_per_second'] / comparison['rows_per_second_baseline']
+    comparison['memory_ratio'] = comparison['peak_memory_mb'] / comparison['peak_memory_mb_baseline']
+    comparison['memory_regression'] = ((comparison['peak_memory_mb'] > comparison['peak_memory_mb_baseline'] * (1 + memory_tolerance))
+                                       & (comparison['peak_memory_mb'] - comparison['peak_memory_mb_baseline'] > MEMORY_SLACK_MB))
+    comparison['regression'] = (comparison['speedup'] < 1 - tolerance) | comparison['memory_regression']
+
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de data_preparation y metrics_calculation con datos sintéticos')
+    parser.add_argument('--scaling', action='store_true', help='medir solo cómo escalan drop_outliers y get_position')
+    parser.add_argument('--lean', action='store_true', help='medir la memoria del modo lean y cuánto desvía las métricas')
+    parser.add_argument('--resampling', action='store_true',
+                        help='medir el rechazo de los p-values por remuestreo bajo la hipótesis nula')
+    parser.add_argument('--trials', type=int, default=100, help='ensayos de --resampling')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--rows', type=int, default=5_000, help='barras por ticker')
+    parser.add_argument('--tickers', type=int, default=4)
+    parser.add_argument('--forecast-horizon', type=int, default=5)
+    parser.add_argument('--executor', default='serial', choices=['serial', 'thread', 'process'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='guardar los resultados como nueva referencia')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--memory-tolerance', type=float, help='tolerancia del pico de memoria (por defecto la de --tolerance)')
+    args = parser.parse_args()
+
+    if args.lean:
+        print(lean_memory(args.rows, args.forecast_horizon).to_string(index=False))
+        drift = lean_accuracy(args.rows, args.tickers, executor=args.executor)
+        print(drift.to_string())
+        print(f'el modo lean cambia {drift["changed"].sum()} de {drift["values"].sum()} valores, '
+              f'diferencia máxima {drift["max_abs_diff"].max():.2e}')
+    elif args.resampling:
+        calibration = resampling_calibration(args.trials, n_rows=args.rows)
+        print(calibration.to_string())
+        print(f'rechazo medio a nivel 5%: {calibration.values.mean():.3f}')
+    elif args.scaling:
+        print(scaling_benchmark(args.sizes).to_string(index=False))
+    else:
+        config = {'rows': args.rows, 'tickers': args.tickers, 'forecast_horizon': args.forecast_horizon, 'executor': args.executor}
+        results = benchmark_suite(args.rows, args.tickers, args.forecast_horizon, PARAMS, args.executor, args.repeat)
+
+        if args.save_baseline:
+            save_baseline(results, config, args.baseline)
+            print(results.to_string(index=False))
+        elif os.path.exists(args.baseline):
+            comparison = compare_baseline(results, args.baseline, args.tolerance, args.memory_tolerance)
+            print(comparison.to_string(index=False))
+            if comparison['regression'].any():
+                raise SystemExit(f'regresiones: {", ".join(comparison.loc[comparison.regression, "function"])}')
+        else:
+            print(results.to_string(index=False))
@@ -0,0 +1,606 @@
+import math
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import talib
+from scipy.signal import lfilter
+
+from . import instrumentation
+from . import metrics_calculation
+from . import stock_metrics as sm
+from .indicator_cache import PPO_MATYPE, indicator_parameters
+from .metrics_store import MetricsStore
+from .panel import INDICATORS, panel_signals
+from .streaming import N_SIGNALS
+
+
+# Modo por bloques (out-of-core) de explore_stocks para historias que no caben en memoria (p.ej. barras de minutos)
+# los precios de un ticker se leen por bloques de filas consecutivas dos veces:
+# - primera pasada: medias de |returns| y |future_returns| (los umbrales de position y future_position, que son globales)
+#   y una muestra de sus cuantiles para repartir los valores en tramos
+# - segunda pasada: returns, outliers, targets, indicadores, señales y tablas de contingencia de cada bloque
+# cada fase arrastra del bloque anterior solo lo que necesita: las últimas fh barras para los returns, los últimos 20
+# returns para la ventana de outliers, las últimas fh filas pendientes de su future_returns y las últimas barras de la
+# ventana de la sma, las bbands y el ppo simple; las medias exponenciales (rsi, macd y ppo exponencial) arrastran su estado
+# las tablas de contingencia se suman entre bloques y los p-values se calculan al final con un ordenamiento externo:
+# cada fila se escribe en disco en el tramo de valores que le corresponde y los tramos se ordenan de uno en uno
+# la memoria depende del tamaño de los bloques y de los tramos, no de la longitud de la historia
+# el resultado es el de explore_stocks, salvo errores de redondeo
+
+
+# número de cuantiles de cada bloque que se guardan en la primera pasada para calcular los tramos
+SKETCH_SIZE = 129
+
+# número máximo de señales de un indicador (los estados de una tabla caben en un uint8)
+MAX_SIGNALS = 3
+
+# ventana de drop_outliers
+OUTLIER_WINDOW = 21
+
+# hipótesis de los p-values generales sobre |returns| (estados de general_signals)
+# tendencia: alcistas frente a bajistas; posición: largas frente a cortas
+GENERAL_HYPOTHESES = [({0: True}, {0: False}), ({1: True}, {2: True})]
+
+
+# Bloques de un dataframe en memoria (para probar el modo por bloques con los precios de get_stock_prices)
+class FrameChunks:
+
+    def __init__(self, stock_prices, chunk_size=100_000):
+        self.stock_prices = stock_prices
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for start in range(0, len(self.stock_prices), self.chunk_size):
+            yield self.stock_prices.iloc[start:start + self.chunk_size]
+
+
+# Bloques de un parquet (p.ej. los de price_cache.PriceCache), leídos por lotes de filas sin cargar el fichero entero
+class ParquetChunks:
+
+    def __init__(self, path, chunk_size=100_000, columns=('close', 'volume')):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.columns = list(columns)
+
+    def __iter__(self):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(self.path).iter_batches(batch_size=self.chunk_size, columns=self.columns):
+            yield batch.to_pandas()
+
+
+# función para concatenar la cola de un bloque anterior con el bloque actual
+def carry(tail, values):
+    return np.concatenate([tail, np.asarray(values, dtype='float64')])
+
+
+# función para quedarse con las últimas n filas (todas si hay menos, ninguna si n es 0)
+def last(values, n):
+    return values[max(0, len(values) - n):] if n > 0 else values[:0]
+
+
+# función para obtener qué returns son outliers (drop_outliers) con los returns anteriores de la ventana en tail
+def outliers(tail, returns, n_sigmas=3):
+    rolling = pd.Series(carry(tail, returns)).rolling(window=OUTLIER_WINDOW)
+    mu = last(rolling.mean().values, len(returns))
+    sigma = last(rolling.std().values, len(returns))
+
+    with np.errstate(invalid='ignore'):
+        return (returns > mu + n_sigmas*sigma) | (returns < mu - n_sigmas*sigma)
+
+
+# función para obtener la posición (get_position) con un umbral ya calculado
+def position(returns, mean_returns):
+    with np.errstate(invalid='ignore'):
+        return np.where(np.abs(returns) > mean_returns, (returns >= 0).astype('int'), 2)
+
+
+# Acumulador de la media de |valores| (sin NaN) y de una muestra de sus cuantiles
+class AbsoluteScan:
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self.sketch = []
+
+    def update(self, values):
+        values = np.abs(values[~np.isnan(values)])
+        if len(values) == 0:
+            return
+
+        self.total += values.sum()
+        self.count += len(values)
+        self.sketch.append(np.quantile(values, np.linspace(0, 1, SKETCH_SIZE)))
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    # límites de los tramos de valores para que cada tramo tenga unas bucket_size filas
+    def boundaries(self, bucket_size, signed=False):
+        if not self.sketch:
+            return np.empty(0)
+
+        sketch = np.concatenate(self.sketch)
+        if signed:
+            sketch = np.concatenate([-sketch, sketch])
+        n_buckets = math.ceil(self.count / bucket_size)
+
+        return np.unique(np.quantile(sketch, np.linspace(0, 1, n_buckets + 1)[1:-1]))
+
+
+# Acumulador de media y desviación típica (ddof=1) que se combina por bloques (algoritmo de Chan)
+class Moments:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+
+        count = self.count + len(values)
+        mean = values.mean()
+        delta = mean - self.mean
+        self.m2 += ((values - mean) ** 2).sum() + delta ** 2 * self.count * len(values) / count
+        self.mean += delta * len(values) / count
+        self.count = count
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+
+# Preparación de un horizonte temporal por bloques (create_price_change_vars y create_target_features)
+# sin umbrales (primera pasada) solo acumula las medias de |returns| y |future_returns|
+# con umbrales (segunda pasada) devuelve las filas de cada bloque que quedan tras las dos fases de outliers
+class ChunkedTargets:
+
+    def __init__(self, forecast_horizon, mean_returns=None, mean_future_returns=None):
+        self.forecast_horizon = forecast_horizon
+        self.mean_returns = mean_returns
+        self.mean_future_returns = mean_future_returns
+        self.scan = mean_returns is None
+
+        self.close = np.empty(0)
+        self.returns = np.empty(0)
+        self.pending = {name: np.empty(0) for name in ['close', 'volume', 'returns']}
+        self.target_returns = np.empty(0)
+
+        self.abs_returns = AbsoluteScan()
+        self.abs_future_returns = AbsoluteScan()
+
+    # función para procesar un bloque de barras; con final=True se vacían las filas pendientes (fin de la historia)
+    def update(self, close, volume, final=False):
+        fh = self.forecast_horizon
+        close = np.asarray(close, dtype='float64')
+
+        # returns (get_returns) con las últimas fh barras del bloque anterior
+        history = carry(self.close, close)
+        returns = np.full(len(close), np.nan)
+        first = max(0, fh - len(self.close))
+        if first < len(close):
+            returns[first:] = (history[len(self.close) + first:] / history[len(self.close) + first - fh:len(history) - fh] - 1) * 100
+        self.close = last(history, fh)
+
+        # primera fase de outliers con los últimos returns de la ventana
+        keep = ~outliers(self.returns, returns)
+        self.returns = last(carry(self.returns, returns), OUTLIER_WINDOW - 1)
+        if self.scan:
+            self.abs_returns.update(returns)
+
+        # future_returns de las filas sin outliers: las últimas fh esperan a las filas del bloque siguiente
+        rows = {'close': close[keep], 'volume': np.asarray(volume, dtype='float64')[keep], 'returns': returns[keep]}
+        rows = {name: carry(self.pending[name], values) for name, values in rows.items()}
+        n = len(rows['close']) if final else max(0, len(rows['close']) - fh)
+        self.pending = {name: values[n:] for name, values in rows.items()}
+        rows = {name: values[:n] for name, values in rows.items()}
+
+        rows['future_returns'] = np.full(n, np.nan)
+        resolved = min(n, len(self.pending['close']) + n - fh)
+        if resolved > 0:
+            future_close = carry(rows['close'], self.pending['close'])
+            rows['future_returns'][:resolved] = (future_close[fh:fh + resolved] / rows['close'][:resolved] - 1) * 100
+
+        if self.scan:
+            self.abs_future_returns.update(rows['future_returns'])
+            return None
+
+        # segunda fase de outliers sobre los returns de las filas que quedan
+        keep = ~outliers(self.target_returns, rows['returns'])
+        self.target_returns = last(carry(self.target_returns, rows['returns']), OUTLIER_WINDOW - 1)
+        rows = {name: values[keep] for name, values in rows.items()}
+
+        rows['bullish'] = (rows['returns'] >= 0).astype('int')
+        rows['position'] = position(rows['returns'], self.mean_returns)
+        rows['future_bullish'] = (rows['future_returns'] >= 0).astype('int')
+        rows['future_position'] = position(rows['future_returns'], self.mean_future_returns)
+
+        return rows
+
+
+# función para aplicar la recurrencia y[t] = decay * y[t-1] + gain * x[t] desde la barra start, partiendo de y[start] = seed
+def recurrence(values, seed, start, decay, gain):
+    result = np.full(values.shape, np.nan)
+    result[..., start] = seed
+    if start + 1 < values.shape[-1]:
+        zi = np.expand_dims(decay * np.asarray(seed), -1)
+        result[..., start + 1:], _ = lfilter([gain], [1, -decay], values[..., start + 1:], axis=-1, zi=zi)
+    return result
+
+
+# función para obtener el RSI a partir de las medias de ganancias y pérdidas
+def rsi_values(mean_gain, mean_loss):
+    total = mean_gain + mean_loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(np.abs(total) < 1e-8, 0.0, 100 * mean_gain / total)
+    values[np.isnan(total)] = np.nan
+    return values
+
+
+# función para obtener los periodos (fastperiod, slowperiod, signalperiod) de una combinación del MACD, como talib
+def macd_periods(combination):
+    fastperiod = combination.get('fastperiod', 12)
+    slowperiod = combination.get('slowperiod', 26)
+    signalperiod = combination.get('signalperiod', 9)
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+
+    return fastperiod, slowperiod, signalperiod
+
+
+# función para obtener los periodos (fastperiod, slowperiod) y el matype de una combinación del PPO, como talib
+def ppo_periods(combination, matype=0):
+    fastperiod = combination.get('fastperiod', 12)
+    slowperiod = combination.get('slowperiod', 26)
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+
+    combination_matype = combination.get('matype', matype)
+    if combination_matype not in (0, 1):
+        raise ValueError(f'matype no soportado: {combination_matype}')
+
+    return fastperiod, slowperiod, combination_matype
+
+
+# función para obtener el PPO a partir de las medias rápida y lenta
+def ppo_values(fast, slow):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(slow == 0, 0.0, 100 * (fast - slow) / slow)
+    values[np.isnan(slow) | np.isnan(fast)] = np.nan
+    return values
+
+
+# Recurrencia y[t] = decay * y[t-1] + gain * x[t] por bloques, iniciada en la barra start con la media de las window
+# barras que terminan en ella (como recurrence); el estado entre bloques es el último valor
+class ChunkedRecurrence:
+
+    def __init__(self, start, window, decay, gain):
+        self.start = start
+        self.window = window
+        self.decay = decay
+        self.gain = gain
+        self.offset = 0
+        self.tail = np.empty(0)
+        self.value = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        result = np.full(len(values), np.nan)
+        offset = self.offset
+        self.offset += len(values)
+
+        if self.value is None:
+            if self.offset <= self.start:
+                self.tail = last(carry(self.tail, values), self.window)
+                return result
+
+            seed_row = self.start - offset
+            seed = last(carry(self.tail, values[:seed_row + 1]), self.window).mean()
+            result[seed_row:] = recurrence(values[seed_row:], seed, 0, self.decay, self.gain)
+            self.tail = None
+        elif len(values):
+            result[:], _ = lfilter([self.gain], [1, -self.decay], values, zi=[self.decay * self.value])
+
+        if len(values):
+            self.value = result[-1]
+
+        return result
+
+
+# función para crear la recurrencia de una EMA de talib iniciada en la barra start
+def chunked_ema(timeperiod, start=None):
+    k = 2 / (timeperiod + 1)
+    return ChunkedRecurrence(timeperiod - 1 if start is None else start, timeperiod, 1 - k, k)
+
+
+# Indicadores de todos los parámetros por bloques, con el mismo formato que panel_indicator (una fila por parámetro)
+class ChunkedIndicators:
+
+    def __init__(self, params, matype=PPO_MATYPE):
+        self.parameters = {indicator: [indicator_parameters(parameter) for parameter in params[f'{indicator}_timeperiods']]
+                           for indicator in INDICATORS}
+        self.offset = 0
+        self.last_close = np.nan
+
+        # los indicadores de ventana (sma, bbands y ppo simple) se calculan sobre el bloque y las barras anteriores de su ventana
+        self.ppo = [ppo_periods(parameter, matype) for parameter in self.parameters['ppo']]
+        windows = [parameter['timeperiod'] for indicator in ['sma', 'bbands'] for parameter in self.parameters[indicator]]
+        windows += [slowperiod for _, slowperiod, ppo_matype in self.ppo if ppo_matype == 0]
+        self.window = max(windows, default=1) - 1
+        self.close = np.empty(0)
+
+        # los exponenciales arrastran el estado de sus recurrencias
+        self.rsi = [
+            (ChunkedRecurrence(p['timeperiod'], p['timeperiod'], (p['timeperiod'] - 1) / p['timeperiod'], 1 / p['timeperiod']),
+             ChunkedRecurrence(p['timeperiod'], p['timeperiod'], (p['timeperiod'] - 1) / p['timeperiod'], 1 / p['timeperiod']))
+            for p in self.parameters['rsi']
+        ]
+        self.macd = []
+        for parameter in self.parameters['macd']:
+            fastperiod, slowperiod, signalperiod = macd_periods(parameter)
+            lookback = slowperiod - 1 + signalperiod - 1
+            self.macd.append((chunked_ema(fastperiod, slowperiod - 1), chunked_ema(slowperiod, slowperiod - 1),
+                              chunked_ema(signalperiod, lookback), lookback))
+        self.ppo_ema = [(chunked_ema(fastperiod), chunked_ema(slowperiod)) if ppo_matype == 1 else None
+                        for fastperiod, slowperiod, ppo_matype in self.ppo]
+
+    # función para calcular los indicadores de un bloque de cierres (no vacío)
+    def update(self, close):
+        n = len(close)
+        rows = self.offset + np.arange(n)
+        history = carry(self.close, close)
+        self.close = last(history, self.window)
+        self.offset += n
+
+        values = {}
+        timeperiods = [parameter['timeperiod'] for parameter in self.parameters['sma']]
+        if timeperiods:
+            values['sma'] = np.stack([last(talib.SMA(history, timeperiod), n) for timeperiod in timeperiods])
+
+        timeperiods = [parameter['timeperiod'] for parameter in self.parameters['bbands']]
+        if timeperiods:
+            bands = [talib.BBANDS(history, timeperiod) for timeperiod in timeperiods]
+            values['bbands'] = tuple(np.stack([last(band[k], n) for band in bands]) for k in range(3))
+
+        if self.rsi:
+            change = np.diff(carry([self.last_close], close))
+            gains = np.maximum(change, 0)
+            losses = np.maximum(-change, 0)
+            if rows[0] == 0:
+                gains[0] = losses[0] = 0
+            values['rsi'] = np.stack([rsi_values(mean_gain.update(gains), mean_loss.update(losses)) for mean_gain, mean_loss in self.rsi])
+        self.last_close = close[-1]
+
+        if self.macd:
+            macd, signal, hist = [], [], []
+            for fast, slow, line_signal, lookback in self.macd:
+                line = fast.update(close) - slow.update(close)
+                signal.append(line_signal.update(line))
+                line[rows < lookback] = np.nan
+                macd.append(line)
+                hist.append(line - signal[-1])
+            values['macd'] = (np.stack(macd), np.stack(signal), np.stack(hist))
+
+        if self.ppo:
+            ppo = []
+            for (fastperiod, slowperiod, ppo_matype), ema in zip(self.ppo, self.ppo_ema):
+                if ppo_matype == 0:
+                    ppo.append(last(talib.PPO(history, fastperiod, slowperiod, 0), n))
+                else:
+                    fast = ema[0].update(close)
+                    slow = ema[1].update(close)
+                    fast[rows < slowperiod - 1] = np.nan
+                    ppo.append(ppo_values(fast, slow))
+            values['ppo'] = np.stack(ppo)
+
+        return values
+
+
+# Rangos de Mann-Whitney de una variable que no cabe en memoria (ordenamiento externo por tramos de valores)
+# cada fila se guarda en disco con su valor y el estado de cada celda (tabla de contingencia) en el tramo de su valor;
+# como los empates caen en el mismo tramo, los tramos se ordenan de uno en uno y los rangos se acumulan entre tramos
+# las filas con valor NaN no se guardan: solo se anota su estado, porque un NaN en una muestra da un p-value NaN
+class ExternalRanks:
+
+    def __init__(self, boundaries, n_cells, directory):
+        self.boundaries = boundaries
+        self.dtype = np.dtype([('value', 'float64'), ('state', 'uint8', (n_cells,))])
+        self.nan_states = np.zeros((n_cells, 2 ** MAX_SIGNALS), dtype='bool')
+        os.makedirs(directory, exist_ok=True)
+        self.paths = [os.path.join(directory, f'{bucket}.bin') for bucket in range(len(boundaries) + 1)]
+
+    # función para añadir las filas de un bloque (states es celdas x filas)
+    def add(self, values, states):
+        nan = np.isnan(values)
+        for cell, state in enumerate(states):
+            self.nan_states[cell, state[nan]] = True
+
+        records = np.empty((~nan).sum(), dtype=self.dtype)
+        records['value'] = values[~nan]
+        records['state'] = states[:, ~nan].T
+
+        buckets = np.searchsorted(self.boundaries, records['value'], side='right')
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.searchsorted(buckets[order], np.arange(len(self.paths) + 1))
+        for bucket in np.unique(buckets):
+            with open(self.paths[bucket], 'ab') as f:
+                f.write(records[order[bounds[bucket]:bounds[bucket + 1]]].tobytes())
+
+    # función para obtener los p-values de una lista de hipótesis (celda, región 1, región 2 o None para el complementario)
+    def p_values(self, hypotheses):
+        states = sm.SignalTable.from_counts(np.zeros((2 ** MAX_SIGNALS, 2, 3)))
+        cells = np.array([cell for cell, _, _ in hypotheses], dtype='int64')
+        masks1 = np.array([states.match(region1) for _, region1, _ in hypotheses]).reshape(len(hypotheses), -1)
+        masks2 = np.array([~mask1 if region2 is None else states.match(region2)
+                           for mask1, (_, _, region2) in zip(masks1, hypotheses)]).reshape(len(hypotheses), -1)
+
+        n1 = np.zeros(len(hypotheses))
+        n2 = np.zeros(len(hypotheses))
+        rank_sum1 = np.zeros(len(hypotheses))
+        ties = np.zeros(len(hypotheses))
+
+        for path in self.paths:
+            if not os.path.exists(path):
+                continue
+
+            records = np.fromfile(path, dtype=self.dtype)
+            records = records[np.argsort(records['value'], kind='stable')]
+            new_group = np.ones(len(records), dtype='bool')
+            new_group[1:] = records['value'][1:] != records['value'][:-1]
+            starts = np.flatnonzero(new_group)
+
+            # una hipótesis cada vez para que la memoria solo dependa del tamaño del tramo
+            for k, cell in enumerate(cells):
+                state = records['state'][:, cell]
+                count1 = np.add.reduceat(masks1[k, state], starts, dtype='int64')
+                count = count1 + np.add.reduceat(masks2[k, state], starts, dtype='int64')
+
+                # los rangos del tramo empiezan después de las observaciones de los tramos anteriores
+                ranks = (n1[k] + n2[k]) + np.cumsum(count) - count + (count + 1) / 2
+                rank_sum1[k] += (count1 * ranks).sum()
+                ties[k] += (count.astype('float') ** 3 - count).sum()
+                n1[k] += count1.sum()
+                n2[k] += (count - count1).sum()
+
+        p = np.full(len(hypotheses), np.nan)
+        nan = ((masks1 | masks2) & self.nan_states[cells]).any(axis=1)
+        valid = (n1 > 20) & (n2 > 20) & ~nan
+        if valid.any():
+            p[valid] = sm.mann_whitney_p_values(n1[valid], n2[valid], rank_sum1[valid], ties[valid])
+
+        return p
+
+
+# Métricas de un horizonte temporal por bloques (segunda pasada)
+class ChunkedHorizon:
+
+    def __init__(self, scan, params, directory, bucket_size=1_000_000):
+        self.forecast_horizon = scan.forecast_horizon
+        self.targets = ChunkedTargets(scan.forecast_horizon, scan.abs_returns.mean(), scan.abs_future_returns.mean())
+        self.indicators = ChunkedIndicators(params)
+
+        # celdas (indicador, parámetro, fila del parámetro en los indicadores) en el orden de calculate_fh_metrics
+        self.cells = [(indicator, parameter, j) for indicator in INDICATORS
+                      for j, parameter in enumerate(params[f'{indicator}_timeperiods'])]
+        self.tables = [np.zeros((2 ** N_SIGNALS[indicator], 2, 3), dtype='int64') for indicator, _, _ in self.cells]
+        self.general_table = np.zeros((2 ** 3, 2, 3), dtype='int64')
+        self.returns = Moments()
+        self.volume = Moments()
+
+        self.ranks = ExternalRanks(scan.abs_future_returns.boundaries(bucket_size, signed=True), len(self.cells),
+                                   os.path.join(directory, 'future_returns'))
+        self.general_ranks = ExternalRanks(scan.abs_returns.boundaries(bucket_size), 1, os.path.join(directory, 'returns'))
+
+    # función para procesar un bloque de barras (final=True al terminar la historia)
+    def update(self, close, volume, final=False):
+        rows = self.targets.update(close, volume, final)
+        if len(rows['close']) == 0:
+            return
+
+        self.returns.update(rows['returns'])
+        self.volume.update(rows['volume'])
+
+        table = sm.SignalTable(metrics_calculation.general_signals(rows['bullish'], rows['position']),
+                               rows['future_bullish'], rows['future_position'])
+        self.general_table += table.table
+        self.general_ranks.add(np.abs(rows['returns']), table.state[None].astype('uint8'))
+
+        values = self.indicators.update(rows['close'])
+        states = np.empty((len(self.cells), len(rows['close'])), dtype='uint8')
+        for i, (indicator, _, j) in enumerate(self.cells):
+            with np.errstate(invalid='ignore'):
+                signals = panel_signals(indicator, rows['close'], values[indicator], j)
+            table = sm.SignalTable(signals, rows['future_bullish'], rows['future_position'])
+            self.tables[i] += table.table
+            states[i] = table.state
+
+        self.ranks.add(rows['future_returns'], states)
+
+    # función para obtener las métricas del horizonte, con el mismo formato que calculate_fh_metrics
+    def metrics(self):
+        fh_metrics = {'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+
+        def append(indicator, parameter, metrics):
+            fh_metrics['indicator'] += ([indicator] * len(metrics['value']))
+            fh_metrics['parameter'] += ([parameter] * len(metrics['value']))
+            fh_metrics['metric'] += metrics['metric']
+            fh_metrics['value'] += metrics['value']
+
+        with instrumentation.stage('chunked.p_values'):
+            general_p_values = self.general_ranks.p_values([(0, region1, region2) for region1, region2 in GENERAL_HYPOTHESES])
+            hypotheses = [(i, region1, region2) for i, (indicator, _, _) in enumerate(self.cells)
+                          for region1, region2 in metrics_calculation.HYPOTHESES[indicator]]
+            p_values = self.ranks.p_values(hypotheses) if hypotheses else []
+
+        append('general', 'NA', metrics_calculation.general_table_metrics(
+            sm.SignalTable.from_counts(self.general_table), self.returns.mean if self.returns.count else np.nan,
+            self.returns.std(), self.volume.mean if self.volume.count else np.nan, list(general_p_values)))
+
+        start = 0
+        for (indicator, parameter, _), table in zip(self.cells, self.tables):
+            n_hypotheses = len(metrics_calculation.HYPOTHESES[indicator])
+            append(indicator, parameter, metrics_calculation.TABLE_METRICS[indicator](
+                sm.SignalTable.from_counts(table), list(p_values[start:start + n_hypotheses])))
+            start += n_hypotheses
+
+        return fh_metrics
+
+
+# función para obtener las métricas de un ticker por bloques, con el mismo formato que calculate_stock_metrics
+# chunks es una fuente de bloques que se pueda recorrer dos veces (FrameChunks, ParquetChunks, ...) con close y volume
+# directory es el directorio de los ficheros temporales de los p-values (el temporal del sistema por defecto)
+# bucket_size es el número aproximado de filas de cada tramo de valores que se ordena en memoria
+def calculate_chunked_metrics(chunks, params, directory=None, bucket_size=1_000_000):
+    horizons = params['forecast_horizons']
+
+    # primera pasada: umbrales de position y future_position y tramos de valores
+    scans = {fh: ChunkedTargets(fh) for fh in horizons}
+    with instrumentation.stage('chunked.scan') as stage:
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            for scan in scans.values():
+                scan.update(chunk['close'].values, chunk['volume'].values)
+        for scan in scans.values():
+            scan.update([], [], final=True)
+        stage.rows = rows
+
+    # segunda pasada: métricas de todos los horizontes a la vez
+    stock_metrics = {'forecast_horizon': [], 'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+    with tempfile.TemporaryDirectory(dir=directory) as spill:
+        chunked_horizons = {fh: ChunkedHorizon(scans[fh], params, os.path.join(spill, str(fh)), bucket_size) for fh in horizons}
+
+        with instrumentation.stage('chunked.metrics', rows):
+            for chunk in chunks:
+                for chunked_horizon in chunked_horizons.values():
+                    chunked_horizon.update(chunk['close'].values, chunk['volume'].values)
+            for chunked_horizon in chunked_horizons.values():
+                chunked_horizon.update([], [], final=True)
+
+        for fh in horizons:
+            with instrumentation.context(forecast_horizon=fh):
+                metrics_calculation.append_fh_metrics(stock_metrics, fh, chunked_horizons[fh].metrics())
+
+    return stock_metrics
+
+
+# función para crear el dataset con todas las métricas en modo por bloques (el mismo formato que explore_stocks)
+# sources es un diccionario ticker -> fuente de bloques
+def explore_chunked(sources, params, as_store=False, directory=None, bucket_size=1_000_000):
+    stocks = {}
+    for ticker, chunks in sources.items():
+        with instrumentation.context(ticker=ticker):
+            stocks[ticker] = calculate_chunked_metrics(chunks, params, directory, bucket_size)
+
+    stocks_metrics = MetricsStore(sum(len(stock_metrics['value']) for stock_metrics in stocks.values()))
+    for ticker, stock_metrics in stocks.items():
+        stocks_metrics.append_stock(ticker, stock_metrics)
+
+    if as_store:
+        return stocks_metrics
+
+    return stocks_metrics.to_legacy_frame()
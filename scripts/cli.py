@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# instante en que empieza a cargarse la línea de comandos, para medir el arranque
+START = time.perf_counter()
+
+
+# Línea de comandos para calcular el dataset de métricas sin pasar por el notebook parte3
+# python -m scripts.cli config.json [--output ...] [--executor ...] [--startup-budget ...] [--check] [--trace ...]
+# la configuración es un json o un toml con los tickers, las fechas y los parámetros de explore_stocks, p.ej.:
+#   {"tickers": ["AAPL", "MSFT"], "start_date": "2000-01-01", "end_date": null,
+#    "params": {"forecast_horizons": [1, 5], "sma_timeperiods": [20], "rsi_timeperiods": [14], "macd_timeperiods": [],
+#               "ppo_timeperiods": [], "bbands_timeperiods": [20]},
+#    "output": "data/stocks_metrics.csv", "executor": "thread", "price_cache": "data/price_cache"}
+# solo se importan módulos de la librería estándar al arrancar: pandas, talib, scipy y yfinance se importan al
+# ejecutar (y yfinance y scipy solo si hacen falta), así que validar la configuración (--check) es inmediato
+# al terminar las importaciones se informa del tiempo de arranque frente al presupuesto (--startup-budget)
+
+
+# valores por defecto de las claves opcionales de la configuración
+DEFAULTS = {
+    'end_date': None,
+    'output': 'data/stocks_metrics.csv',
+    # 'stocks' (explore_stocks) o 'sliced' (time_slices.explore_sliced, métricas por ventanas)
+    'mode': 'stocks',
+    'executor': 'serial',
+    'max_workers': None,
+    # directorio de price_cache.PriceCache (None para descargar siempre) y si se usa sin conexión
+    'price_cache': None,
+    'offline': False,
+    # fichero de metrics_checkpoint.CheckpointStore (None para no guardar checkpoints)
+    'checkpoint': None,
+    'cache_indicators': False,
+    # solo en el modo 'stocks': precios e indicadores en float32 y etiquetas en int8 (ver benchmark --lean)
+    'lean': False,
+    # solo en el modo 'stocks': None o los argumentos de resampling.Resampler (p.ej. {"n_resamples": 2000, "seed": 0})
+    # para añadir los p-values por permutación y por bootstrap por bloques
+    'resampling': None,
+    # solo en el modo 'sliced': 'yearly', 'rolling' o 'trend' y si se calculan los p-values
+    'windows': 'yearly',
+    'p_values': True,
+}
+
+# claves obligatorias de la configuración
+REQUIRED = ['tickers', 'start_date', 'params']
+
+# formatos de salida según la extensión del fichero
+OUTPUT_FORMATS = ['.csv', '.parquet', '.feather']
+
+# módulos de importación lenta que se muestran en el informe de arranque
+HEAVY_MODULES = ['pandas', 'talib', 'scipy.stats', 'scipy.signal', 'yfinance', 'pyarrow']
+
+# presupuesto de arranque por defecto (segundos hasta que se puede empezar a calcular)
+STARTUP_BUDGET = 1.0
+
+
+# función para leer la configuración de un json o un toml y completarla con los valores por defecto
+def load_config(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path) as f:
+            config = json.load(f)
+    elif extension == '.toml':
+        import tomllib
+
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        raise ValueError(f'formato de configuración desconocido: {extension}')
+
+    return validate_config({**DEFAULTS, **config})
+
+
+# función para comprobar la configuración antes de importar nada pesado
+def validate_config(config):
+    missing = [key for key in REQUIRED if key not in config]
+    if missing:
+        raise ValueError(f'faltan claves en la configuración: {", ".join(missing)}')
+
+    unknown = sorted(set(config) - set(DEFAULTS) - set(REQUIRED))
+    if unknown:
+        raise ValueError(f'claves desconocidas en la configuración: {", ".join(unknown)}')
+
+    if not config['tickers']:
+        raise ValueError('la configuración no tiene tickers')
+    if 'forecast_horizons' not in config['params']:
+        raise ValueError('faltan los forecast_horizons en params')
+    if config['mode'] not in ['stocks', 'sliced']:
+        raise ValueError(f'modo desconocido: {config["mode"]}')
+    if config['windows'] not in ['yearly', 'rolling', 'trend']:
+        raise ValueError(f'ventanas desconocidas: {config["windows"]}')
+    if config['resampling'] is not None and not isinstance(config['resampling'], dict):
+        raise ValueError('resampling debe ser None o un diccionario con los argumentos de Resampler')
+    if os.path.splitext(config['output'])[1].lower() not in OUTPUT_FORMATS:
+        raise ValueError(f'formato de salida desconocido: {config["output"]}')
+
+    # los parámetros que faltan son listas vacías (el indicador no se calcula)
+    params = dict(config['params'])
+    for indicator in ['sma', 'rsi', 'macd', 'ppo', 'bbands']:
+        params.setdefault(f'{indicator}_timeperiods', [])
+
+    return {**config, 'params': params}
+
+
+# función para obtener el informe de arranque: segundos desde START y módulos pesados ya importados
+def startup_report(budget=STARTUP_BUDGET):
+    seconds = time.perf_counter() - START
+    return {
+        'seconds': seconds,
+        'budget': budget,
+        'within_budget': seconds <= budget,
+        'modules': [module for module in HEAVY_MODULES if module in sys.modules],
+    }
+
+
+# función para escribir el informe de arranque en stderr
+def print_startup_report(report):
+    status = 'dentro del presupuesto' if report['within_budget'] else 'SUPERA el presupuesto'
+    print(f'arranque: {report["seconds"]:.2f} s ({status} de {report["budget"]:.2f} s), '
+          f'módulos cargados: {", ".join(report["modules"]) or "ninguno"}', file=sys.stderr)
+
+
+# función para importar los módulos del cálculo y obtener el informe de arranque
+def prepare(budget=STARTUP_BUDGET):
+    from . import metrics_calculation, metrics_checkpoint, price_cache
+
+    return startup_report(budget)
+
+
+# función para calcular las métricas de la configuración
+# devuelve un MetricsStore en el modo 'stocks' y un dataframe en el modo 'sliced'
+def run(config):
+    from . import metrics_calculation
+    from .metrics_checkpoint import CheckpointStore
+    from .price_cache import PriceCache
+
+    cache = PriceCache(config['price_cache'], config['offline']) if config['price_cache'] is not None else None
+
+    if config['mode'] == 'sliced':
+        from . import time_slices
+
+        windows = {
+            'yearly': time_slices.yearly_windows,
+            'rolling': time_slices.rolling_windows,
+            'trend': time_slices.trend_regime_windows,
+        }[config['windows']]
+        result = time_slices.explore_sliced(config['tickers'], config['start_date'], config['end_date'], config['params'],
+                                            windows, config['p_values'], cache)
+    else:
+        from .resampling import Resampler
+
+        checkpoint = CheckpointStore(config['checkpoint']) if config['checkpoint'] is not None else None
+        resampler = Resampler(**config['resampling']) if config['resampling'] is not None else None
+        try:
+            result = metrics_calculation.explore_stocks(
+                config['tickers'], config['start_date'], config['end_date'], config['params'], config['executor'],
+                config['max_workers'], cache, config['cache_indicators'], as_store=True, checkpoint=checkpoint,
+                lean=config['lean'], resampler=resampler)
+        finally:
+            if resampler is not None:
+                resampler.close()
+
+    return result
+
+
+# función para guardar el resultado según la extensión del fichero
+# el csv tiene el formato de data/stocks_metrics.csv (el que guarda el notebook parte3)
+def write_results(result, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    extension = os.path.splitext(path)[1].lower()
+    if hasattr(result, 'to_legacy_frame'):
+        if extension == '.csv':
+            result.to_legacy_frame().to_csv(path)
+        elif extension == '.parquet':
+            result.to_parquet(path)
+        else:
+            result.to_feather(path)
+        return
+
+    if extension == '.csv':
+        result.to_csv(path)
+        return
+
+    # los parámetros mezclan enteros, diccionarios y 'NA', así que en parquet y feather se guardan como etiquetas
+    from .metrics_store import parameter_label
+
+    result = result.assign(parameter=result['parameter'].map(parameter_label))
+    if extension == '.parquet':
+        result.to_parquet(path, index=False)
+    else:
+        result.reset_index(drop=True).to_feather(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cálculo del dataset de métricas de los indicadores a partir de una configuración')
+    parser.add_argument('config', help='fichero de configuración (.json o .toml)')
+    parser.add_argument('--output', help='fichero de resultados (.csv, .parquet o .feather), sustituye al de la configuración')
+    parser.add_argument('--executor', choices=['serial', 'thread', 'process'], help='sustituye al de la configuración')
+    parser.add_argument('--max-workers', type=int, help='sustituye al de la configuración')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET, help='segundos de arranque admitidos')
+    parser.add_argument('--strict-startup', action='store_true', help='terminar con error si el arranque supera el presupuesto')
+    parser.add_argument('--check', action='store_true', help='solo comprobar la configuración (sin importar nada pesado)')
+    parser.add_argument('--trace', help='guardar la instrumentación de las fases (.json para Chrome, .jsonl en otro caso)')
+    args = parser.parse_args(argv)
+
+    overrides = {'output': args.output, 'executor': args.executor, 'max_workers': args.max_workers}
+    try:
+        config = load_config(args.config)
+        config = validate_config({**config, **{key: value for key, value in overrides.items() if value is not None}})
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    if args.check:
+        print_startup_report(startup_report(args.startup_budget))
+        print(f'configuración correcta: {len(config["tickers"])} tickers, '
+              f'{len(config["params"]["forecast_horizons"])} horizontes, salida en {config["output"]}', file=sys.stderr)
+        return 0
+
+    if args.trace:
+        from . import instrumentation
+
+        instrumentation.enable()
+
+    report = prepare(args.startup_budget)
+    print_startup_report(report)
+    if args.strict_startup and not report['within_budget']:
+        return 2
+
+    start = time.perf_counter()
+    result = run(config)
+    write_results(result, config['output'])
+    print(f'{len(result)} métricas guardadas en {config["output"]} en {time.perf_counter() - start:.2f} s', file=sys.stderr)
+
+    if args.trace:
+        tracer = instrumentation.disable()
+        if args.trace.endswith('.json'):
+            tracer.to_chrome_trace(args.trace)
+        else:
+            tracer.to_jsonl(args.trace)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,65 +1,104 @@
-import yfinance as yf
 import numpy as np
 import pandas as pd
 import talib
 
-#Función para obtener datos de yfinance
-def get_financial_data(ticker_name, start_date, end_date=None):
+from . import instrumentation
+
+# tipos del modo lean (para tener muchos tickers en memoria): precios en float32 y etiquetas en int8
+# los returns se siguen calculando en float64 porque de ellos salen los umbrales, los outliers y los p-values
+PRICE_DTYPE = 'float32'
+LABEL_DTYPE = 'int8'
+
+#Función para descargar datos de yfinance
+# yfinance se importa al descargar (su importación es lenta y no hace falta si los precios están en la caché)
+def download_financial_data(ticker_name, start_date, end_date=None):
+    import yfinance as yf
+
     ticker = yf.Ticker(ticker_name)
     return ticker.history(start=start_date, end=end_date)
 
+#Función para obtener datos de yfinance, usando la caché local de precios si se indica (price_cache.PriceCache)
+@instrumentation.traced('fetch', rows=len)
+def get_financial_data(ticker_name, start_date, end_date=None, cache=None):
+    if cache is None:
+        return download_financial_data(ticker_name, start_date=start_date, end_date=end_date)
+
+    return cache.get(ticker_name, start_date, end_date, download_financial_data)
+
 # Función para limpiar los datos
-def clean_data(stock_prices):
+# con lean los precios se guardan en float32 y el volumen en el entero más pequeño que lo representa sin pérdida
+@instrumentation.traced('clean', rows=len)
+def clean_data(stock_prices, lean=False):
     stock_prices = stock_prices.loc[:, ['Open', 'High', 'Low', 'Close', 'Volume']]
     stock_prices.columns = ['open', 'high', 'low', 'close', 'volume']
+
+    if lean:
+        stock_prices = stock_prices.astype(dict.fromkeys(['open', 'high', 'low', 'close'], PRICE_DTYPE))
+        stock_prices['volume'] = pd.to_numeric(stock_prices.volume, downcast='integer')
+
     return stock_prices
 
 # Función para realizar la funcionalidad de esta fase y saltarla en fases posteriores
-def get_stock_prices(ticker_name, start_date, end_date=None):
-    return clean_data(get_financial_data(ticker_name, start_date=start_date, end_date=end_date))
+def get_stock_prices(ticker_name, start_date, end_date=None, cache=None, lean=False):
+    return clean_data(get_financial_data(ticker_name, start_date=start_date, end_date=end_date, cache=cache), lean)
+
+# Función para obtener la memoria que ocupa un dataframe (en bytes, con el índice), total o por columna
+def frame_memory(stock_prices, by_column=False):
+    memory = stock_prices.memory_usage(index=True, deep=True)
+    return memory if by_column else int(memory.sum())
+
+# Función para obtener los valores de una serie en float64 (talib solo admite float64; sin copia si ya lo son)
+def float64_values(series):
+    return np.asarray(series, dtype='float64')
 
 # Función para eliminar los outliers de los returns del dataframe
-def drop_outliers(stock_prices):
-    outliers = stock_prices.join(stock_prices.returns.rolling(window=21).agg(['mean', 'std']))
-    def indentify_outliers(row, n_sigmas=3):
-        x = row['returns']
-        mu = row['mean']
-        sigma = row['std']
-
-        if (x > mu + n_sigmas*sigma) | (x < mu - n_sigmas*sigma):
-            return 1
-        else:
-            return 0
-    outliers['outlier'] = outliers.apply(indentify_outliers, axis=1)
-    stock_prices = stock_prices[outliers['outlier'] == 0]
+# un return es outlier si se sale de la media +- n_sigmas desviaciones de la ventana móvil de 21 barras
+def drop_outliers(stock_prices, n_sigmas=3):
+    returns = stock_prices.returns
+    rolling = returns.rolling(window=21)
+    mu = rolling.mean()
+    sigma = rolling.std()
+
+    # las comparaciones con NaN (inicio de la serie) son falsas, así que esas filas no son outliers
+    outlier = (returns > mu + n_sigmas*sigma) | (returns < mu - n_sigmas*sigma)
+    stock_prices = stock_prices[~outlier.values]
 
     return stock_prices
 
 # Función para obtener la variable que representa el porcentaje de variación del precio en un horizonte temporal
+# los precios en float32 (modo lean) se pasan a float64 antes de calcular la variación
 def get_returns(asset_price, forecast_horizon=1):
-    return asset_price.pct_change(forecast_horizon) * 100
+    return asset_price.astype('float64').pct_change(forecast_horizon) * 100
 
 # Función para obtener la variable que indica la tendencia de los retornos del activo
-def get_bullish(returns):
-    return (returns >= 0).astype('int')
+def get_bullish(returns, dtype='int'):
+    return (returns >= 0).astype(dtype)
 
 # Función para obtener la variable que indica la posicion (long / short / stay) según los retornos
-def get_position(returns):
+# 1 (long) si el return supera en valor absoluto a la media y es positivo, 0 (short) si es negativo y 2 (stay) en otro caso
+def get_position(returns, dtype='int'):
     mean_returns = np.mean(np.abs(returns))
-    return np.array([ret >= 0 if np.abs(ret) > mean_returns else 2 for ret in returns], dtype='object').astype('int')
+    returns = np.asarray(returns, dtype='float')
+    return np.where(np.abs(returns) > mean_returns, (returns >= 0).astype('int'), 2).astype(dtype, copy=False)
 
 # Función para realizar las modificaciones de esta fase y saltarla en fases posteriores
-def create_price_change_vars(stock_prices, forecast_horizon=1):
+# con lean las etiquetas bullish y position son int8
+@instrumentation.traced('price_change_vars', rows=len)
+def create_price_change_vars(stock_prices, forecast_horizon=1, lean=False):
+    labels = LABEL_DTYPE if lean else 'int'
     stock_prices['returns'] = get_returns(stock_prices.close, forecast_horizon)
-    stock_prices['bullish'] = get_bullish(stock_prices.returns)
-    stock_prices['position'] = get_position(stock_prices.returns)
+    stock_prices['bullish'] = get_bullish(stock_prices.returns, labels)
+    stock_prices['position'] = get_position(stock_prices.returns, labels)
 
     stock_prices = drop_outliers(stock_prices)
 
     return stock_prices
 
 # Función para obtener las variables objetivo
-def create_target_features(stock_prices, forecast_horizon):
+# con lean las etiquetas future_bullish y future_position son int8 (future_close tiene el tipo de close)
+@instrumentation.traced('targets', rows=len)
+def create_target_features(stock_prices, forecast_horizon, lean=False):
+    labels = LABEL_DTYPE if lean else 'int'
 
     # crear el target precio de cierre futuro (future_close)
     stock_prices['future_close'] = stock_prices['close'].shift(-forecast_horizon)
@@ -68,10 +107,10 @@ def create_target_features(stock_prices, forecast_horizon):
     stock_prices['future_returns'] = get_returns(stock_prices.close, forecast_horizon).shift(-forecast_horizon)
 
     # crear el target tendencia futura (future_bullish)
-    stock_prices['future_bullish'] = get_bullish(stock_prices['future_returns'])
+    stock_prices['future_bullish'] = get_bullish(stock_prices['future_returns'], labels)
 
     # crear el target posicion futura (future_position)
-    stock_prices['future_position'] = get_position(stock_prices['future_returns'])
+    stock_prices['future_position'] = get_position(stock_prices['future_returns'], labels)
 
     stock_prices = drop_outliers(stock_prices)
 
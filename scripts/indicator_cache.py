@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import talib
+import talib.abstract
+
+
+# funciones de talib que calculan cada indicador a partir del precio de cierre
+INDICATORS = {
+    'sma': talib.SMA,
+    'rsi': talib.RSI,
+    'macd': talib.MACD,
+    'ppo': talib.PPO,
+    'bbands': talib.BBANDS,
+}
+
+
+# tipo de media por defecto de talib.PPO (0 = simple en versiones antiguas de talib, 1 = exponencial en las recientes)
+PPO_MATYPE = talib.abstract.Function('PPO').parameters['matype']
+
+
+# función para pasar el parámetro de un indicador (periodo o diccionario de periodos) a argumentos de talib
+def indicator_parameters(parameter):
+    if isinstance(parameter, dict):
+        return parameter
+
+    return {'timeperiod': parameter}
+
+
+# Caché de indicadores de la serie de precios de un ticker
+# cada serie se calcula una sola vez por (indicador, parámetros) y se reutiliza en todos los horizontes temporales
+# los indicadores se calculan sobre la serie completa, antes de eliminar los outliers de cada horizonte
+# se calculan en float64 y se guardan con dtype (float32 en el modo lean para ocupar la mitad)
+class IndicatorCache:
+
+    def __init__(self, close, dtype='float64'):
+        self.close = close
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._series = {}
+
+    # función para obtener un indicador (una serie o una tupla de series), alineado con index si se indica
+    def get(self, indicator, index=None, **parameters):
+        key = (indicator, tuple(sorted(parameters.items())))
+
+        if key in self._series:
+            self.hits += 1
+        else:
+            self.misses += 1
+            values = INDICATORS[indicator](self._values(), **parameters)
+            self._store(key, values)
+
+        series = self._series[key]
+        if index is None:
+            return series
+
+        if isinstance(series, tuple):
+            return tuple(s.reindex(index) for s in series)
+
+        return series.reindex(index)
+
+    # función para calcular de antemano todos los indicadores de un diccionario de parámetros
+    def warm(self, params):
+        for indicator in INDICATORS:
+            for parameter in params.get(f'{indicator}_timeperiods', []):
+                key = (indicator, tuple(sorted(indicator_parameters(parameter).items())))
+                if key not in self._series:
+                    self.get(indicator, **indicator_parameters(parameter))
+
+        return self
+
+    # precios de cierre en float64 (talib no admite float32)
+    def _values(self):
+        return np.asarray(self.close.values, dtype='float64')
+
+    # función para guardar las salidas de un indicador como series del índice de los precios
+    def _store(self, key, values):
+        if isinstance(values, tuple):
+            self._series[key] = tuple(pd.Series(v, index=self.close.index, dtype=self.dtype) for v in values)
+        else:
+            self._series[key] = pd.Series(values, index=self.close.index, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self._series)
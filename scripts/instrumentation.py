@@ -0,0 +1,225 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+# Instrumentación opcional de las fases de explore_stocks (descarga, limpieza, indicadores, métricas, ...)
+# cada fase registra su duración, el número de filas y el contexto (ticker y horizonte temporal) en el tracer activo
+# sin tracer activo las fases solo comprueban una variable global, así que el coste es despreciable
+# con executor='process' cada proceso hijo registra sus fases en un tracer propio y las devuelve con su resultado
+# (call_traced), y el proceso principal las añade a su tracer (merge)
+
+
+# tracer activo (None si la instrumentación está desactivada)
+_tracer = None
+
+# contexto de la fase actual, se propaga con el código que se ejecuta en él
+_context = contextvars.ContextVar('instrumentation_context', default={})
+
+
+# Tracer que acumula los eventos de las fases
+class Tracer:
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self._lock = threading.Lock()
+
+    # función para registrar una fase (inicio y duración en segundos de perf_counter)
+    def record(self, stage, start, duration, rows=None):
+        event = {
+            'stage': stage,
+            'start': start - self.origin,
+            'seconds': duration,
+            'rows': rows,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        event.update(_context.get())
+
+        with self._lock:
+            self.events.append(event)
+
+    # función para añadir los eventos de otro tracer (p.ej. el de un proceso hijo) con el inicio relativo a este
+    # perf_counter usa un reloj monótono del sistema, así que los inicios de distintos procesos son comparables
+    def merge(self, events, origin):
+        shift = origin - self.origin
+        with self._lock:
+            self.events.extend({**event, 'start': event['start'] + shift} for event in events)
+
+    # función para obtener el dataframe con un evento por fila
+    def to_frame(self):
+        frame = pd.DataFrame(data=self.events, columns=['stage', 'ticker', 'forecast_horizon', 'start', 'seconds', 'rows', 'pid', 'tid'])
+        return frame.astype({'rows': 'Int64', 'forecast_horizon': 'Int64'})
+
+    # función para obtener el resumen por fase, ticker y horizonte: llamadas, tiempo total y filas procesadas
+    def summary(self, by=('stage', 'ticker', 'forecast_horizon')):
+        frame = self.to_frame()
+        summary = frame.groupby(list(by), dropna=False, observed=True).agg(
+            calls=('seconds', 'size'), seconds=('seconds', 'sum'), rows=('rows', 'sum'))
+
+        return summary.sort_values('seconds', ascending=False)
+
+    # función para exportar los eventos en JSON lines (un evento por línea)
+    def to_jsonl(self, path):
+        with open(path, 'w') as f:
+            for event in self.events:
+                f.write(json.dumps(event, default=str) + '\n')
+
+    # función para exportar los eventos en el formato de traza de Chrome (chrome://tracing o Perfetto)
+    def to_chrome_trace(self, path):
+        trace_events = []
+        for event in self.events:
+            args = {key: event[key] for key in ['ticker', 'forecast_horizon', 'rows'] if event.get(key) is not None}
+            trace_events.append({
+                'name': event['stage'],
+                'cat': event['stage'].split('.')[0],
+                'ph': 'X',
+                'ts': event['start'] * 1e6,
+                'dur': event['seconds'] * 1e6,
+                'pid': event['pid'],
+                'tid': event['tid'],
+                'args': args,
+            })
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+# funciones para activar y desactivar la instrumentación
+def enable(tracer=None):
+    global _tracer
+    _tracer = tracer if tracer is not None else Tracer()
+    return _tracer
+
+
+def disable():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+# función para añadir al tracer activo los eventos de otro tracer (no hace nada con la instrumentación desactivada)
+def merge(events, origin):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.merge(events, origin)
+
+
+# Instrumentación activa dentro de un bloque with, devuelve el tracer
+class tracing:
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+
+    def __enter__(self):
+        self.previous = _tracer
+        return enable(self.tracer)
+
+    def __exit__(self, *exc):
+        global _tracer
+        _tracer = self.previous
+        return False
+
+
+# Contexto (ticker, forecast_horizon) de las fases que se ejecutan dentro de un bloque with
+class context:
+
+    def __init__(self, **values):
+        self.values = values
+
+    def __enter__(self):
+        self.token = _context.set({**_context.get(), **self.values})
+        return self
+
+    def __exit__(self, *exc):
+        _context.reset(self.token)
+        return False
+
+
+# función para ejecutar una función con un contexto, para las unidades de trabajo de los executors
+# (los hilos de un ThreadPoolExecutor no heredan el contexto del hilo que les envía el trabajo)
+def call_with_context(values, function, *args, **kwargs):
+    with context(**values):
+        return function(*args, **kwargs)
+
+
+# función para ejecutar una función con un contexto en un proceso hijo registrando sus fases en un tracer propio
+# devuelve el resultado, el origen del tracer y sus eventos (ver merge)
+def call_traced(values, function, *args, **kwargs):
+    with tracing(Tracer()) as tracer:
+        result = call_with_context(values, function, *args, **kwargs)
+    return result, tracer.origin, tracer.events
+
+
+# Fase medida con un bloque with; rows se puede indicar al crearla o asignar dentro del bloque
+class _Stage:
+
+    __slots__ = ('tracer', 'name', 'rows', 'start')
+
+    def __init__(self, tracer, name, rows):
+        self.tracer = tracer
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start, self.rows)
+        return False
+
+
+# fase que no hace nada, la que se devuelve con la instrumentación desactivada
+class _NoStage:
+
+    __slots__ = ()
+
+    rows = property(lambda self: None, lambda self, rows: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_STAGE = _NoStage()
+
+
+# función para medir un bloque como una fase
+def stage(name, rows=None):
+    tracer = _tracer
+    if tracer is None:
+        return NO_STAGE
+
+    return _Stage(tracer, name, rows)
+
+
+# decorador para medir una función como una fase; rows obtiene el número de filas a partir del resultado (p.ej. len)
+def traced(name, rows=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            tracer.record(name, start, time.perf_counter() - start, rows(result) if rows is not None else None)
+            return result
+
+        return wrapper
+
+    return decorator
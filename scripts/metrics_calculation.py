@@ -1,365 +1,660 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 import numpy as np
-import pandas as pd
 import talib
-import scipy.stats as scs
 
 from . import data_preparation
+from . import instrumentation
+from . import metrics_checkpoint
 from . import stock_metrics as sm
+from .indicator_cache import IndicatorCache
+from .metrics_store import MetricsStore
 
 
-# función para calcular las métricas de la sma
-def calculate_sma_metrics(stock_prices, sma_timeperiod):
-    stock_prices['sma'] = talib.SMA(stock_prices['close'].values, timeperiod=sma_timeperiod)
-    stock_prices['above_sma'] = (stock_prices['close'] >= stock_prices['sma']).astype('int')
+logger = logging.getLogger(__name__)
 
-    sma_metrics = {'metric': [], 'value': []}
+# ejecutores disponibles para repartir el trabajo de explore_stocks
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+
+# función para obtener los rangos de future_returns, reutilizando los del horizonte si ya están calculados
+def future_returns_ranks(stock_prices, ranks=None):
+    if ranks is None:
+        return sm.MannWhitneyRanks(stock_prices.future_returns)
+
+    return ranks
+
+
+# hipótesis de los p-values de cada indicador sobre future_returns
+# cada hipótesis es (región de la muestra 1, región de la muestra 2), con None para el complementario de la primera
+HYPOTHESES = {
+    'sma': [({0: True}, None)],
+    'rsi': [({0: True}, None), ({1: True}, None)],
+    'macd': [({0: True, 1: True}, None), ({0: False, 1: False}, None), ({0: True, 1: False}, None), ({0: False, 1: True}, None)],
+    'ppo': [({0: True}, None)],
+    # las filas sin bandas (señal 2 falsa) no entran en ninguna de las dos muestras
+    'bbands': [({0: True}, {0: False, 2: True}), ({1: True}, {1: False, 2: True})],
+}
+
+
+# función para obtener los p-values de las hipótesis de un indicador a partir de su tabla de contingencia
+# hypotheses es una lista opcional en la que se añaden las máscaras de las muestras (para remuestrearlas después)
+def table_p_values(table, indicator, stock_prices, ranks=None, hypotheses=None):
+    with instrumentation.stage(f'p_values.{indicator}', len(table.state)):
+        samples = table.samples(HYPOTHESES[indicator])
+        if hypotheses is not None:
+            hypotheses.append(samples)
+
+        return future_returns_ranks(stock_prices, ranks).p_values(*samples)
+
+
+# funciones para obtener las señales de cada indicador a partir de sus valores (series o arrays)
+# las comparaciones con NaN (inicio de la serie) son falsas
+
+# señales: 0 = precio por encima de la sma
+def sma_signals(close, sma):
+    return [close >= sma]
+
+# señales: 0 = sobrecompra, 1 = sobreventa
+def rsi_signals(rsi):
+    return [rsi >= 70, rsi <= 30]
+
+# señales: 0 = compra (histograma positivo), 1 = señal por encima de cero
+def macd_signals(macd_signal, macd_hist):
+    return [macd_hist > 0, macd_signal >= 0]
+
+# señales: 0 = ppo positivo
+def ppo_signals(ppo):
+    return [ppo >= 0]
+
+# señales: 0 = precio por encima de la banda superior, 1 = precio por debajo de la banda inferior, 2 = hay bandas
+def bbands_signals(close, bb_upperband, bb_lowerband):
+    return [close >= bb_upperband, close <= bb_lowerband, ~np.isnan(bb_upperband)]
+
+# señales: 0 = alcista, 1 = posición larga, 2 = posición corta
+def general_signals(bullish, position):
+    return [bullish == 1, position == 1, position == 0]
 
-    price_above = stock_prices.above_sma == 1
+
+# función para obtener las métricas de la sma a partir de su tabla de contingencia y de sus p-values
+def sma_table_metrics(table, p_values):
+    sma_metrics = {'metric': [], 'value': []}
 
     # calcular frecuecia relativa de above_sma
     sma_metrics['metric'].append('above_sma_pct')
-    sma_metrics['value'].append(sm.series_relative_frequence(stock_prices.above_sma))
+    sma_metrics['value'].append(table.relative_frequence({0: True}))
 
     # calcular frecuencia de la tendencia cuando está por encima de above_sma
     sma_metrics['metric'].append('above_sma_bullish_pct')
-    sma_metrics['value'].append(sm.bullish_relative_frequence(price_above, stock_prices.future_bullish))
+    sma_metrics['value'].append(table.bullish_relative_frequence({0: True}))
 
     # calcular frecuencia de la tendencia cuando está por debajo de above_sma
     sma_metrics['metric'].append('below_sma_bullish_pct')
-    sma_metrics['value'].append(sm.bullish_relative_frequence(np.logical_not(price_above), stock_prices.future_bullish))
+    sma_metrics['value'].append(table.bullish_relative_frequence({0: False}))
 
     # calcular p-value para la hipótesis de la sma
     sma_metrics['metric'].append('sma_p-value')
-    sma_metrics['value'].append(sm.p_value(
-        stock_prices.loc[price_above, 'future_returns'],
-        stock_prices.loc[np.logical_not(price_above), 'future_returns']
-    ))
+    sma_metrics['value'].append(p_values[0])
 
     return sma_metrics
 
 
-# funcion para calcular las métricas del rsi
-def calculate_rsi_metrics(stock_prices, rsi_timeperiod):
-    stock_prices['rsi'] = talib.RSI(stock_prices['close'].values, timeperiod=rsi_timeperiod)
-
+# función para obtener las métricas del rsi a partir de su tabla de contingencia y de sus p-values
+def rsi_table_metrics(table, p_values):
     rsi_metrics = {'metric': [], 'value': []}
 
-    overbought = stock_prices.rsi >= 70
-    oversold = stock_prices.rsi <= 30
-
     # calcular frecuencia relativa de sobrecompra
     rsi_metrics['metric'].append('overbought_pct')
-    rsi_metrics['value'].append(sm.series_relative_frequence(overbought))
+    rsi_metrics['value'].append(table.relative_frequence({0: True}))
 
     # calcular frecuencia de tendencia en sobrecompra
     rsi_metrics['metric'].append('overbought_bullish_pct')
-    rsi_metrics['value'].append(sm.bullish_relative_frequence(overbought, stock_prices.future_bullish))
+    rsi_metrics['value'].append(table.bullish_relative_frequence({0: True}))
 
     # calcular frecuencia relativa de sobreventa
     rsi_metrics['metric'].append('oversold_pct')
-    rsi_metrics['value'].append(sm.series_relative_frequence(oversold))
+    rsi_metrics['value'].append(table.relative_frequence({1: True}))
 
     #calcular frecuencia de tendencia en sobreventa
     rsi_metrics['metric'].append('oversold_bullish_pct')
-    rsi_metrics['value'].append(sm.bullish_relative_frequence(oversold, stock_prices.future_bullish))
+    rsi_metrics['value'].append(table.bullish_relative_frequence({1: True}))
 
     # calcular trend change accuracy
     rsi_metrics['metric'].append('trend_change_accuracy')
-    rsi_metrics['value'].append(sm.rsi_accuracy(overbought, oversold, stock_prices.future_position))
+    rsi_metrics['value'].append(table.accuracy([({0: True}, 0), ({1: True}, 1)]))
 
     # calcular p-value para la hipótesis de sobrecompra
     rsi_metrics['metric'].append('overbought_p-value')
-    rsi_metrics['value'].append(sm.p_value(
-        stock_prices.loc[overbought, 'future_returns'],
-        stock_prices.loc[np.logical_not(overbought), 'future_returns']
-    ))
+    rsi_metrics['value'].append(p_values[0])
 
     # calcular p-value para la hipótesis de sobreventa
     rsi_metrics['metric'].append('oversold_p-value')
-    rsi_metrics['value'].append(sm.p_value(
-        stock_prices.loc[oversold, 'future_returns'],
-        stock_prices.loc[np.logical_not(oversold), 'future_returns']
-    ))
+    rsi_metrics['value'].append(p_values[1])
 
     return rsi_metrics
 
 
-# funcion para calcular las métricas del macd
-def calculate_macd_metrics(stock_prices, macd_timeperiod):
-    stock_prices["macd"], stock_prices["macd_signal"], stock_prices["macd_hist"] = talib.MACD(stock_prices['close'], **macd_timeperiod)
-
+# función para obtener las métricas del macd a partir de su tabla de contingencia y de sus p-values
+def macd_table_metrics(table, p_values):
     macd_metrics = {'metric': [], 'value': []}
 
-    buy = stock_prices['macd_hist'] > 0
-    above_zero = stock_prices['macd_signal'] >= 0
-
     # calcular frecuencia de tendencia en pro-trend buy
     macd_metrics['metric'].append('pro-trend_buy_bullish_pct')
-    macd_metrics['value'].append(sm.bullish_relative_frequence(buy & above_zero, stock_prices.future_bullish))
+    macd_metrics['value'].append(table.bullish_relative_frequence({0: True, 1: True}))
 
     # calcular frecuencia de tendencia en pro-trend sell
     macd_metrics['metric'].append('pro-trend_sell_bullish_pct')
-    macd_metrics['value'].append(sm.bullish_relative_frequence(np.logical_not(buy) & np.logical_not(above_zero), stock_prices.future_bullish))
+    macd_metrics['value'].append(table.bullish_relative_frequence({0: False, 1: False}))
 
     # calcular frecuencia de tendencia en anti-trend buy
     macd_metrics['metric'].append('anti-trend_buy_bullish_pct')
-    macd_metrics['value'].append(sm.bullish_relative_frequence(buy & np.logical_not(above_zero), stock_prices.future_bullish))
+    macd_metrics['value'].append(table.bullish_relative_frequence({0: True, 1: False}))
 
     # calcular frecuencia de tendencia en anti-trend sell
     macd_metrics['metric'].append('anti-trend_sell_bullish_pct')
-    macd_metrics['value'].append(sm.bullish_relative_frequence(np.logical_not(buy) & above_zero, stock_prices.future_bullish))
+    macd_metrics['value'].append(table.bullish_relative_frequence({0: False, 1: True}))
 
     # calcular pro-trend signal accuracy
     macd_metrics['metric'].append('pro-trend_signal_accuracy')
-    macd_metrics['value'].append(sm.macd_accuracy(buy, above_zero, stock_prices.future_position))
+    macd_metrics['value'].append(table.accuracy([({0: True, 1: True}, 1), ({0: False, 1: False}, 0)]))
 
     # calcular anti-trend signal accuracy
     macd_metrics['metric'].append('anti-trend_signal_accuracy')
-    macd_metrics['value'].append(sm.macd_accuracy(buy, np.logical_not(above_zero), stock_prices.future_bullish))
+    # (se compara con future_bullish, igual que en la versión con macd_accuracy)
+    macd_metrics['value'].append(table.accuracy([({0: True, 1: False}, 1), ({0: False, 1: True}, 0)], target='bullish'))
 
     # calcular p-value para la hipótesis de pro-trend buy
     macd_metrics['metric'].append('pro-trend_buy_p-value')
-    macd_metrics['value'].append(sm.p_value(
-        stock_prices.loc[buy & above_zero, 'future_returns'],
-        stock_prices.loc[np.logical_not(buy & above_zero), 'future_returns']
-    ))
+    macd_metrics['value'].append(p_values[0])
 
     # calcular p-value para la hipótesis de pro-trend sell
     macd_metrics['metric'].append('pro-trend_sell_p-value')
-    macd_metrics['value'].append(sm.p_value(
-        stock_prices.loc[np.logical_not(buy) & np.logical_not(above_zero), 'future_returns'],
-        stock_prices.loc[np.logical_not(np.logical_not(buy) & np.logical_not(above_zero)), 'future_returns']
-    ))
+    macd_metrics['value'].append(p_values[1])
 
     # calcular p-value para la hipótesis de anti-trend buy
     macd_metrics['metric'].append('anti-trend_buy_p-value')
-    macd_metrics['value'].append(sm.p_value(
-        stock_prices.loc[buy & np.logical_not(above_zero), 'future_returns'],
-        stock_prices.loc[np.logical_not(buy & np.logical_not(above_zero)), 'future_returns']
-    ))
+    macd_metrics['value'].append(p_values[2])
 
     # calcular p-value para la hipótesis de anti-trend sell
     macd_metrics['metric'].append('anti-trend_sell_p-value')
-    macd_metrics['value'].append(sm.p_value(
-        stock_prices.loc[np.logical_not(buy) & above_zero, 'future_returns'],
-        stock_prices.loc[np.logical_not(np.logical_not(buy) & above_zero), 'future_returns']
-    ))
+    macd_metrics['value'].append(p_values[3])
 
     return macd_metrics
 
 
-# funcion para calcular las métricas del ppo
-def calculate_ppo_metrics(stock_prices, ppo_timeperiod):
-    stock_prices['ppo'] = talib.PPO(stock_prices['close'].values, **ppo_timeperiod)
-
+# función para obtener las métricas del ppo a partir de su tabla de contingencia y de sus p-values
+def ppo_table_metrics(table, p_values):
     ppo_metrics = {'metric': [], 'value': []}
 
-    positive_ppo = stock_prices.ppo >= 0
-
     # calcular porcentaje relativo del ppo positivo/negativo
     ppo_metrics['metric'].append('positive_ppo_pct')
-    ppo_metrics['value'].append(sm.series_relative_frequence(positive_ppo))
+    ppo_metrics['value'].append(table.relative_frequence({0: True}))
 
     # calcular frecuencia de la tendencia cuando el ppo es positivo
     ppo_metrics['metric'].append('positive_ppo_bullish_pct')
-    ppo_metrics['value'].append(sm.bullish_relative_frequence(positive_ppo, stock_prices.future_bullish))
+    ppo_metrics['value'].append(table.bullish_relative_frequence({0: True}))
 
     # calcular frecuencia de la tendencia cuando el ppo es negativo
     ppo_metrics['metric'].append('negative_ppo_bullish_pct')
-    ppo_metrics['value'].append(sm.bullish_relative_frequence(np.logical_not(positive_ppo), stock_prices.future_bullish))
+    ppo_metrics['value'].append(table.bullish_relative_frequence({0: False}))
 
     # calcular p-value para la hipótesis del ppo
     ppo_metrics['metric'].append('ppo_p-value')
-    ppo_metrics['value'].append(sm.p_value(
-        stock_prices.loc[positive_ppo, 'future_returns'],
-        stock_prices.loc[np.logical_not(positive_ppo), 'future_returns']
-    ))
+    ppo_metrics['value'].append(p_values[0])
 
     return ppo_metrics
 
 
-# funcion para calcular las métricas de las bbands
-def calculate_bbands_metrics(stock_prices, bbands_timeperiod):
-    stock_prices['bb_upperband'], stock_prices['bb_middleband'], stock_prices['bb_lowerband'] = talib.BBANDS(stock_prices.close, timeperiod=bbands_timeperiod)
-
+# función para obtener las métricas de las bbands a partir de su tabla de contingencia y de sus p-values
+def bbands_table_metrics(table, p_values):
     bbands_metrics = {'metric': [], 'value': []}
 
-    above_bb_upperband = stock_prices.close >= stock_prices.bb_upperband
-    below_bb_lowerband = stock_prices.close <= stock_prices.bb_lowerband
-
     # calcular frecuencia relativa del precio por encima de la banda superior
     bbands_metrics['metric'].append('above_bb_upperband_pct')
-    bbands_metrics['value'].append(sm.series_relative_frequence(above_bb_upperband))
+    bbands_metrics['value'].append(table.relative_frequence({0: True}))
 
     # calcular frecuencia de la tendencia cuando el precio está por encima de la banda superior
     bbands_metrics['metric'].append('above_bb_upperband_bullish_pct')
-    bbands_metrics['value'].append(sm.bullish_relative_frequence(above_bb_upperband, stock_prices.future_bullish))
+    bbands_metrics['value'].append(table.bullish_relative_frequence({0: True}))
 
     # calcular frecuencia relativa del precio por debajo de la banda inferior
     bbands_metrics['metric'].append('below_bb_lowerband_pct')
-    bbands_metrics['value'].append(sm.series_relative_frequence(below_bb_lowerband))
+    bbands_metrics['value'].append(table.relative_frequence({1: True}))
 
     # calcular frecuencia de la tendencia cuando el precio está por debajo de la banda inferior
     bbands_metrics['metric'].append('below_bb_lowerband_bullish_pct')
-    bbands_metrics['value'].append(sm.bullish_relative_frequence(below_bb_lowerband, stock_prices.future_bullish))
+    bbands_metrics['value'].append(table.bullish_relative_frequence({1: True}))
 
     # calcular p-value para la hipótesis de las bbands
     bbands_metrics['metric'].append('above_bb_upperband_p-value')
-    bbands_metrics['value'].append(sm.p_value(
-        stock_prices.loc[above_bb_upperband, 'future_returns'],
-        stock_prices.loc[stock_prices.close < stock_prices.bb_upperband, 'future_returns']
-    ))
+    bbands_metrics['value'].append(p_values[0])
 
     bbands_metrics['metric'].append('below_bb_lowerband_p-value')
-    bbands_metrics['value'].append(sm.p_value(
-        stock_prices.loc[below_bb_lowerband, 'future_returns'],
-        stock_prices.loc[stock_prices.close > stock_prices.bb_lowerband, 'future_returns']
-    ))
+    bbands_metrics['value'].append(p_values[1])
 
     return bbands_metrics
 
-# función para calcular las métricas de un horizonte temporal
-def calculate_fh_metrics(stock_prices, forecast_horizon, params):
-    stock_prices = data_preparation.create_price_change_vars(stock_prices, forecast_horizon)
-    stock_prices = data_preparation.create_target_features(stock_prices, forecast_horizon)
 
-    fh_metrics = {'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+# función para obtener las métricas generales a partir de la tabla de tendencia y posición y de los estadísticos de returns
+def general_table_metrics(table, mean_returns, volatility, mean_volume, p_values):
+    general_metrics = {'metric': [], 'value': []}
 
     # calcular el porcentaje alcista-bajista
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('bullish_pct')
-    fh_metrics['value'].append(sm.series_relative_frequence(stock_prices.bullish))
-
-    position_frequence = stock_prices.position.value_counts() / len(stock_prices.position)
+    general_metrics['metric'].append('bullish_pct')
+    general_metrics['value'].append(table.relative_frequence({0: True}))
 
     # calcular el porcentaje de posiciones largas
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('long_pct')
-    fh_metrics['value'].append(position_frequence[1])
+    general_metrics['metric'].append('long_pct')
+    general_metrics['value'].append(table.relative_frequence({1: True}))
 
     # calcular el porcentaje de posiciones cortas
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('short_pct')
-    fh_metrics['value'].append(position_frequence[0])
+    general_metrics['metric'].append('short_pct')
+    general_metrics['value'].append(table.relative_frequence({2: True}))
 
     # calcular retornos medios
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('mean_returns')
-    fh_metrics['value'].append(stock_prices.returns.mean())
+    general_metrics['metric'].append('mean_returns')
+    general_metrics['value'].append(mean_returns)
 
     # calcular volatilidad media
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('volatility')
-    fh_metrics['value'].append(stock_prices.returns.std())
+    general_metrics['metric'].append('volatility')
+    general_metrics['value'].append(volatility)
 
     # calcular volumen medio
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('mean_volume')
-    fh_metrics['value'].append(stock_prices.volume.mean())
+    general_metrics['metric'].append('mean_volume')
+    general_metrics['value'].append(mean_volume)
 
     # calcular p-value para la hipótesis de la diferencia de retornos según tendencia
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('trend_p-value')
-    fh_metrics['value'].append(sm.p_value(
-        stock_prices.loc[stock_prices.bullish == 1, 'returns'],
-        np.abs(stock_prices.loc[stock_prices.bullish == 0, 'returns'])
-    ))
+    general_metrics['metric'].append('trend_p-value')
+    general_metrics['value'].append(p_values[0])
 
     # calcular p-value para la hipótesis de diferencia de retornos según posición
-    fh_metrics['indicator'].append('general')
-    fh_metrics['parameter'].append('NA')
-    fh_metrics['metric'].append('position_p-value')
-    fh_metrics['value'].append(sm.p_value(
-        stock_prices.loc[stock_prices.position == 1, 'returns'],
-        np.abs(stock_prices.loc[stock_prices.position == 0, 'returns'])
-    ))
-
-    # calcular las métricas de cada SMA
-    for sma_timeperiod in params['sma_timeperiods']:
-        sma_metrics = calculate_sma_metrics(stock_prices, sma_timeperiod)
-
-        fh_metrics['indicator'] += (['sma'] * len(sma_metrics['value']))
-        fh_metrics['parameter'] += ([sma_timeperiod] * len(sma_metrics['value']))
-        fh_metrics['metric'] += sma_metrics['metric']
-        fh_metrics['value'] += sma_metrics['value']
-
-    # calcular las métricas de cada RSI
-    for rsi_timeperiod in params['rsi_timeperiods']:
-        rsi_metrics = calculate_rsi_metrics(stock_prices, rsi_timeperiod)
-
-        fh_metrics['indicator'] += (['rsi'] * len(rsi_metrics['value']))
-        fh_metrics['parameter'] += ([rsi_timeperiod] * len(rsi_metrics['value']))
-        fh_metrics['metric'] += rsi_metrics['metric']
-        fh_metrics['value'] += rsi_metrics['value']
-
-    # calcular las métricas de cada MACD
-    for macd_timeperiod in params['macd_timeperiods']:
-        macd_metrics = calculate_macd_metrics(stock_prices, macd_timeperiod)
-        #f'{macd_timeperiod["fastperiod"]}-{macd_timeperiod["slowperiod"]}-{macd_timeperiod["signalperiod"]}'
-
-        fh_metrics['indicator'] += (['macd'] * len(macd_metrics['value']))
-        fh_metrics['parameter'] += ([macd_timeperiod] * len(macd_metrics['value']))
-        fh_metrics['metric'] += macd_metrics['metric']
-        fh_metrics['value'] += macd_metrics['value']
-
-    # calcular las métricas de cada PPO
-    for ppo_timeperiod in params['ppo_timeperiods']:
-        ppo_metrics = calculate_ppo_metrics(stock_prices, ppo_timeperiod)
-        #f'{ppo_timeperiod["fastperiod"]}-{ppo_timeperiod["slowperiod"]}'
-
-        fh_metrics['indicator'] += (['ppo'] * len(ppo_metrics['value']))
-        fh_metrics['parameter'] += ([ppo_timeperiod] * len(ppo_metrics['value']))
-        fh_metrics['metric'] += ppo_metrics['metric']
-        fh_metrics['value'] += ppo_metrics['value']
-
-    # calcular las métricas de cada BBands
-    for bbands_timeperiod in params['bbands_timeperiods']:
-        bbands_metrics = calculate_bbands_metrics(stock_prices, bbands_timeperiod)
-
-        fh_metrics['indicator'] += (['bbands'] * len(bbands_metrics['value']))
-        fh_metrics['parameter'] += ([bbands_timeperiod] * len(bbands_metrics['value']))
-        fh_metrics['metric'] += bbands_metrics['metric']
-        fh_metrics['value'] += bbands_metrics['value']
+    general_metrics['metric'].append('position_p-value')
+    general_metrics['value'].append(p_values[1])
+
+    return general_metrics
+
+
+# funciones que obtienen las métricas de cada indicador a partir de su tabla de contingencia y de sus p-values
+TABLE_METRICS = {
+    'sma': sma_table_metrics,
+    'rsi': rsi_table_metrics,
+    'macd': macd_table_metrics,
+    'ppo': ppo_table_metrics,
+    'bbands': bbands_table_metrics,
+}
+
+
+# función para calcular las métricas de la sma
+# indicators es una IndicatorCache opcional de la que se toman los indicadores en lugar de calcularlos con talib
+# ranks es un stock_metrics.MannWhitneyRanks de future_returns compartido por todos los indicadores del horizonte
+# con lean los indicadores son temporales y no se añaden como columnas al dataframe
+# hypotheses es una lista opcional en la que se añaden las máscaras de las muestras de los p-values (ver table_p_values)
+def calculate_sma_metrics(stock_prices, sma_timeperiod, indicators=None, ranks=None, lean=False, hypotheses=None):
+    with instrumentation.stage('indicator.sma', len(stock_prices)):
+        if indicators is None:
+            sma = talib.SMA(data_preparation.float64_values(stock_prices['close']), timeperiod=sma_timeperiod)
+        else:
+            sma = indicators.get('sma', stock_prices.index, timeperiod=sma_timeperiod)
+    if not lean:
+        stock_prices['sma'] = sma
+        stock_prices['above_sma'] = (stock_prices['close'] >= stock_prices['sma']).astype('int')
+
+    with instrumentation.stage('metrics.sma', len(stock_prices)):
+        table = sm.SignalTable(sma_signals(stock_prices.close, sma), stock_prices.future_bullish, stock_prices.future_position)
+
+    return sma_table_metrics(table, table_p_values(table, 'sma', stock_prices, ranks, hypotheses))
+
+
+# funcion para calcular las métricas del rsi
+def calculate_rsi_metrics(stock_prices, rsi_timeperiod, indicators=None, ranks=None, lean=False, hypotheses=None):
+    with instrumentation.stage('indicator.rsi', len(stock_prices)):
+        if indicators is None:
+            rsi = talib.RSI(data_preparation.float64_values(stock_prices['close']), timeperiod=rsi_timeperiod)
+        else:
+            rsi = indicators.get('rsi', stock_prices.index, timeperiod=rsi_timeperiod)
+    if not lean:
+        stock_prices['rsi'] = rsi
+
+    with instrumentation.stage('metrics.rsi', len(stock_prices)):
+        table = sm.SignalTable(rsi_signals(rsi), stock_prices.future_bullish, stock_prices.future_position)
+
+    return rsi_table_metrics(table, table_p_values(table, 'rsi', stock_prices, ranks, hypotheses))
+
+
+# funcion para calcular las métricas del macd
+def calculate_macd_metrics(stock_prices, macd_timeperiod, indicators=None, ranks=None, lean=False, hypotheses=None):
+    with instrumentation.stage('indicator.macd', len(stock_prices)):
+        if indicators is None:
+            macd, macd_signal, macd_hist = talib.MACD(data_preparation.float64_values(stock_prices['close']), **macd_timeperiod)
+        else:
+            macd, macd_signal, macd_hist = indicators.get('macd', stock_prices.index, **macd_timeperiod)
+    if not lean:
+        stock_prices["macd"], stock_prices["macd_signal"], stock_prices["macd_hist"] = macd, macd_signal, macd_hist
+
+    with instrumentation.stage('metrics.macd', len(stock_prices)):
+        table = sm.SignalTable(macd_signals(macd_signal, macd_hist), stock_prices.future_bullish, stock_prices.future_position)
+
+    return macd_table_metrics(table, table_p_values(table, 'macd', stock_prices, ranks, hypotheses))
+
+
+# funcion para calcular las métricas del ppo
+def calculate_ppo_metrics(stock_prices, ppo_timeperiod, indicators=None, ranks=None, lean=False, hypotheses=None):
+    with instrumentation.stage('indicator.ppo', len(stock_prices)):
+        if indicators is None:
+            ppo = talib.PPO(data_preparation.float64_values(stock_prices['close']), **ppo_timeperiod)
+        else:
+            ppo = indicators.get('ppo', stock_prices.index, **ppo_timeperiod)
+    if not lean:
+        stock_prices['ppo'] = ppo
+
+    with instrumentation.stage('metrics.ppo', len(stock_prices)):
+        table = sm.SignalTable(ppo_signals(ppo), stock_prices.future_bullish, stock_prices.future_position)
+
+    return ppo_table_metrics(table, table_p_values(table, 'ppo', stock_prices, ranks, hypotheses))
+
+
+# funcion para calcular las métricas de las bbands
+def calculate_bbands_metrics(stock_prices, bbands_timeperiod, indicators=None, ranks=None, lean=False, hypotheses=None):
+    with instrumentation.stage('indicator.bbands', len(stock_prices)):
+        if indicators is None:
+            bb_upperband, bb_middleband, bb_lowerband = talib.BBANDS(data_preparation.float64_values(stock_prices.close), timeperiod=bbands_timeperiod)
+        else:
+            bb_upperband, bb_middleband, bb_lowerband = indicators.get('bbands', stock_prices.index, timeperiod=bbands_timeperiod)
+    if not lean:
+        stock_prices['bb_upperband'], stock_prices['bb_middleband'], stock_prices['bb_lowerband'] = bb_upperband, bb_middleband, bb_lowerband
+
+    with instrumentation.stage('metrics.bbands', len(stock_prices)):
+        table = sm.SignalTable(bbands_signals(stock_prices.close, bb_upperband, bb_lowerband),
+                               stock_prices.future_bullish, stock_prices.future_position)
+
+    return bbands_table_metrics(table, table_p_values(table, 'bbands', stock_prices, ranks, hypotheses))
+
+# funciones que calculan las métricas de cada parámetro de un indicador, en el orden en que aparecen en el resultado
+CALCULATE_METRICS = {
+    'sma': calculate_sma_metrics,
+    'rsi': calculate_rsi_metrics,
+    'macd': calculate_macd_metrics,
+    'ppo': calculate_ppo_metrics,
+    'bbands': calculate_bbands_metrics,
+}
+
+
+# función para obtener los p-values generales a partir de returns, bullish y position (series o arrays)
+def general_p_values(returns, bullish, position):
+    return [
+        # hipótesis de la diferencia de retornos según tendencia
+        sm.p_value(returns[bullish == 1], np.abs(returns[bullish == 0])),
+        # hipótesis de la diferencia de retornos según posición
+        sm.p_value(returns[position == 1], np.abs(returns[position == 0])),
+    ]
+
+
+# función para calcular las métricas generales de un horizonte temporal
+# en hypotheses se añaden las máscaras de las muestras de sus p-values, que son de |returns| (ver general_p_values)
+def calculate_general_metrics(stock_prices, hypotheses=None):
+    with instrumentation.stage('metrics.general', len(stock_prices)):
+        table = sm.SignalTable(general_signals(stock_prices.bullish, stock_prices.position),
+                               stock_prices.future_bullish, stock_prices.future_position)
+
+    with instrumentation.stage('p_values.general', len(stock_prices)):
+        p_values = general_p_values(stock_prices.returns, stock_prices.bullish, stock_prices.position)
+        if hypotheses is not None:
+            bullish, position = stock_prices.bullish.values, stock_prices.position.values
+            hypotheses.append((np.array([bullish == 1, position == 1]), np.array([bullish == 0, position == 0])))
+
+    return general_table_metrics(
+        table, stock_prices.returns.mean(), stock_prices.returns.std(), stock_prices.volume.mean(), p_values)
+
+
+# función para añadir a las métricas de las celdas los p-values por remuestreo de sus hipótesis
+# hypotheses tiene las máscaras de las muestras de cada celda calculada; todas las hipótesis de los indicadores se
+# remuestrean a la vez sobre future_returns y las generales sobre |returns|
+# cada métrica X_p-value tiene X_permutation_p-value y X_bootstrap_p-value al final de las métricas de su celda
+def append_resampled_p_values(results, hypotheses, cells, stock_prices, forecast_horizon, resampler, digest):
+    general = [i for i in hypotheses if cells[i][0] == 'general']
+    others = [i for i in hypotheses if cells[i][0] != 'general']
+
+    for name, values, members in [('general', np.abs(stock_prices.returns.values), general),
+                                  ('indicators', stock_prices.future_returns.values, others)]:
+        if not members:
+            continue
+
+        with instrumentation.stage(f'resampling.{name}', len(stock_prices)):
+            test = resampler.test(values, forecast_horizon, digest, name)
+            permutation, bootstrap = test.p_values(np.concatenate([hypotheses[i][0] for i in members]),
+                                                   np.concatenate([hypotheses[i][1] for i in members]))
+
+        start = 0
+        for i in members:
+            prefixes = [metric[:-len('p-value')] for metric in results[i]['metric'] if metric.endswith('_p-value')]
+            end = start + len(prefixes)
+            results[i]['metric'] += ([f'{prefix}permutation_p-value' for prefix in prefixes] +
+                                  [f'{prefix}bootstrap_p-value' for prefix in prefixes])
+            results[i]['value'] += permutation[start:end].tolist() + bootstrap[start:end].tolist()
+            start = end
+
+
+# función para calcular las métricas de un horizonte temporal
+# con checkpoint (metrics_checkpoint.CheckpointStore) las celdas (indicador, parámetro) ya guardadas no se calculan
+# y las que faltan se guardan según se terminan
+# con resampler (resampling.Resampler) se añaden los p-values por permutación y por bootstrap por bloques de cada
+# hipótesis; las celdas se guardan en el checkpoint al terminar el horizonte, cuando ya los tienen
+def calculate_fh_metrics(stock_prices, forecast_horizon, params, indicators=None, checkpoint=None, lean=False, resampler=None):
+    cells = [('general', 'NA')] + [(indicator, parameter) for indicator in CALCULATE_METRICS
+                                   for parameter in params[f'{indicator}_timeperiods']]
+    results = {}
+
+    if checkpoint is not None or resampler is not None:
+        digest = metrics_checkpoint.price_digest(stock_prices)
+
+    if checkpoint is not None:
+        mode = ['series' if indicators is not None else 'horizon'] + (['lean'] if lean else [])
+        if resampler is not None:
+            mode += resampler.mode()
+        keys = [metrics_checkpoint.cell_key(digest, forecast_horizon, indicator, parameter, mode) for indicator, parameter in cells]
+        with instrumentation.stage('checkpoint.get', len(cells)):
+            stored = checkpoint.get_many(keys)
+        results = {i: stored[key] for i, key in enumerate(keys) if key in stored}
+
+    missing = [i for i in range(len(cells)) if i not in results]
+    if missing:
+        stock_prices = data_preparation.create_price_change_vars(stock_prices, forecast_horizon, lean)
+        stock_prices = data_preparation.create_target_features(stock_prices, forecast_horizon, lean)
+
+        # future_returns se ordena una sola vez para todos los p-values del horizonte
+        with instrumentation.stage('ranks', len(stock_prices)):
+            ranks = sm.MannWhitneyRanks(stock_prices.future_returns)
+
+    hypotheses = {}
+    for i in missing:
+        indicator, parameter = cells[i]
+        cell_hypotheses = [] if resampler is not None else None
+        if indicator == 'general':
+            results[i] = calculate_general_metrics(stock_prices, cell_hypotheses)
+        else:
+            results[i] = CALCULATE_METRICS[indicator](stock_prices, parameter, indicators, ranks, lean, cell_hypotheses)
+
+        if resampler is not None:
+            hypotheses[i] = cell_hypotheses[0]
+        elif checkpoint is not None:
+            with instrumentation.stage('checkpoint.put'):
+                checkpoint.put(keys[i], results[i])
+
+    if hypotheses:
+        append_resampled_p_values(results, hypotheses, cells, stock_prices, forecast_horizon, resampler, digest)
+
+        if checkpoint is not None:
+            for i in missing:
+                with instrumentation.stage('checkpoint.put'):
+                    checkpoint.put(keys[i], results[i])
+
+    fh_metrics = {'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+    for i, (indicator, parameter) in enumerate(cells):
+        fh_metrics['indicator'] += ([indicator] * len(results[i]['value']))
+        fh_metrics['parameter'] += ([parameter] * len(results[i]['value']))
+        fh_metrics['metric'] += results[i]['metric']
+        fh_metrics['value'] += results[i]['value']
 
     return fh_metrics
 
 
+# función para obtener el tipo de los indicadores guardados en una IndicatorCache (float32 en el modo lean)
+def indicator_dtype(lean=False):
+    return data_preparation.PRICE_DTYPE if lean else 'float64'
+
+
 # función para obtener las métricas de un stock
-def calculate_stock_metrics(ticker, start_date, end_date, params):
-    stock_prices = data_preparation.get_stock_prices(ticker, start_date, end_date)
+# con cache_indicators los indicadores se calculan una vez sobre la serie completa y se reutilizan en cada horizonte
+# con lean los precios y los indicadores guardados son float32, las etiquetas int8 y los indicadores no se añaden al dataframe
+def calculate_stock_metrics(ticker, start_date, end_date, params, cache=None, cache_indicators=False, checkpoint=None,
+                            lean=False, resampler=None):
+    stock_prices = data_preparation.get_stock_prices(ticker, start_date, end_date, cache, lean)
+
+    indicators = IndicatorCache(stock_prices.close, indicator_dtype(lean)).warm(params) if cache_indicators else None
 
     stock_metrics = {'forecast_horizon': [], 'indicator': [], 'parameter': [], 'metric': [], 'value': []}
 
     for fh in params['forecast_horizons']:
-        fh_metrics = calculate_fh_metrics(stock_prices, fh, params)
+        with instrumentation.context(forecast_horizon=fh):
+            fh_metrics = calculate_fh_metrics(stock_prices, fh, params, indicators, checkpoint, lean, resampler)
+        append_fh_metrics(stock_metrics, fh, fh_metrics)
 
-        stock_metrics['forecast_horizon'] += ([fh] * len(fh_metrics['value']))
-        stock_metrics['indicator'] += fh_metrics['indicator']
-        stock_metrics['parameter'] += fh_metrics['parameter']
-        stock_metrics['metric'] += fh_metrics['metric']
-        stock_metrics['value'] += fh_metrics['value']
+    if indicators is not None:
+        logger.debug('Caché de indicadores de %s: %d aciertos, %d fallos', ticker, indicators.hits, indicators.misses)
 
     return stock_metrics
 
-# función para crear el dataset con todas las métricas
-def explore_stocks(tickers, start_date, end_date, params):
-    stocks_metrics = {'ticker': [], 'forecast_horizon': [], 'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+# función para añadir las métricas de un horizonte temporal a las de un stock
+def append_fh_metrics(stock_metrics, forecast_horizon, fh_metrics):
+    stock_metrics['forecast_horizon'] += ([forecast_horizon] * len(fh_metrics['value']))
+    stock_metrics['indicator'] += fh_metrics['indicator']
+    stock_metrics['parameter'] += fh_metrics['parameter']
+    stock_metrics['metric'] += fh_metrics['metric']
+    stock_metrics['value'] += fh_metrics['value']
+
+    return stock_metrics
+
+
+# función para calcular las métricas de todos los stocks de forma secuencial
+def explore_stocks_serial(tickers, start_date, end_date, params, cache=None, cache_indicators=False, checkpoint=None,
+                          lean=False, resampler=None):
+    stocks = {}
 
     for ticker in tickers:
-        stock_metrics = calculate_stock_metrics(ticker, start_date, end_date, params)
+        try:
+            with instrumentation.context(ticker=ticker):
+                stocks[ticker] = calculate_stock_metrics(ticker, start_date, end_date, params, cache, cache_indicators,
+                                                             checkpoint, lean, resampler)
+        except Exception:
+            logger.exception('No se han podido calcular las métricas de %s', ticker)
+
+    return stocks
+
+
+# función para calcular las métricas de un horizonte en un proceso hijo y devolver también los aciertos y fallos de su
+# copia del checkpoint, que el proceso principal suma a los suyos
+def calculate_fh_metrics_counted(stock_prices, forecast_horizon, params, indicators, checkpoint, lean, resampler):
+    hits, misses = checkpoint.hits, checkpoint.misses
+    fh_metrics = calculate_fh_metrics(stock_prices, forecast_horizon, params, indicators, checkpoint, lean, resampler)
+    return fh_metrics, checkpoint.hits - hits, checkpoint.misses - misses
+
+
+# función para calcular las métricas de todos los stocks repartiendo cada (ticker, horizonte) entre varios workers
+def explore_stocks_parallel(tickers, start_date, end_date, params, executor='thread', max_workers=None, cache=None,
+                            cache_indicators=False, checkpoint=None, lean=False, resampler=None):
+    prices = {}
+    failed = set()
+
+    # la descarga de precios es I/O, así que siempre se hace con hilos en el proceso principal
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            ticker: pool.submit(instrumentation.call_with_context, {'ticker': ticker},
+                                data_preparation.get_stock_prices, ticker, start_date, end_date, cache, lean)
+            for ticker in tickers
+        }
+        for ticker, future in futures.items():
+            try:
+                prices[ticker] = future.result()
+            except Exception:
+                logger.exception('No se han podido obtener los precios de %s', ticker)
+                failed.add(ticker)
+
+    # los indicadores de cada ticker se calculan antes de repartir el trabajo para compartirlos entre horizontes
+    indicators = {ticker: IndicatorCache(prices[ticker].close, indicator_dtype(lean)).warm(params) if cache_indicators else None
+                  for ticker in prices}
+
+    # cada unidad de trabajo recibe su propia copia porque calculate_fh_metrics modifica el dataframe
+    # con procesos cada unidad recibe también una copia del checkpoint, así que sus aciertos y fallos se devuelven aparte
+    # y, con la instrumentación activada, las fases que registra en su propio tracer
+    counted = executor == 'process' and checkpoint is not None
+    traced = executor == 'process' and instrumentation.enabled()
+    function = calculate_fh_metrics_counted if counted else calculate_fh_metrics
+    call = instrumentation.call_traced if traced else instrumentation.call_with_context
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        futures = {
+            (ticker, fh): pool.submit(call, {'ticker': ticker, 'forecast_horizon': fh},
+                                      function, prices[ticker].copy(), fh, params, indicators[ticker], checkpoint,
+                                      lean, resampler)
+            for ticker in prices for fh in params['forecast_horizons']
+        }
+
+        stocks = {}
+        for ticker in prices:
+            stock_metrics = {'forecast_horizon': [], 'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+            for fh in params['forecast_horizons']:
+                try:
+                    fh_metrics = futures[(ticker, fh)].result()
+                    if traced:
+                        fh_metrics, origin, events = fh_metrics
+                        instrumentation.merge(events, origin)
+                    if counted:
+                        fh_metrics, hits, misses = fh_metrics
+                        checkpoint.hits += hits
+                        checkpoint.misses += misses
+                    append_fh_metrics(stock_metrics, fh, fh_metrics)
+                except Exception:
+                    logger.exception('No se han podido calcular las métricas de %s con horizonte %s', ticker, fh)
+                    failed.add(ticker)
+            if ticker not in failed:
+                stocks[ticker] = stock_metrics
+
+    return stocks
 
-        stocks_metrics['ticker'] += ([ticker] * len(stock_metrics['value']))
-        stocks_metrics['forecast_horizon'] += stock_metrics['forecast_horizon']
-        stocks_metrics['indicator'] += stock_metrics['indicator']
-        stocks_metrics['parameter'] += stock_metrics['parameter']
-        stocks_metrics['metric'] += stock_metrics['metric']
-        stocks_metrics['value'] += stock_metrics['value']
 
-    return pd.DataFrame(data=stocks_metrics)
+# función para crear el dataset con todas las métricas
+# executor puede ser 'serial', 'thread' o 'process'; el resultado es el mismo en los tres casos
+# los tickers que fallan se omiten del resultado en lugar de detener la exploración
+# cache es una price_cache.PriceCache opcional para no volver a descargar los precios
+# cache_indicators calcula los indicadores una vez por ticker sobre la serie completa (ver calculate_stock_metrics)
+# con as_store se devuelve un metrics_store.MetricsStore tipado en lugar del dataframe
+# las fases se registran en el tracer de instrumentation si está activado (instrumentation.tracing())
+# checkpoint es un metrics_checkpoint.CheckpointStore opcional: cada celda se guarda al terminarse y las que ya están
+# guardadas con los mismos precios y parámetros no se recalculan, así que una ejecución interrumpida se puede retomar
+# lean reduce la memoria de cada dataframe (precios e indicadores guardados en float32, etiquetas en int8, indicadores
+# temporales); las métricas pueden variar hasta 0.01 por el redondeo, ver benchmark.lean_memory y test_metrics_calculation
+# resampler es un resampling.Resampler opcional que añade los p-values por permutación y por bootstrap por bloques
+# (métricas X_permutation_p-value y X_bootstrap_p-value de cada X_p-value)
+def explore_stocks(tickers, start_date, end_date, params, executor='serial', max_workers=None, cache=None,
+                   cache_indicators=False, as_store=False, checkpoint=None, lean=False, resampler=None):
+    if executor == 'serial':
+        stocks = explore_stocks_serial(tickers, start_date, end_date, params, cache, cache_indicators, checkpoint, lean,
+                                       resampler)
+    elif executor in EXECUTORS:
+        stocks = explore_stocks_parallel(tickers, start_date, end_date, params, executor, max_workers, cache,
+                                         cache_indicators, checkpoint, lean, resampler)
+    else:
+        raise ValueError(f'executor desconocido: {executor}')
+
+    with instrumentation.stage('assembly') as stage:
+        stocks_metrics = MetricsStore(sum(len(stock_metrics['value']) for stock_metrics in stocks.values()))
+
+        for ticker in tickers:
+            if ticker in stocks:
+                stocks_metrics.append_stock(ticker, stocks[ticker])
+
+        stage.rows = len(stocks_metrics)
+        if as_store:
+            return stocks_metrics
+
+        return stocks_metrics.to_legacy_frame()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+# Checkpoint de las métricas de explore_stocks en una base de datos sqlite local
+# cada celda (ticker, horizonte, indicador, parámetro) se guarda con una clave que es el hash de los precios de los que
+# sale (índice, close y volume), del horizonte, del indicador, del parámetro y del modo de cálculo de los indicadores
+# las celdas se guardan según se terminan, así que una ejecución interrumpida se retoma sin repetir lo ya calculado,
+# y al cambiar un parámetro o los precios de un ticker solo se calculan las celdas nuevas
+# el tamaño de las celdas guardadas está acotado por max_size: al superarlo se eliminan las menos usadas recientemente
+
+
+# versión del cálculo de las métricas; al cambiarla se invalidan todas las celdas guardadas
+CHECKPOINT_VERSION = 1
+
+# número máximo de claves por consulta (límite de variables de sqlite)
+QUERY_SIZE = 500
+
+
+# función para obtener el hash de los precios de un ticker (las columnas de las que dependen las métricas)
+def price_digest(stock_prices):
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(stock_prices.index.asi8).tobytes())
+    for column in ['close', 'volume']:
+        digest.update(np.ascontiguousarray(stock_prices[column].values, dtype='float64').tobytes())
+
+    return digest.hexdigest()
+
+
+# función para obtener la clave de una celda
+# mode identifica cómo se calculan los indicadores (sobre la serie completa o la del horizonte, y si es lean)
+def cell_key(digest, forecast_horizon, indicator, parameter, mode):
+    cell = [CHECKPOINT_VERSION, digest, int(forecast_horizon), indicator, parameter, mode]
+    return hashlib.sha256(json.dumps(cell, sort_keys=True).encode()).hexdigest()
+
+
+# Almacén de celdas de métricas
+# cada hilo (y cada proceso de un ProcessPoolExecutor) abre su propia conexión; sqlite serializa las escrituras
+# hits y misses cuentan las celdas leídas y no encontradas en este proceso; explore_stocks con executor='process'
+# les suma las de las copias de los procesos hijos
+class CheckpointStore:
+
+    def __init__(self, path='data/metrics_checkpoint.sqlite', max_size=256 * 2**20, timeout=60):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS cells '
+                           '(key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS cells_last_used ON cells (last_used)')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        connection.execute("INSERT OR IGNORE INTO meta VALUES ('size', 0)")
+
+        # el almacén puede venir de una ejecución con un max_size mayor
+        connection.execute('BEGIN IMMEDIATE')
+        self._evict(connection)
+        connection.execute('COMMIT')
+
+    # las conexiones no se copian al enviar el almacén a otro proceso
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    # conexión del hilo actual (en modo autocommit, las transacciones se abren explícitamente)
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+
+        return connection
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM cells').fetchone()[0]
+
+    # tamaño total de las celdas guardadas (en bytes)
+    def size(self):
+        return self._connection().execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+
+    # función para obtener las celdas guardadas de una lista de claves
+    # devuelve un diccionario clave -> métricas ({'metric': [...], 'value': [...]}) solo con las que están guardadas
+    def get_many(self, keys):
+        connection = self._connection()
+        cells = {}
+        for start in range(0, len(keys), QUERY_SIZE):
+            chunk = keys[start:start + QUERY_SIZE]
+            rows = connection.execute(f'SELECT key, payload FROM cells WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            cells.update((key, json.loads(payload)) for key, payload in rows)
+
+        # las celdas leídas pasan a ser las usadas más recientemente
+        if cells:
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('UPDATE cells SET last_used = ? WHERE key = ?', [(now, key) for key in cells])
+            connection.execute('COMMIT')
+
+        self.hits += len(cells)
+        self.misses += len(keys) - len(cells)
+
+        return cells
+
+    # función para guardar una celda y eliminar las menos usadas si se supera max_size
+    def put(self, key, metrics):
+        payload = json.dumps({'metric': list(metrics['metric']), 'value': [float(value) for value in metrics['value']]})
+
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            previous = connection.execute('SELECT size FROM cells WHERE key = ?', (key,)).fetchone()
+            connection.execute('INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?)', (key, payload, len(payload), time.time()))
+            connection.execute("UPDATE meta SET value = value + ? WHERE name = 'size'",
+                               (len(payload) - (previous[0] if previous else 0),))
+            self._evict(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    # función para eliminar las celdas menos usadas recientemente hasta que el tamaño total no supere max_size
+    def _evict(self, connection):
+        excess = connection.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0] - self.max_size
+        if excess <= 0:
+            return
+
+        evicted = []
+        freed = 0
+        for key, size in connection.execute('SELECT key, size FROM cells ORDER BY last_used'):
+            evicted.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+
+        connection.executemany('DELETE FROM cells WHERE key = ?', evicted)
+        connection.execute("UPDATE meta SET value = value - ? WHERE name = 'size'", (freed,))
+
+    # función para borrar todas las celdas
+    def clear(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('DELETE FROM cells')
+        connection.execute("UPDATE meta SET value = 0 WHERE name = 'size'")
+        connection.execute('COMMIT')
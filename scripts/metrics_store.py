@@ -0,0 +1,229 @@
+import ast
+
+import numpy as np
+import pandas as pd
+
+
+# columnas en las que se normalizan los parámetros de los indicadores (periodo simple o diccionario de periodos)
+PARAMETER_COLUMNS = ['timeperiod', 'fastperiod', 'slowperiod', 'signalperiod']
+
+# columnas categóricas del almacén
+CATEGORY_COLUMNS = ['ticker', 'indicator', 'parameter', 'metric']
+
+# columnas del índice para buscar métricas
+INDEX_COLUMNS = ['ticker', 'forecast_horizon', 'indicator', 'metric']
+
+
+# función para obtener la etiqueta de un parámetro, la misma que aparece en stocks_metrics.csv
+def parameter_label(parameter):
+    return str(parameter)
+
+
+# función para recuperar un parámetro a partir de su etiqueta ('NA', '14' o "{'fastperiod': 12, ...}")
+def parse_parameter(label):
+    try:
+        return ast.literal_eval(label)
+    except (ValueError, SyntaxError):
+        return label
+
+
+# función para ordenar etiquetas de parámetros por el parámetro (20 antes que 100, 'NA' al principio)
+def parameter_sort_key(label):
+    return tuple(normalize_parameter(parse_parameter(label)).values())
+
+
+# función para normalizar un parámetro en las columnas de PARAMETER_COLUMNS (-1 si no aplica)
+def normalize_parameter(parameter):
+    values = dict.fromkeys(PARAMETER_COLUMNS, -1)
+
+    if isinstance(parameter, dict):
+        for key, value in parameter.items():
+            if key not in values:
+                raise ValueError(f'parámetro desconocido: {key}')
+            values[key] = value
+    elif isinstance(parameter, (int, np.integer)):
+        values['timeperiod'] = parameter
+
+    return values
+
+
+# Almacén columnar y tipado de las métricas de explore_stocks
+# las columnas se reservan de antemano (y crecen al doble si hace falta), las de texto se guardan como códigos
+class MetricsStore:
+
+    def __init__(self, capacity=0):
+        self.size = 0
+        self.forecast_horizon = np.empty(capacity, dtype='int16')
+        self.value = np.empty(capacity, dtype='float64')
+        self.codes = {column: np.empty(capacity, dtype='int32') for column in CATEGORY_COLUMNS}
+        self.categories = {column: [] for column in CATEGORY_COLUMNS}
+        self._lookup = {column: {} for column in CATEGORY_COLUMNS}
+        self._index = None
+
+    def __len__(self):
+        return self.size
+
+    # función para obtener el código de una categoría, añadiéndola si es nueva
+    def _code(self, column, label):
+        lookup = self._lookup[column]
+        if label not in lookup:
+            lookup[label] = len(self.categories[column])
+            self.categories[column].append(label)
+
+        return lookup[label]
+
+    # función para asegurar espacio para n filas más
+    def _reserve(self, n):
+        capacity = len(self.value)
+        if self.size + n <= capacity:
+            return
+
+        capacity = max(self.size + n, 2 * capacity)
+        self.forecast_horizon = np.resize(self.forecast_horizon, capacity)
+        self.value = np.resize(self.value, capacity)
+        for column in CATEGORY_COLUMNS:
+            self.codes[column] = np.resize(self.codes[column], capacity)
+
+    # función para añadir las métricas de un horizonte temporal (el diccionario de calculate_fh_metrics)
+    def append(self, ticker, forecast_horizon, fh_metrics):
+        n = len(fh_metrics['value'])
+        self._reserve(n)
+        rows = slice(self.size, self.size + n)
+
+        self.codes['ticker'][rows] = self._code('ticker', ticker)
+        self.forecast_horizon[rows] = forecast_horizon
+        self.codes['indicator'][rows] = [self._code('indicator', label) for label in fh_metrics['indicator']]
+        self.codes['parameter'][rows] = [self._code('parameter', parameter_label(p)) for p in fh_metrics['parameter']]
+        self.codes['metric'][rows] = [self._code('metric', label) for label in fh_metrics['metric']]
+        self.value[rows] = fh_metrics['value']
+
+        self.size += n
+        self._index = None
+
+        return self
+
+    # función para añadir las métricas de un stock (el diccionario de calculate_stock_metrics)
+    def append_stock(self, ticker, stock_metrics):
+        forecast_horizons = np.asarray(stock_metrics['forecast_horizon'])
+        for fh in pd.unique(forecast_horizons):
+            rows = np.flatnonzero(forecast_horizons == fh)
+            self.append(ticker, fh, {key: [stock_metrics[key][i] for i in rows]
+                                     for key in ['indicator', 'parameter', 'metric', 'value']})
+
+        return self
+
+    # función para obtener una columna categórica
+    def _categorical(self, column):
+        return pd.Categorical.from_codes(self.codes[column][:self.size], categories=self.categories[column])
+
+    # función para obtener las columnas de parámetros normalizados
+    def _parameter_columns(self):
+        normalized = [normalize_parameter(parse_parameter(label)) for label in self.categories['parameter']]
+        codes = self.codes['parameter'][:self.size]
+
+        columns = {}
+        for column in PARAMETER_COLUMNS:
+            values = np.array([parameter[column] for parameter in normalized], dtype='int32')[codes]
+            columns[column] = pd.array(np.where(values < 0, None, values), dtype='Int32')
+
+        return columns
+
+    # función para obtener el dataframe tipado (categóricas, parámetros normalizados y value)
+    def to_frame(self):
+        data = {
+            'ticker': self._categorical('ticker'),
+            'forecast_horizon': self.forecast_horizon[:self.size].copy(),
+            'indicator': self._categorical('indicator'),
+            'parameter': self._categorical('parameter'),
+        }
+        data.update(self._parameter_columns())
+        data['metric'] = self._categorical('metric')
+        data['value'] = self.value[:self.size].copy()
+
+        return pd.DataFrame(data=data)
+
+    # función para obtener el dataframe con el formato original de explore_stocks
+    def to_legacy_frame(self):
+        parameters = [parse_parameter(label) for label in self.categories['parameter']]
+
+        return pd.DataFrame(data={
+            'ticker': [self.categories['ticker'][code] for code in self.codes['ticker'][:self.size]],
+            'forecast_horizon': self.forecast_horizon[:self.size].astype('int64'),
+            'indicator': [self.categories['indicator'][code] for code in self.codes['indicator'][:self.size]],
+            'parameter': [parameters[code] for code in self.codes['parameter'][:self.size]],
+            'metric': [self.categories['metric'][code] for code in self.codes['metric'][:self.size]],
+            'value': self.value[:self.size].copy(),
+        })
+
+    # función para crear el almacén a partir de un dataframe de explore_stocks (o leído de stocks_metrics.csv)
+    @classmethod
+    def from_frame(cls, stocks_metrics):
+        store = cls(len(stocks_metrics))
+        n = len(stocks_metrics)
+
+        for column in CATEGORY_COLUMNS:
+            labels = stocks_metrics[column]
+            if column == 'parameter':
+                # read_csv lee la etiqueta 'NA' como NaN
+                labels = labels.fillna('NA').map(parameter_label)
+            codes, categories = pd.factorize(labels.astype('str'))
+            store.categories[column] = list(categories)
+            store._lookup[column] = {label: code for code, label in enumerate(categories)}
+            store.codes[column][:n] = codes
+
+        store.forecast_horizon[:n] = stocks_metrics['forecast_horizon'].values
+        store.value[:n] = stocks_metrics['value'].values
+        store.size = n
+
+        return store
+
+    # funciones para guardar y leer el almacén en parquet o en arrow (feather)
+    def to_parquet(self, path):
+        self.to_frame().to_parquet(path, index=False)
+
+    def to_feather(self, path):
+        self.to_frame().to_feather(path)
+
+    @classmethod
+    def read_parquet(cls, path):
+        return cls.from_frame(pd.read_parquet(path, columns=['ticker', 'forecast_horizon', 'indicator', 'parameter', 'metric', 'value']))
+
+    @classmethod
+    def read_feather(cls, path):
+        return cls.from_frame(pd.read_feather(path, columns=['ticker', 'forecast_horizon', 'indicator', 'parameter', 'metric', 'value']))
+
+    # función para obtener el dataframe indexado por (ticker, forecast_horizon, indicator, metric), ordenado para búsquedas rápidas
+    def indexed(self):
+        if self._index is None:
+            self._index = self.to_frame().set_index(INDEX_COLUMNS).sort_index()
+
+        return self._index
+
+    # función para buscar los valores de una métrica (una fila por parámetro del indicador)
+    # devuelve una serie indexada por la etiqueta del parámetro
+    def lookup(self, ticker, forecast_horizon, indicator, metric, parameter=None):
+        rows = self.indexed().loc[[(ticker, forecast_horizon, indicator, metric)]]
+        if parameter is not None:
+            rows = rows[rows['parameter'] == parameter_label(parameter)]
+
+        return pd.Series(rows['value'].values, index=pd.Index(rows['parameter'].astype('str').values, name='parameter'),
+                         name='value')
+
+    # función para obtener la tabla de valores medios de una métrica por ticker y otra columna (como en el notebook parte3)
+    # se añaden la columna y la fila 'mean' con las medias; con columns='parameter' las columnas se ordenan por el parámetro
+    def pivot(self, metric, columns='forecast_horizon', parameter=None):
+        frame = self.to_frame()
+        rows = (frame['metric'] == metric).values
+        if parameter is not None:
+            rows &= (frame['parameter'] == parameter_label(parameter)).values
+
+        table = frame.loc[rows, ['ticker', columns, 'value']].astype({'ticker': 'str'})
+        if isinstance(table[columns].dtype, pd.CategoricalDtype):
+            table[columns] = table[columns].astype('str')
+        table = table.groupby(['ticker', columns]).mean().unstack()
+        if columns == 'parameter':
+            table = table[sorted(table.columns, key=lambda column: parameter_sort_key(column[1]))]
+        table['mean'] = table.mean(numeric_only=True, axis=1)
+        table.loc['mean'] = table.mean()
+
+        return table
@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+
+from . import data_preparation
+from . import indicator_cache
+from . import metrics_calculation
+from . import stock_metrics as sm
+from .indicator_cache import indicator_parameters
+from .metrics_store import MetricsStore
+
+
+# Modo panel de explore_stocks: todos los tickers en un solo bloque (ticker x fecha x campo) con un calendario común
+# los returns, los outliers, los targets y los indicadores se calculan para todos los tickers a la vez
+# cada ticker se procesa sobre sus propias barras (igual que en explore_stocks), así que antes de cada fase
+# las filas que quedan de cada ticker se compactan a la izquierda y el resto del bloque se rellena con NaN
+# los indicadores se calculan con talib por periodo y por ticker, en un array por familia (una fila por periodo)
+
+
+# campos de cada ticker en el panel (las columnas de clean_data)
+FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+# orden de los indicadores en calculate_fh_metrics
+INDICATORS = ['sma', 'rsi', 'macd', 'ppo', 'bbands']
+
+
+# Panel de precios de varios tickers
+class PricePanel:
+
+    def __init__(self, tickers, dates, values):
+        self.tickers = list(tickers)
+        self.dates = dates
+        self.values = values
+
+    # función para crear el panel a partir de los dataframes de clean_data de cada ticker
+    # los días en los que un ticker no tiene barra quedan a NaN
+    @classmethod
+    def from_frames(cls, stock_prices):
+        tickers = list(stock_prices)
+        dates = pd.DatetimeIndex([])
+        for prices in stock_prices.values():
+            dates = dates.union(prices.index)
+
+        values = np.full((len(tickers), len(dates), len(FIELDS)), np.nan)
+        for i, ticker in enumerate(tickers):
+            rows = dates.get_indexer(stock_prices[ticker].index)
+            values[i, rows] = stock_prices[ticker][FIELDS].values
+
+        return cls(tickers, dates, values)
+
+    # función para crear el panel descargando los precios de cada ticker (get_stock_prices)
+    @classmethod
+    def from_tickers(cls, tickers, start_date, end_date=None, cache=None):
+        return cls.from_frames({ticker: data_preparation.get_stock_prices(ticker, start_date, end_date, cache) for ticker in tickers})
+
+    # máscara de los días con barra de cada ticker
+    def mask(self):
+        return ~np.isnan(self.values[:, :, FIELDS.index('close')])
+
+    def field(self, name):
+        return self.values[:, :, FIELDS.index(name)]
+
+    # función para obtener el dataframe de un ticker (el mismo que devuelve get_stock_prices)
+    def frame(self, ticker):
+        i = self.tickers.index(ticker)
+        rows = self.mask()[i]
+        return pd.DataFrame(self.values[i, rows], index=self.dates[rows], columns=FIELDS)
+
+
+# función para compactar a la izquierda las filas de cada ticker indicadas por keep
+# devuelve los campos compactados (NaN a la derecha) y la máscara de filas válidas
+def compact(fields, keep):
+    order = np.argsort(~keep, axis=1, kind='stable')
+    valid = np.arange(keep.shape[1]) < keep.sum(axis=1)[:, None]
+
+    compacted = {}
+    for name, values in fields.items():
+        values = np.take_along_axis(values, order, axis=1)
+        compacted[name] = np.where(valid, values, np.nan)
+
+    return compacted, valid
+
+
+# función para obtener los returns de cada ticker sobre sus filas compactadas (get_returns)
+def panel_returns(close, forecast_horizon):
+    returns = np.full(close.shape, np.nan)
+    returns[:, forecast_horizon:] = (close[:, forecast_horizon:] / close[:, :-forecast_horizon] - 1) * 100
+    return returns
+
+
+# función para obtener qué filas son outliers (drop_outliers) en cada ticker
+# pandas calcula la ventana móvil de cada columna con el mismo algoritmo que en drop_outliers
+def panel_outliers(returns, n_sigmas=3):
+    rolling = pd.DataFrame(returns.T).rolling(window=21)
+    mu = rolling.mean().values.T
+    sigma = rolling.std().values.T
+
+    with np.errstate(invalid='ignore'):
+        return (returns > mu + n_sigmas*sigma) | (returns < mu - n_sigmas*sigma)
+
+
+# función para obtener la posición (get_position) de cada ticker, con la media de |returns| de cada uno
+def panel_position(returns):
+    with np.errstate(invalid='ignore'):
+        mean_returns = np.nanmean(np.abs(returns), axis=1, keepdims=True)
+        return np.where(np.abs(returns) > mean_returns, (returns >= 0).astype('int'), 2)
+
+
+# función para preparar un horizonte temporal de todos los tickers (create_price_change_vars y create_target_features)
+# devuelve los campos de las filas que quedan tras las dos fases de outliers, compactados, y su máscara
+def panel_targets(panel, forecast_horizon):
+    fields, valid = compact({name: panel.field(name) for name in ['close', 'volume']}, panel.mask())
+
+    # create_price_change_vars
+    fields['returns'] = np.where(valid, panel_returns(fields['close'], forecast_horizon), np.nan)
+    fields['bullish'] = (fields['returns'] >= 0).astype('float')
+    fields['position'] = panel_position(fields['returns']).astype('float')
+    fields, valid = compact(fields, valid & ~panel_outliers(fields['returns']))
+
+    # create_target_features
+    fields['future_returns'] = np.full(valid.shape, np.nan)
+    fields['future_returns'][:, :-forecast_horizon] = panel_returns(fields['close'], forecast_horizon)[:, forecast_horizon:]
+    fields['future_bullish'] = (fields['future_returns'] >= 0).astype('float')
+    fields['future_position'] = panel_position(fields['future_returns']).astype('float')
+    fields, valid = compact(fields, valid & ~panel_outliers(fields['returns']))
+
+    return fields, valid
+
+
+# función para calcular los indicadores de una familia para todos los tickers y periodos en un único array
+# cada periodo se calcula con talib sobre las barras de cada ticker; los tickers sin barras (filas vacías) quedan a NaN
+# devuelve un array (periodo, ticker, fecha), o una tupla de ellos para los indicadores con varias salidas (macd, bbands)
+def panel_indicator(close, indicator, parameters):
+    parameters = [indicator_parameters(parameter) for parameter in parameters]
+    outputs = 3 if indicator in ('macd', 'bbands') else 1
+    result = np.full((outputs, len(parameters)) + close.shape, np.nan)
+
+    rows = [(i, np.ascontiguousarray(values, dtype='float64')) for i, values in enumerate(close) if not np.isnan(values).all()]
+    for j, parameter in enumerate(parameters):
+        for i, values in rows:
+            output = indicator_cache.INDICATORS[indicator](values, **parameter)
+            for k, line in enumerate([output] if outputs == 1 else output):
+                result[k, j, i] = line
+
+    return result[0] if outputs == 1 else tuple(result)
+
+
+# función para obtener las señales de un indicador a partir de su salida en panel_indicator (fila i de la familia)
+def panel_signals(indicator, close, values, i):
+    if indicator == 'sma':
+        return metrics_calculation.sma_signals(close, values[i])
+    if indicator == 'rsi':
+        return metrics_calculation.rsi_signals(values[i])
+    if indicator == 'macd':
+        return metrics_calculation.macd_signals(values[1][i], values[2][i])
+    if indicator == 'ppo':
+        return metrics_calculation.ppo_signals(values[i])
+
+    return metrics_calculation.bbands_signals(close, values[0][i], values[2][i])
+
+
+# función para obtener las tablas de contingencia de todos los tickers con un solo bincount
+# devuelve las tablas (ticker x estado x future_bullish x future_position) y el estado de cada fila
+def panel_tables(signals, fields, valid):
+    n_states = 2 ** len(signals)
+    state = np.zeros(valid.shape, dtype='int64')
+    for i, signal in enumerate(signals):
+        with np.errstate(invalid='ignore'):
+            state |= np.asarray(signal, dtype='bool').astype('int64') << i
+
+    cells = (state * 2 + np.nan_to_num(fields['future_bullish']).astype('int64')) * 3 + np.nan_to_num(fields['future_position']).astype('int64')
+    cells += np.arange(len(valid))[:, None] * n_states * 6
+
+    tables = np.bincount(cells[valid], minlength=len(valid) * n_states * 6).reshape(len(valid), n_states, 2, 3)
+    return tables, state
+
+
+# función para calcular las métricas de un horizonte temporal de todos los tickers
+# devuelve un diccionario ticker -> métricas, con el mismo formato que calculate_fh_metrics
+def panel_fh_metrics(panel, forecast_horizon, params):
+    fields, valid = panel_targets(panel, forecast_horizon)
+    lengths = valid.sum(axis=1)
+    close = fields['close']
+
+    fh_metrics = {ticker: {'indicator': [], 'parameter': [], 'metric': [], 'value': []} for ticker in panel.tickers}
+
+    def append(i, indicator, parameter, metrics):
+        ticker_metrics = fh_metrics[panel.tickers[i]]
+        ticker_metrics['indicator'] += ([indicator] * len(metrics['value']))
+        ticker_metrics['parameter'] += ([parameter] * len(metrics['value']))
+        ticker_metrics['metric'] += metrics['metric']
+        ticker_metrics['value'] += metrics['value']
+
+    # future_returns de cada ticker se ordena una sola vez para todos sus p-values
+    ranks = [sm.MannWhitneyRanks(fields['future_returns'][i, :lengths[i]]) for i in range(len(valid))]
+
+    # métricas generales
+    tables, _ = panel_tables(metrics_calculation.general_signals(fields['bullish'], fields['position']), fields, valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns_count = (~np.isnan(fields['returns'])).sum(axis=1)
+        mean_returns = np.nansum(fields['returns'], axis=1) / returns_count
+        volatility = np.sqrt(np.nansum((fields['returns'] - mean_returns[:, None]) ** 2, axis=1) / (returns_count - 1))
+        mean_volume = np.nansum(fields['volume'], axis=1) / lengths
+
+    for i in range(len(valid)):
+        returns = fields['returns'][i, :lengths[i]]
+        bullish = fields['bullish'][i, :lengths[i]]
+        position = fields['position'][i, :lengths[i]]
+        p_values = [
+            sm.p_value(returns[bullish == 1], np.abs(returns[bullish == 0])),
+            sm.p_value(returns[position == 1], np.abs(returns[position == 0])),
+        ]
+        append(i, 'general', 'NA', metrics_calculation.general_table_metrics(
+            sm.SignalTable.from_counts(tables[i]), mean_returns[i], volatility[i], mean_volume[i], p_values))
+
+    # métricas de cada indicador, con todos los periodos de una familia calculados a la vez
+    for indicator in INDICATORS:
+        parameters = params[f'{indicator}_timeperiods']
+        if not parameters:
+            continue
+
+        values = panel_indicator(close, indicator, parameters)
+        for j, parameter in enumerate(parameters):
+            tables, state = panel_tables(panel_signals(indicator, close, values, j), fields, valid)
+            for i in range(len(valid)):
+                table = sm.SignalTable.from_counts(tables[i], state[i, :lengths[i]])
+                p_values = metrics_calculation.table_p_values(table, indicator, None, ranks[i])
+                append(i, indicator, parameter, metrics_calculation.TABLE_METRICS[indicator](table, p_values))
+
+    return fh_metrics
+
+
+# función para crear el dataset con todas las métricas en modo panel (el mismo formato que explore_stocks)
+def explore_panel(panel, params, as_store=False):
+    stocks = {ticker: {'forecast_horizon': [], 'indicator': [], 'parameter': [], 'metric': [], 'value': []} for ticker in panel.tickers}
+
+    for fh in params['forecast_horizons']:
+        for ticker, fh_metrics in panel_fh_metrics(panel, fh, params).items():
+            metrics_calculation.append_fh_metrics(stocks[ticker], fh, fh_metrics)
+
+    stocks_metrics = MetricsStore(sum(len(stock_metrics['value']) for stock_metrics in stocks.values()))
+    for ticker in panel.tickers:
+        stocks_metrics.append_stock(ticker, stocks[ticker])
+
+    if as_store:
+        return stocks_metrics
+
+    return stocks_metrics.to_legacy_frame()
@@ -0,0 +1,104 @@
+import json
+import os
+from urllib.parse import quote
+
+import pandas as pd
+
+
+# Caché local de precios OHLCV por ticker
+# cada ticker se guarda en un parquet (columnar, se lee con memory map) junto a un json con el rango cubierto
+# el rango cubierto es [start, end), igual que los parámetros start/end de yfinance
+class PriceCache:
+
+    def __init__(self, path='data/price_cache', offline=False):
+        self.path = path
+        self.offline = offline
+        os.makedirs(path, exist_ok=True)
+
+    # rutas del parquet y de los metadatos de un ticker (los tickers pueden llevar caracteres como ^ o =)
+    def _paths(self, ticker_name):
+        name = quote(ticker_name, safe='')
+        return os.path.join(self.path, name + '.parquet'), os.path.join(self.path, name + '.json')
+
+    # función para leer de disco los precios y el rango cubierto de un ticker
+    def load(self, ticker_name):
+        prices_path, meta_path = self._paths(ticker_name)
+
+        if not (os.path.exists(prices_path) and os.path.exists(meta_path)):
+            return None, None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        prices = pd.read_parquet(prices_path, memory_map=True)
+        return prices, (pd.Timestamp(meta['start']), pd.Timestamp(meta['end']))
+
+    # función para guardar en disco los precios y el rango cubierto de un ticker
+    # se escribe en ficheros temporales y se renombran para no dejar la caché a medias
+    def store(self, ticker_name, prices, start, end):
+        prices_path, meta_path = self._paths(ticker_name)
+
+        prices.to_parquet(prices_path + '.tmp')
+        os.replace(prices_path + '.tmp', prices_path)
+
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d')}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    # función para obtener los precios de un ticker descargando solo los tramos que faltan en la caché
+    # fetch(ticker_name, start_date, end_date) es la función de descarga
+    def get(self, ticker_name, start_date, end_date, fetch):
+        today = pd.Timestamp.today().normalize()
+        start = pd.Timestamp(start_date)
+        end = pd.Timestamp(end_date) if end_date is not None else today + pd.Timedelta(days=1)
+
+        prices, covered = self.load(ticker_name)
+
+        if self.offline:
+            if prices is None:
+                raise LookupError(f'{ticker_name} no está en la caché y el modo offline está activado')
+            return slice_dates(prices, start, end)
+
+        if prices is None:
+            prices = fetch(ticker_name, start_date=start.strftime('%Y-%m-%d'), end_date=end.strftime('%Y-%m-%d'))
+            covered_start, covered_end = start, end
+        else:
+            covered_start, covered_end = covered
+            parts = [prices]
+
+            # tramo anterior al cubierto
+            if start < covered_start:
+                parts.insert(0, fetch(ticker_name, start_date=start.strftime('%Y-%m-%d'),
+                                      end_date=covered_start.strftime('%Y-%m-%d')))
+                covered_start = start
+
+            # tramo posterior al cubierto (la última barra se vuelve a pedir por si estaba incompleta)
+            if end > covered_end:
+                parts.append(fetch(ticker_name, start_date=covered_end.strftime('%Y-%m-%d'),
+                                   end_date=end.strftime('%Y-%m-%d')))
+                covered_end = end
+
+            if len(parts) == 1:
+                return slice_dates(prices, start, end)
+
+            prices = pd.concat([part for part in parts if len(part) > 0])
+            prices = prices[~prices.index.duplicated(keep='last')].sort_index()
+
+        # si el rango llega hasta hoy, la última barra puede cambiar y se marca como no cubierta
+        if covered_end > today and len(prices) > 0:
+            covered_end = naive_dates(prices.index)[-1].normalize()
+
+        self.store(ticker_name, prices, covered_start, covered_end)
+
+        return slice_dates(prices, start, end)
+
+
+# función para obtener las fechas de un índice sin zona horaria (yfinance devuelve la del mercado)
+def naive_dates(index):
+    return index.tz_localize(None) if index.tz is not None else index
+
+
+# función para quedarse con las barras de [start, end)
+def slice_dates(prices, start, end):
+    dates = naive_dates(prices.index)
+    return prices[(dates >= start) & (dates < end)]
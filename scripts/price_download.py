@@ -0,0 +1,356 @@
+import http.client
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from . import data_preparation
+
+
+# Descarga masiva de precios diarios con varios hilos, límite de peticiones por host y reintentos
+# los precios se piden al endpoint de gráficos de Yahoo (el mismo que usa yfinance) y se devuelven con su formato
+# la capa HTTP es intercambiable (transport), así que se puede probar contra LocalPriceServer sin acceso a la red
+
+
+# endpoint de gráficos de Yahoo, {ticker} se sustituye por el ticker codificado
+YAHOO_CHART_URL = 'https://query1.finance.yahoo.com/v8/finance/chart/{ticker}'
+
+# códigos de estado que se reintentan (límite de peticiones y errores del servidor)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+# error de descarga de un ticker; retryable indica si tiene sentido volver a intentarlo
+class DownloadError(Exception):
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+# Transporte HTTP con conexiones persistentes (keep-alive), una por host y por hilo
+# cualquier objeto con un método get(url) -> (status, body) puede sustituirlo
+class HTTPTransport:
+
+    def __init__(self, timeout=30, headers=None):
+        self.timeout = timeout
+        self.headers = {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}
+        self.headers.update(headers or {})
+        self._local = threading.local()
+
+    def _connection(self, scheme, netloc):
+        connections = self._local.__dict__.setdefault('connections', {})
+        if (scheme, netloc) not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connections[(scheme, netloc)] = connection_class(netloc, timeout=self.timeout)
+
+        return connections[(scheme, netloc)]
+
+    def get(self, url):
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        connection = self._connection(parts.scheme, parts.netloc)
+
+        try:
+            connection.request('GET', path, headers=self.headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            # la conexión puede haberla cerrado el servidor, se descarta para abrir otra en el siguiente intento
+            connection.close()
+            del self._local.connections[(parts.scheme, parts.netloc)]
+            raise
+
+
+# Límite de peticiones con un cubo de fichas: rate fichas por segundo y como mucho capacity acumuladas
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # función para esperar hasta que haya una ficha y consumirla
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# Límite de peticiones por host, con un cubo de fichas para cada uno
+class RateLimiter:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.capacity)
+
+        self.buckets[host].acquire()
+
+
+# función para pasar la respuesta del endpoint de gráficos a un dataframe con el formato de yfinance
+# con auto_adjust los precios se ajustan por dividendos y splits con la relación adjclose / close, como en yfinance
+def parse_chart(payload, auto_adjust=True):
+    chart = payload['chart']
+    if chart.get('error'):
+        raise DownloadError(chart['error'].get('description', str(chart['error'])))
+
+    result = chart['result'][0]
+    timezone = result['meta'].get('exchangeTimezoneName', 'UTC')
+    index = pd.to_datetime(result.get('timestamp', []), unit='s', utc=True).tz_convert(timezone).normalize()
+    index.name = 'Date'
+
+    quote_values = result['indicators']['quote'][0] if result.get('timestamp') else {}
+    stock_prices = pd.DataFrame({
+        column: np.asarray(quote_values.get(field, []), dtype='float')
+        for column, field in [('Open', 'open'), ('High', 'high'), ('Low', 'low'), ('Close', 'close'), ('Volume', 'volume')]
+    }, index=index)
+
+    # dividendos y splits en la fecha de cada evento
+    stock_prices['Dividends'] = 0.0
+    stock_prices['Stock Splits'] = 0.0
+    events = result.get('events', {})
+    for event in events.get('dividends', {}).values():
+        date = pd.Timestamp(event['date'], unit='s', tz='UTC').tz_convert(timezone).normalize()
+        if date in stock_prices.index:
+            stock_prices.loc[date, 'Dividends'] += event['amount']
+    for event in events.get('splits', {}).values():
+        date = pd.Timestamp(event['date'], unit='s', tz='UTC').tz_convert(timezone).normalize()
+        if date in stock_prices.index:
+            stock_prices.loc[date, 'Stock Splits'] = event['numerator'] / event['denominator']
+
+    if auto_adjust and 'adjclose' in result['indicators'] and len(stock_prices) > 0:
+        adjclose = np.asarray(result['indicators']['adjclose'][0]['adjclose'], dtype='float')
+        ratio = adjclose / stock_prices['Close'].values
+        for column in ['Open', 'High', 'Low']:
+            stock_prices[column] *= ratio
+        stock_prices['Close'] = adjclose
+
+    # las barras sin cierre (días sin cotización) se descartan
+    return stock_prices.dropna(subset=['Close'])
+
+
+# función para pasar un dataframe con el formato de yfinance a la respuesta del endpoint de gráficos (inversa de parse_chart)
+def to_chart(stock_prices, timezone='America/New_York'):
+    index = stock_prices.index if stock_prices.index.tz is not None else stock_prices.index.tz_localize(timezone)
+    timestamps = [int(t.timestamp()) for t in index]
+    close = stock_prices['Close'].astype('float')
+    adjclose = stock_prices['Adj Close'] if 'Adj Close' in stock_prices else close
+
+    def values(series):
+        return [None if np.isnan(value) else float(value) for value in series]
+
+    events = {}
+    if 'Dividends' in stock_prices:
+        events['dividends'] = {str(t): {'amount': float(a), 'date': t}
+                               for t, a in zip(timestamps, stock_prices['Dividends']) if a != 0}
+    if 'Stock Splits' in stock_prices:
+        events['splits'] = {str(t): {'date': t, 'numerator': float(s), 'denominator': 1.0}
+                            for t, s in zip(timestamps, stock_prices['Stock Splits']) if s != 0}
+
+    return {'chart': {'result': [{
+        'meta': {'exchangeTimezoneName': str(index.tz)},
+        'timestamp': timestamps,
+        'events': events,
+        'indicators': {
+            'quote': [{field: values(stock_prices[column].astype('float'))
+                       for field, column in [('open', 'Open'), ('high', 'High'), ('low', 'Low'), ('close', 'Close'), ('volume', 'Volume')]}],
+            'adjclose': [{'adjclose': values(adjclose.astype('float'))}],
+        },
+    }], 'error': None}}
+
+
+# función para pasar una fecha a segundos desde 1970 (period1 y period2 del endpoint)
+def epoch(date):
+    return int(pd.Timestamp(date).tz_localize(None).timestamp())
+
+
+# Resultado de una descarga masiva: tickers descargados, fallidos (con su error) e intentos de cada uno
+class DownloadReport:
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+        self.attempts = {}
+
+    def to_frame(self):
+        tickers = self.succeeded + list(self.failed)
+        return pd.DataFrame(data={
+            'ticker': tickers,
+            'ok': [ticker not in self.failed for ticker in tickers],
+            'attempts': [self.attempts.get(ticker, 0) for ticker in tickers],
+            'error': [self.failed.get(ticker) for ticker in tickers],
+        })
+
+
+# Descargador de precios de muchos tickers a la vez
+# rate y burst limitan las peticiones por segundo a cada host; los errores de red, 429 y 5xx se reintentan
+# hasta retries veces con espera exponencial con jitter (entre 0 y min(max_backoff, backoff * 2^intento) segundos)
+class PriceDownloader:
+
+    def __init__(self, transport=None, url=YAHOO_CHART_URL, max_workers=8, rate=2.0, burst=None,
+                 retries=3, backoff=0.5, max_backoff=30.0, auto_adjust=True, seed=None):
+        self.transport = transport if transport is not None else HTTPTransport()
+        self.url = url
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.auto_adjust = auto_adjust
+        self.random = random.Random(seed)
+        self.report = DownloadReport()
+
+    # función para obtener la url de los precios diarios de un ticker en [start_date, end_date)
+    def chart_url(self, ticker_name, start_date, end_date=None):
+        end = pd.Timestamp(end_date) if end_date is not None else pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+        query = {'period1': epoch(start_date), 'period2': epoch(end), 'interval': '1d',
+                 'events': 'div,splits', 'includeAdjustedClose': 'true'}
+        return self.url.format(ticker=quote(ticker_name, safe='')) + '?' + urlencode(query)
+
+    # función para descargar los precios de un ticker con reintentos, con la misma firma que download_financial_data
+    # (se puede usar como fetch de price_cache.PriceCache)
+    def fetch(self, ticker_name, start_date, end_date=None):
+        url = self.chart_url(ticker_name, start_date, end_date)
+
+        for attempt in range(self.retries + 1):
+            self.report.attempts[ticker_name] = attempt + 1
+            self.limiter.acquire(url)
+            try:
+                status, body = self.transport.get(url)
+                if status == 200:
+                    return parse_chart(json.loads(body), self.auto_adjust)
+                error = DownloadError(f'{ticker_name}: HTTP {status}', status, status in RETRY_STATUS)
+            except (http.client.HTTPException, OSError) as e:
+                error = DownloadError(f'{ticker_name}: {e}', retryable=True)
+
+            if not error.retryable or attempt == self.retries:
+                raise error
+
+            time.sleep(self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    # función para descargar varios tickers a la vez, devolviendo (ticker, precios de clean_data) según van llegando
+    # los tickers que fallan no detienen la descarga, quedan en report.failed
+    def download(self, tickers, start_date, end_date=None):
+        self.report = DownloadReport()
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {pool.submit(self.fetch, ticker, start_date, end_date): ticker for ticker in tickers}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    stock_prices = data_preparation.clean_data(future.result())
+                except Exception as e:
+                    self.report.failed[ticker] = str(e)
+                    continue
+
+                self.report.succeeded.append(ticker)
+                yield ticker, stock_prices
+        finally:
+            # si se deja de consumir el generador no se lanzan las descargas pendientes
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # función para descargar varios tickers y devolver un diccionario ticker -> precios (en el orden de tickers)
+    def download_all(self, tickers, start_date, end_date=None):
+        prices = dict(self.download(tickers, start_date, end_date))
+        return {ticker: prices[ticker] for ticker in tickers if ticker in prices}
+
+
+# Servidor HTTP local que imita el endpoint de gráficos con precios fijos, para probar la descarga sin red
+# prices es un diccionario ticker -> dataframe con el formato de yfinance (p.ej. benchmark.synthetic_prices)
+# failures es un diccionario ticker -> lista de códigos de estado que se devuelven antes de servir los precios
+class LocalPriceServer:
+
+    def __init__(self, prices, failures=None, host='127.0.0.1', port=0):
+        self.prices = prices
+        self.failures = {ticker: list(statuses) for ticker, statuses in (failures or {}).items()}
+        self.requests = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    # url para PriceDownloader
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v8/finance/chart/{{ticker}}'
+
+    def _respond(self, path):
+        parts = urlsplit(path)
+        ticker = unquote(parts.path.rsplit('/', 1)[-1])
+        query = parse_qs(parts.query)
+
+        with self._lock:
+            self.requests.append(ticker)
+            if self.failures.get(ticker):
+                return self.failures[ticker].pop(0), {'chart': {'result': None, 'error': {'code': 'Unavailable'}}}
+
+        if ticker not in self.prices:
+            return 404, {'chart': {'result': None, 'error': {'code': 'Not Found', 'description': 'No data found, symbol may be delisted'}}}
+
+        stock_prices = self.prices[ticker]
+        dates = stock_prices.index.tz_localize(None) if stock_prices.index.tz is not None else stock_prices.index
+        start = pd.Timestamp(int(query['period1'][0]), unit='s')
+        end = pd.Timestamp(int(query['period2'][0]), unit='s')
+
+        return 200, to_chart(stock_prices[(dates >= start) & (dates < end)])
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, payload = server._respond(self.path)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
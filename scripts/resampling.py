@@ -0,0 +1,311 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Significancia por remuestreo de las hipótesis de las métricas (complemento de los p-values de Mann-Whitney U)
+# el estadístico de cada hipótesis es la diferencia de medias de la variable entre sus dos muestras (bilateral)
+# los future_returns de horizonte fh se solapan fh - 1 barras y las señales de los indicadores son persistentes (una sma
+# de 200 barras cambia de lado pocas veces), así que las observaciones no son intercambiables y ambos tests trabajan
+# con bloques de barras consecutivas:
+# - permutación por bloques: se barajan bloques de las observaciones de las dos muestras (en orden temporal) y se
+#   mantienen las máscaras, así que la dependencia dentro de cada bloque se conserva
+# - bootstrap circular por bloques: se remuestrean bloques de la serie completa y se cuenta cuántas veces la diferencia
+#   remuestreada se aleja de la observada más que la observada de cero
+# la longitud de bloque de cada hipótesis es la de Politis y White (2004, corregida en 2009) sobre la función de influencia
+# de su estadístico, que recoge a la vez la dependencia de la variable y la persistencia de las máscaras; como mínimo es
+# el horizonte (el solapamiento conocido) y se redondea hacia arriba a una rejilla para que las hipótesis compartan
+# remuestreos (ver benchmark.resampling_calibration para el rechazo bajo la hipótesis nula)
+# como en stock_metrics.MannWhitneyRanks, cada muestra necesita más de MIN_SAMPLE observaciones; a diferencia de
+# Mann-Whitney, las observaciones con NaN (los últimos future_returns) se descartan en lugar de dar NaN
+# los remuestreos se hacen por lotes con operaciones de numpy, todas las hipótesis a la vez
+# cada grupo de SEED_BLOCK remuestreos tiene su propia semilla derivada de la del test, así que el resultado no depende
+# del tamaño de los lotes, de cómo se repartan entre procesos ni de qué otras hipótesis se calculen a la vez
+
+
+# versión del remuestreo; al cambiarla se invalidan las celdas del checkpoint calculadas con él
+RESAMPLING_VERSION = 1
+
+# número de remuestreos por defecto
+N_RESAMPLES = 2000
+
+# remuestreos de cada semilla (los lotes tienen un número entero de grupos de SEED_BLOCK remuestreos)
+SEED_BLOCK = 50
+
+# máximo de remuestreos por lote y máximo de elementos (remuestreos x observaciones) de las matrices de un lote
+BATCH_SIZE = 250
+BATCH_ELEMENTS = 4_000_000
+
+# mínimo de observaciones de cada muestra (sin incluir)
+MIN_SAMPLE = 20
+
+# tolerancia relativa al comparar los estadísticos remuestreados con el observado (errores de redondeo)
+RTOL = 1e-9
+
+
+# función para obtener la entropía de una semilla a partir de una semilla base y de una clave (p.ej. precios y horizonte)
+def seed_entropy(seed, *key):
+    digest = hashlib.sha256(json.dumps(key, default=str).encode()).digest()
+    return [int(seed)] + np.frombuffer(digest, dtype='uint32').tolist()
+
+
+# función para obtener el generador de un grupo de SEED_BLOCK remuestreos (chunk) y de una clave de enteros
+def chunk_rng(entropy, chunk, *key):
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(chunk,) + tuple(int(k) for k in key)))
+
+
+# función para redondear longitudes de bloque hacia arriba a la rejilla de potencias de raíz de 2 (1, 2, 3, 4, 6, 8, 12,
+# 16, 23, 32, ...)
+def round_block_length(block_length):
+    block_length = np.maximum(np.asarray(block_length, dtype='float64'), 1)
+    return np.ceil(2 ** (np.ceil(2 * np.log2(block_length) - 1e-9) / 2)).astype('int64')
+
+
+# función para obtener la longitud de bloque óptima del bootstrap circular por bloques de cada fila de series
+# (Politis y White 2004 con la corrección de Patton, Politis y White 2009): la última autocorrelación significativa
+# marca el ancho de la ventana plana con la que se estiman la varianza de largo plazo y su sesgo
+# las series constantes tienen longitud 1
+def optimal_block_length(series):
+    series = np.atleast_2d(np.asarray(series, dtype='float64'))
+    n = series.shape[1]
+    centered = series - series.mean(axis=1, keepdims=True)
+    autocovariance = np.fft.irfft(np.abs(np.fft.rfft(centered, 2 * n)) ** 2, 2 * n)[:, :n] / n
+
+    # ventana: el primer retardo m tras el que kn autocorrelaciones seguidas no son significativas (M = 2m)
+    kn = max(5, int(np.ceil(np.sqrt(np.log10(n)))))
+    max_lag = min(int(np.ceil(np.sqrt(n))) + kn, n - kn - 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = autocovariance[:, 1:max_lag + kn + 1] / autocovariance[:, :1]
+    insignificant = sliding_window_view(np.abs(correlation) < 2 * np.sqrt(np.log10(n) / n), kn, axis=1).all(axis=-1)
+    lag = np.where(insignificant.any(axis=1), insignificant.argmax(axis=1), max_lag)
+    window = np.minimum(2 * lag, max_lag)
+
+    # ventana plana (trapezoidal) de cada serie sobre los retardos 0..max_lag
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.arange(max_lag + 1) / window[:, None]
+    flat_top = np.where(t <= 0.5, 1.0, np.where(t <= 1, 2 * (1 - t), 0.0))
+    flat_top[window == 0, 1:] = 0
+    flat_top[:, 0] = 1
+
+    lags = np.arange(1, max_lag + 1)
+    g = 2 * (flat_top[:, 1:] * lags * autocovariance[:, 1:max_lag + 1]).sum(axis=1)
+    long_run = autocovariance[:, 0] + 2 * (flat_top[:, 1:] * autocovariance[:, 1:max_lag + 1]).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        block_length = (2 * g ** 2 / (4 / 3 * long_run ** 2)) ** (1 / 3) * n ** (1 / 3)
+
+    block_length = np.where(np.isfinite(block_length), block_length, 1)
+    return np.clip(block_length, 1, max(1, min(3 * np.sqrt(n), n / 3)))
+
+
+# función para obtener la longitud de bloque de cada hipótesis: Politis-White sobre la función de influencia de la
+# diferencia de medias (contribución de cada observación), como mínimo min_block_length y redondeada a la rejilla
+def hypothesis_block_lengths(values, samples1, samples2, min_block_length=1):
+    n1 = samples1.sum(axis=1, keepdims=True)
+    n2 = samples2.sum(axis=1, keepdims=True)
+    mean1 = samples1 @ values / n1[:, 0]
+    mean2 = samples2 @ values / n2[:, 0]
+    influence = samples1 * (values - mean1[:, None]) / n1 - samples2 * (values - mean2[:, None]) / n2
+
+    return round_block_length(np.maximum(optimal_block_length(influence), min_block_length))
+
+
+# función para obtener size permutaciones por bloques de n posiciones: se barajan los bloques de block_length posiciones
+# consecutivas (el último puede estar incompleto) y se mantiene el orden dentro de cada bloque
+def block_permutations(rng, n, block_length, size):
+    order = rng.permuted(np.tile(np.arange(-(-n // block_length)), (size, 1)), axis=1)
+    positions = (order[:, :, None] * block_length + np.arange(block_length)).reshape(size, -1)
+    return positions[positions < n].reshape(size, n)
+
+
+# función para obtener las veces que se toma cada una de las n observaciones en size remuestreos del bootstrap circular
+# por bloques
+def bootstrap_counts(rng, n, block_length, size):
+    starts = rng.integers(0, n, (size, -(-n // block_length)))
+    rows = ((starts[:, :, None] + np.arange(block_length)) % n).reshape(size, -1)[:, :n]
+    return np.bincount((np.arange(size)[:, None] * n + rows).ravel(), minlength=size * n).reshape(size, n)
+
+
+# función para calcular los remuestreos de un lote (chunks es la lista de (grupo de SEED_BLOCK remuestreos, tamaño))
+# values son las observaciones válidas (sin NaN) en orden temporal, samples1/samples2 las máscaras (hipótesis x
+# observaciones) de las dos muestras y block_lengths la longitud de bloque de cada hipótesis; devuelve por hipótesis
+# cuántas permutaciones y cuántos bootstraps superan al observado y cuántos bootstraps tienen las dos muestras
+def resample_counts(values, samples1, samples2, observed, block_lengths, chunks, entropy):
+    threshold = np.abs(observed) * (1 - RTOL)
+    permutation = np.zeros(len(samples1), dtype='int64')
+    bootstrap = np.zeros(len(samples1), dtype='int64')
+    valid = np.zeros(len(samples1), dtype='int64')
+    unions = samples1 | samples2
+    n = len(values)
+
+    for block_length in np.unique(block_lengths):
+        same_length = np.flatnonzero(block_lengths == block_length)
+
+        # permutación por bloques: una por grupo de hipótesis con las mismas observaciones (unión de las dos muestras)
+        groups, inverse = np.unique(unions[same_length], axis=0, return_inverse=True)
+        for group, union in enumerate(groups):
+            members = same_length[inverse.ravel() == group]
+            rows = np.flatnonzero(union)
+            order = np.concatenate([block_permutations(chunk_rng(entropy, chunk, 0, len(rows), block_length), len(rows),
+                                                       block_length, size) for chunk, size in chunks])
+            permuted = values[rows][order]
+
+            masks = samples1[members][:, rows]
+            n1 = masks.sum(axis=1)
+            n2 = len(rows) - n1
+            sums1 = permuted @ masks.T.astype('float64')
+            difference = sums1 / n1 - (values[rows].sum() - sums1) / n2
+            permutation[members] = (np.abs(difference) >= threshold[members]).sum(axis=0)
+
+        # bootstrap circular por bloques: una matriz de conteos para todas las hipótesis con la misma longitud de bloque
+        counts = np.concatenate([bootstrap_counts(chunk_rng(entropy, chunk, 1, block_length), n, block_length, size)
+                                 for chunk, size in chunks])
+        masks1, masks2 = samples1[same_length], samples2[same_length]
+        weights = np.concatenate([masks1 * values, masks1, masks2 * values, masks2]).T
+        sums1, n1, sums2, n2 = np.split(counts.astype('float64') @ weights, 4, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            difference = sums1 / n1 - sums2 / n2
+        bootstrap[same_length] = (np.abs(difference - observed[same_length]) >= threshold[same_length]).sum(axis=0)
+        valid[same_length] = (~np.isnan(difference)).sum(axis=0)
+
+    return permutation, bootstrap, valid
+
+
+# Test por remuestreo de muchas hipótesis sobre una misma variable (p.ej. future_returns de un horizonte)
+# block_length es una longitud de bloque fija o None para la de Politis-White de cada hipótesis (como mínimo
+# min_block_length)
+# seed es un entero, una lista de enteros (ver seed_entropy) o None para una semilla aleatoria
+# executor es un concurrent.futures.Executor opcional entre cuyos workers se reparten los lotes
+class ResamplingTest:
+
+    def __init__(self, values, block_length=None, n_resamples=N_RESAMPLES, seed=None, batch_size=BATCH_SIZE, executor=None,
+                 min_block_length=1):
+        self.values = np.asarray(values, dtype='float64')
+        self.block_length = block_length
+        self.min_block_length = min_block_length
+        self.n_resamples = n_resamples
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.batch_size = batch_size
+        self.executor = executor
+
+    # grupos de SEED_BLOCK remuestreos (índice, tamaño) de cada lote para n observaciones
+    def batches(self, n):
+        chunks = [(chunk, min(SEED_BLOCK, self.n_resamples - start))
+                  for chunk, start in enumerate(range(0, self.n_resamples, SEED_BLOCK))]
+        per_batch = max(1, min(self.batch_size, BATCH_ELEMENTS // max(n, 1)) // SEED_BLOCK)
+        return [chunks[start:start + per_batch] for start in range(0, len(chunks), per_batch)]
+
+    # función para obtener la longitud de bloque de cada hipótesis
+    def block_lengths(self, values, samples1, samples2):
+        if self.block_length is not None:
+            return np.full(len(samples1), max(1, int(self.block_length)))
+
+        return hypothesis_block_lengths(values, samples1, samples2, self.min_block_length)
+
+    # función para obtener los p-values de permutación y de bootstrap de una matriz de máscaras (una fila por hipótesis)
+    # si no se indican las máscaras de la segunda muestra se usa el complementario de la primera
+    # las observaciones con NaN no entran en ninguna muestra; las hipótesis con alguna muestra de MIN_SAMPLE
+    # observaciones o menos dan NaN
+    def p_values(self, samples1, samples2=None):
+        samples1 = np.atleast_2d(np.asarray(samples1, dtype='bool'))
+        samples2 = ~samples1 if samples2 is None else np.atleast_2d(np.asarray(samples2, dtype='bool'))
+
+        valid = ~np.isnan(self.values)
+        values = self.values[valid]
+        samples1 = samples1[:, valid]
+        samples2 = samples2[:, valid] & ~samples1
+
+        permutation = np.full(len(samples1), np.nan)
+        bootstrap = np.full(len(samples1), np.nan)
+
+        n1 = samples1.sum(axis=1)
+        n2 = samples2.sum(axis=1)
+        testable = (n1 > MIN_SAMPLE) & (n2 > MIN_SAMPLE)
+        if not testable.any():
+            return permutation, bootstrap
+
+        samples1 = samples1[testable]
+        samples2 = samples2[testable]
+        observed = samples1 @ values / n1[testable] - samples2 @ values / n2[testable]
+        block_lengths = self.block_lengths(values, samples1, samples2)
+
+        arguments = [(values, samples1, samples2, observed, block_lengths, chunks, self.entropy)
+                     for chunks in self.batches(len(values))]
+        if self.executor is None:
+            counts = [resample_counts(*args) for args in arguments]
+        else:
+            counts = list(self.executor.map(resample_counts, *zip(*arguments)))
+
+        exceed, boot_exceed, boot_valid = [np.sum(parts, axis=0) for parts in zip(*counts)]
+        permutation[testable] = (1 + exceed) / (1 + self.n_resamples)
+        bootstrap[testable] = (1 + boot_exceed) / (1 + boot_valid)
+
+        return permutation, bootstrap
+
+
+# Configuración del remuestreo de explore_stocks (ver metrics_calculation.calculate_fh_metrics)
+# cada test tiene una semilla derivada de seed y de su clave (hash de los precios, horizonte, variable), así que los
+# resultados son reproducibles y no dependen del executor, del orden de los tickers ni de batch_size
+# con max_workers los lotes de cada test se reparten en un ProcessPoolExecutor propio, que se crea la primera vez que
+# hace falta (con un lock, para los hilos de explore_stocks) y se cierra con close(); no conviene combinarlo con
+# executor='process' en explore_stocks
+# block_length es la longitud de bloque de todas las hipótesis; None para la de Politis-White de cada una, como mínimo
+# el horizonte temporal
+class Resampler:
+
+    def __init__(self, n_resamples=N_RESAMPLES, seed=0, batch_size=BATCH_SIZE, max_workers=None, block_length=None):
+        self.n_resamples = n_resamples
+        self.seed = seed
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.block_length = block_length
+        self._executor = None
+        self._lock = threading.Lock()
+
+    # ni el pool de procesos ni el lock se copian al enviar el resampler a otro proceso
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # función para obtener el pool de procesos (None sin max_workers), creándolo la primera vez
+    def _pool(self):
+        if self.max_workers is None:
+            return None
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    # función para cerrar el pool de procesos (si se ha creado)
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    # identificador de la configuración para las claves del checkpoint
+    def mode(self):
+        return ['resampling', RESAMPLING_VERSION, self.n_resamples, self.seed,
+                'politis-white' if self.block_length is None else self.block_length]
+
+    # función para crear el test de una variable de un horizonte temporal
+    def test(self, values, forecast_horizon, *key):
+        return ResamplingTest(values, self.block_length, self.n_resamples, seed_entropy(self.seed, forecast_horizon, *key),
+                              self.batch_size, self._pool(), min_block_length=forecast_horizon)
@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
 import talib
-import scipy.stats as scs
 
 from . import data_preparation
 
@@ -9,13 +8,79 @@ from . import data_preparation
 # función para obtener el p-value para una hipótesis de diferencia entre distribuciones
 # se utiliza la prueba Mann-Whitney U
 # cada muestra debe tener más de 20 observaciones
+# scipy.stats se importa al calcular el primer p-value (su importación es lenta)
 def p_value(sample1, sample2):
+    import scipy.stats as scs
+
     if len(sample1) > 20 and len(sample2) > 20:
         return scs.mannwhitneyu(sample1, sample2)[1]
 
     return np.nan
 
 
+# Rangos de una variable para calcular muchos p-values de Mann-Whitney U sobre ella sin volver a ordenarla
+# cada hipótesis se define con dos máscaras booleanas (muestra 1 y muestra 2) sobre la variable
+# el resultado es el mismo que el de p_value sobre las muestras seleccionadas por las máscaras
+class MannWhitneyRanks:
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype='float')
+        self.nan = np.isnan(values)
+        self.order = np.argsort(values, kind='stable')
+
+        # posición en el orden donde empieza cada grupo de valores empatados
+        sorted_values = values[self.order]
+        new_group = np.ones(len(values), dtype='bool')
+        new_group[1:] = sorted_values[1:] != sorted_values[:-1]
+        self.starts = np.flatnonzero(new_group)
+
+    # función para obtener los p-values de una matriz de máscaras (una fila por hipótesis)
+    # si no se indican las máscaras de la segunda muestra se usa el complementario de la primera
+    def p_values(self, samples1, samples2=None):
+        samples1 = np.atleast_2d(np.asarray(samples1, dtype='bool'))
+        samples2 = ~samples1 if samples2 is None else np.atleast_2d(np.asarray(samples2, dtype='bool'))
+
+        n1 = samples1.sum(axis=1)
+        n2 = samples2.sum(axis=1)
+        p = np.full(len(samples1), np.nan)
+
+        # cada muestra debe tener más de 20 observaciones y, como en scipy, un NaN en las muestras da NaN
+        valid = (n1 > 20) & (n2 > 20) & ~(samples1 | samples2)[:, self.nan].any(axis=1)
+        if not valid.any():
+            return p
+
+        samples1 = samples1[valid][:, self.order]
+        samples2 = samples2[valid][:, self.order]
+        n1 = n1[valid]
+        n2 = n2[valid]
+
+        # rango medio de cada grupo de empates dentro de la unión de las dos muestras
+        count1 = np.add.reduceat(samples1, self.starts, axis=1, dtype='int64')
+        count = count1 + np.add.reduceat(samples2, self.starts, axis=1, dtype='int64')
+        ranks = np.cumsum(count, axis=1) - count + (count + 1) / 2
+
+        ties = (count.astype('float') ** 3 - count).sum(axis=1)
+        p[valid] = mann_whitney_p_values(n1, n2, (count1 * ranks).sum(axis=1), ties)
+
+        return p
+
+
+# función para obtener los p-values de Mann-Whitney U a partir del tamaño de las muestras, la suma de los rangos de la
+# primera muestra y la suma de t^3 - t de los grupos de empates (t = tamaño del grupo)
+# aproximación normal con corrección de continuidad y de empates (la que usa scipy con más de 8 observaciones)
+def mann_whitney_p_values(n1, n2, rank_sum1, ties):
+    import scipy.stats as scs
+
+    n = n1 + n2
+    u1 = rank_sum1 - n1 * (n1 + 1) / 2
+    u = np.maximum(u1, n1 * n2 - u1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - 0.5) / sigma
+
+    return np.clip(2 * scs.norm.sf(z), 0, 1)
+
+
 # calcula  la frecuencia relativa del valor 1 en una serie booleana
 def series_relative_frequence(series):
 
@@ -68,3 +133,93 @@ def macd_accuracy(buy, above_zero, future_position):
     sell_sort = position_sell[0] if 0 in position_sell.index else 0
 
     return (buy_long + sell_sort) / position_count
+
+
+# Tabla de contingencia estado de las señales x future_bullish x future_position
+# se construye con un solo bincount y de ella salen todas las frecuencias y accuracies de un indicador
+# las regiones se indican con un diccionario {índice de la señal: valor booleano}, p.ej. {0: True, 1: False}
+class SignalTable:
+
+    def __init__(self, signals, future_bullish, future_position):
+        state = np.zeros(len(future_bullish), dtype='int64')
+        for i, signal in enumerate(signals):
+            state |= np.asarray(signal, dtype='int64') << i
+
+        cells = (state * 2 + np.asarray(future_bullish, dtype='int64')) * 3 + np.asarray(future_position, dtype='int64')
+
+        self.state = state
+        self.states = np.arange(2 ** len(signals))
+        self.table = np.bincount(cells, minlength=len(self.states) * 6).reshape(len(self.states), 2, 3)
+
+    # función para crear la tabla directamente a partir de los conteos (estados x future_bullish x future_position)
+    # state es opcional, el estado de cada observación para obtener las muestras de los p-values
+    @classmethod
+    def from_counts(cls, table, state=None):
+        signal_table = cls.__new__(cls)
+        signal_table.table = np.asarray(table)
+        signal_table.states = np.arange(len(signal_table.table))
+        signal_table.state = state
+        return signal_table
+
+    # función para obtener qué estados pertenecen a una región
+    def match(self, region=None):
+        match = np.ones(len(self.states), dtype='bool')
+        for i, value in (region or {}).items():
+            match &= ((self.states >> i) & 1) == value
+
+        return match
+
+    # función para obtener las máscaras de las dos muestras de cada hipótesis (región 1, región 2 o None para el complementario)
+    def samples(self, hypotheses):
+        samples1 = np.array([self.match(region1)[self.state] for region1, _ in hypotheses])
+        samples2 = np.array([
+            ~sample1 if region2 is None else self.match(region2)[self.state]
+            for sample1, (_, region2) in zip(samples1, hypotheses)
+        ])
+        return samples1, samples2
+
+    # función para contar las observaciones de una región, opcionalmente con un valor de future_bullish o future_position
+    def count(self, region=None, bullish=None, position=None):
+        table = self.table[self.match(region)]
+        if bullish is not None:
+            table = table[:, [bullish]]
+        if position is not None:
+            table = table[:, :, [position]]
+
+        return table.sum()
+
+    # frecuencia relativa de una región (equivale a series_relative_frequence)
+    def relative_frequence(self, region):
+        total = self.table.sum()
+
+        # no puede haber observaciones vacías
+        if total == 0:
+            return np.nan
+
+        return self.count(region) / total
+
+    # frecuencia relativa de la tendencia alcista en una región (equivale a bullish_relative_frequence)
+    def bullish_relative_frequence(self, region):
+        total = self.count(region)
+
+        # tiene que haber observaciones en la región
+        if total == 0:
+            return np.nan
+
+        return self.count(region, bullish=1) / total
+
+    # porcentaje de aciertos de una lista de (región, valor esperado) (equivale a rsi_accuracy y macd_accuracy)
+    # target indica la variable con la que se compara, 'position' (sin contar stay) o 'bullish'
+    def accuracy(self, expected, target='position'):
+        if target == 'position':
+            position_count = sum(self.count(region) - self.count(region, position=2) for region, _ in expected)
+            hits = sum(self.count(region, position=value) for region, value in expected)
+        else:
+            position_count = sum(self.count(region) for region, _ in expected)
+            hits = sum(self.count(region, bullish=value) for region, value in expected)
+
+        # si no hay posiciones en las regiones no puede calcularse
+        if position_count == 0:
+            return np.nan
+
+        return hits / position_count
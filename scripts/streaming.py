@@ -0,0 +1,491 @@
+from collections import deque
+
+import numpy as np
+
+from . import data_preparation
+from . import metrics_calculation
+from . import stock_metrics as sm
+from .indicator_cache import PPO_MATYPE, indicator_parameters
+
+
+# Motor incremental de indicadores y métricas para añadir barras nuevas sin recalcular toda la historia
+# reproduce barra a barra el camino batch de calculate_fh_metrics: returns, las dos fases de outliers,
+# future_returns y los indicadores sobre las filas que quedan tras las dos fases
+# cada barra cuesta O(1) (amortizado) por indicador: indicadores, outliers y una fila más en la historia del horizonte
+# los umbrales de position y future_position (medias globales de |returns| y |future_returns|) cambian con cada barra
+# y cambian la posición de filas antiguas, así que el estado exacto necesita toda la historia: la memoria crece O(n)
+# (returns, future_returns y el estado de cada indicador por fila, ver RowHistory) y las tablas se cuentan al pedir
+# las métricas, en O(n) por indicador con operaciones de numpy
+
+
+# orden de los indicadores en calculate_fh_metrics
+INDICATORS = ['sma', 'rsi', 'macd', 'ppo', 'bbands']
+
+
+# ventana de tamaño fijo con la suma de sus valores
+class Window:
+
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+
+    def push(self, value):
+        if self.full():
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+
+    def full(self):
+        return len(self.values) == self.values.maxlen
+
+    def mean(self):
+        return self.total / self.values.maxlen if self.full() else np.nan
+
+
+# SMA incremental (como talib.SMA)
+class StreamingSMA:
+
+    def __init__(self, timeperiod=30):
+        self.window = Window(timeperiod)
+
+    def update(self, close):
+        self.window.push(close)
+        return self.window.mean()
+
+
+# EMA incremental como talib: empieza en la barra start con la media de las timeperiod barras anteriores
+class StreamingEMA:
+
+    def __init__(self, timeperiod=30, start=None):
+        self.k = 2 / (timeperiod + 1)
+        self.start = timeperiod - 1 if start is None else start
+        self.window = Window(timeperiod)
+        self.bar = -1
+        self.value = np.nan
+
+    def update(self, value):
+        self.bar += 1
+        if self.bar <= self.start:
+            self.window.push(value)
+            if self.bar == self.start:
+                self.value = self.window.mean()
+        else:
+            self.value = (1 - self.k) * self.value + self.k * value
+
+        return self.value
+
+
+# RSI incremental con el suavizado de Wilder (como talib.RSI)
+class StreamingRSI:
+
+    def __init__(self, timeperiod=14):
+        self.timeperiod = timeperiod
+        self.previous = None
+        self.gains = Window(timeperiod)
+        self.losses = Window(timeperiod)
+        self.mean_gain = np.nan
+        self.mean_loss = np.nan
+
+    def update(self, close):
+        if self.previous is None:
+            self.previous = close
+            return np.nan
+
+        change = close - self.previous
+        self.previous = close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+
+        # las primeras timeperiod variaciones se promedian y a partir de ahí se suavizan
+        if np.isnan(self.mean_gain):
+            self.gains.push(gain)
+            self.losses.push(loss)
+            if not self.gains.full():
+                return np.nan
+            self.mean_gain, self.mean_loss = self.gains.mean(), self.losses.mean()
+        else:
+            decay = (self.timeperiod - 1) / self.timeperiod
+            self.mean_gain = decay * self.mean_gain + gain / self.timeperiod
+            self.mean_loss = decay * self.mean_loss + loss / self.timeperiod
+
+        total = self.mean_gain + self.mean_loss
+        return 0.0 if abs(total) < 1e-8 else 100 * self.mean_gain / total
+
+
+# MACD incremental (como talib.MACD): las dos EMAs empiezan en la barra slowperiod-1 y la señal sobre la línea
+class StreamingMACD:
+
+    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+
+        self.start = slowperiod - 1
+        self.fast = StreamingEMA(fastperiod, self.start)
+        self.slow = StreamingEMA(slowperiod, self.start)
+        self.signal = StreamingEMA(signalperiod)
+        self.bar = -1
+
+    def update(self, close):
+        self.bar += 1
+        line = self.fast.update(close) - self.slow.update(close)
+        if self.bar < self.start:
+            return np.nan, np.nan, np.nan
+
+        signal = self.signal.update(line)
+        if np.isnan(signal):
+            return np.nan, np.nan, np.nan
+
+        return line, signal, line - signal
+
+
+# PPO incremental (como talib.PPO), con medias simples (matype 0) o exponenciales (matype 1)
+class StreamingPPO:
+
+    def __init__(self, fastperiod=12, slowperiod=26, matype=PPO_MATYPE):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+
+        if matype == 0:
+            self.fast, self.slow = StreamingSMA(fastperiod), StreamingSMA(slowperiod)
+        elif matype == 1:
+            self.fast, self.slow = StreamingEMA(fastperiod), StreamingEMA(slowperiod)
+        else:
+            raise ValueError(f'matype no soportado: {matype}')
+
+    def update(self, close):
+        fast = self.fast.update(close)
+        slow = self.slow.update(close)
+        if np.isnan(fast) or np.isnan(slow):
+            return np.nan
+
+        return 0.0 if slow == 0 else 100 * (fast - slow) / slow
+
+
+# BBANDS incrementales (como talib.BBANDS con media simple y desviación poblacional)
+# las sumas se centran en el primer precio para no perder precisión
+class StreamingBBANDS:
+
+    def __init__(self, timeperiod=5, nbdevup=2, nbdevdn=2):
+        self.nbdevup = nbdevup
+        self.nbdevdn = nbdevdn
+        self.origin = None
+        self.sums = Window(timeperiod)
+        self.squares = Window(timeperiod)
+
+    def update(self, close):
+        if self.origin is None:
+            self.origin = close
+
+        centered = close - self.origin
+        self.sums.push(centered)
+        self.squares.push(centered ** 2)
+        if not self.sums.full():
+            return np.nan, np.nan, np.nan
+
+        mean = self.sums.mean()
+        std = np.sqrt(max(self.squares.mean() - mean ** 2, 0.0))
+        middle = self.origin + mean
+
+        return middle + self.nbdevup * std, middle, middle - self.nbdevdn * std
+
+
+# indicadores incrementales y señales de cada indicador a partir de sus valores (las de metrics_calculation)
+STREAMING = {
+    'sma': StreamingSMA,
+    'rsi': StreamingRSI,
+    'macd': StreamingMACD,
+    'ppo': StreamingPPO,
+    'bbands': StreamingBBANDS,
+}
+
+SIGNALS = {
+    'sma': lambda close, sma: metrics_calculation.sma_signals(close, sma),
+    'rsi': lambda close, rsi: metrics_calculation.rsi_signals(rsi),
+    'macd': lambda close, macd: metrics_calculation.macd_signals(macd[1], macd[2]),
+    'ppo': lambda close, ppo: metrics_calculation.ppo_signals(ppo),
+    'bbands': lambda close, bbands: metrics_calculation.bbands_signals(close, bbands[0], bbands[2]),
+}
+
+# número de señales (bits del estado) de cada indicador
+N_SIGNALS = {'sma': 1, 'rsi': 2, 'macd': 2, 'ppo': 1, 'bbands': 3}
+
+
+# función para obtener el estado (bits de las señales) de un indicador a partir de sus valores
+def signal_state(indicator, close, values):
+    state = 0
+    for i, signal in enumerate(SIGNALS[indicator](close, values)):
+        state |= int(bool(signal)) << i
+
+    return state
+
+
+# detección incremental de outliers con la ventana móvil de drop_outliers
+# las ventanas con algún NaN (inicio de la serie) no marcan outliers
+class RollingOutliers:
+
+    def __init__(self, window=21, n_sigmas=3):
+        self.values = deque(maxlen=window)
+        self.n_sigmas = n_sigmas
+
+    def update(self, value):
+        self.values.append(value)
+        if len(self.values) < self.values.maxlen:
+            return False
+
+        values = np.fromiter(self.values, dtype='float', count=len(self.values))
+        mu = values.mean()
+        sigma = values.std(ddof=1)
+
+        return bool((value > mu + self.n_sigmas*sigma) | (value < mu - self.n_sigmas*sigma))
+
+
+# media incremental de valores absolutos (umbral de get_position), sin contar los NaN
+class AbsoluteMean:
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def update(self, value):
+        if not np.isnan(value):
+            self.total += abs(value)
+            self.count += 1
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else np.nan
+
+
+# historia de las filas que quedan tras las dos fases, en arrays que crecen al doble (añadir una fila es O(1) amortizado)
+# future_returns es NaN hasta que se resuelve; states tiene el estado de cada indicador (bits de sus señales)
+class RowHistory:
+
+    def __init__(self, n_configs, capacity=1024):
+        self.size = 0
+        self.returns = np.empty(capacity)
+        self.future_returns = np.empty(capacity)
+        self.states = np.empty((capacity, n_configs), dtype='int8')
+
+    def __len__(self):
+        return self.size
+
+    def append(self, returns, states):
+        if self.size == len(self.returns):
+            capacity = 2 * len(self.returns)
+            self.returns = np.resize(self.returns, capacity)
+            self.future_returns = np.resize(self.future_returns, capacity)
+            self.states = np.resize(self.states, (capacity, self.states.shape[1]))
+
+        self.returns[self.size] = returns
+        self.future_returns[self.size] = np.nan
+        self.states[self.size] = states
+        self.size += 1
+
+    def resolve(self, row, future_returns):
+        self.future_returns[row] = future_returns
+
+
+# función para obtener la posición (1 larga, 0 corta, 2 sin posición) de unos valores con el umbral de get_position
+# los NaN (filas sin future_returns todavía) no tienen posición, como en batch
+def threshold_position(values, mean_returns):
+    with np.errstate(invalid='ignore'):
+        return np.where(np.abs(values) > mean_returns, (values >= 0).astype('int'), 2)
+
+
+# función para contar la tabla de señales (estado x future_bullish x future_position) con el umbral actual
+def signal_counts(states, future_returns, mean_future_returns, n_signals):
+    cells = (states.astype('int64') * 2 + (future_returns >= 0)) * 3 + threshold_position(future_returns, mean_future_returns)
+    return np.bincount(cells, minlength=2 ** n_signals * 6).reshape(-1, 2, 3)
+
+
+# Estado incremental de un horizonte temporal
+# la historia de las filas (RowHistory) se guarda siempre, porque los umbrales globales de position la necesitan;
+# sin p_values solo se omite el cálculo de los p-values (son NaN), no la memoria
+class StreamingHorizon:
+
+    def __init__(self, forecast_horizon, params, p_values=True):
+        self.forecast_horizon = forecast_horizon
+        self.configs = [(indicator, parameter) for indicator in INDICATORS for parameter in params[f'{indicator}_timeperiods']]
+        self.indicators = [STREAMING[indicator](**indicator_parameters(parameter)) for indicator, parameter in self.configs]
+        self.p_values = p_values
+
+        # returns y outliers de las dos fases (create_price_change_vars y create_target_features)
+        self.closes = deque(maxlen=forecast_horizon + 1)
+        self.outliers = RollingOutliers()
+        self.filtered_outliers = RollingOutliers()
+        self.mean_returns = AbsoluteMean()
+        self.mean_future_returns = AbsoluteMean()
+
+        # filas de la primera fase esperando su future_returns: (close, fila de la historia o None si es outlier)
+        self.targets = deque(maxlen=forecast_horizon)
+
+        # filas y estadísticos de las filas que quedan tras las dos fases
+        self.history = RowHistory(len(self.configs))
+        self.returns_count = 0
+        self.returns_mean = 0.0
+        self.returns_m2 = 0.0
+        self.volume_total = 0.0
+
+    # función para añadir una barra nueva
+    def update(self, close, volume):
+        self.closes.append(close)
+        returns = (close / self.closes[0] - 1) * 100 if len(self.closes) == self.closes.maxlen else np.nan
+        self.mean_returns.update(returns)
+
+        if self.outliers.update(returns):
+            return
+
+        # la fila queda tras la primera fase, se resuelve el future_returns de la fila de hace forecast_horizon
+        if len(self.targets) == self.targets.maxlen:
+            self._resolve(self.targets[0], close)
+
+        if self.filtered_outliers.update(returns):
+            self.targets.append((close, None))
+            return
+
+        # la fila queda tras las dos fases: se actualizan los indicadores y la historia
+        states = [signal_state(indicator, close, self.indicators[i].update(close)) for i, (indicator, _) in enumerate(self.configs)]
+
+        if not np.isnan(returns):
+            self.returns_count += 1
+            delta = returns - self.returns_mean
+            self.returns_mean += delta / self.returns_count
+            self.returns_m2 += delta * (returns - self.returns_mean)
+        self.volume_total += volume
+
+        self.targets.append((close, len(self.history)))
+        self.history.append(returns, states)
+
+    # función para asignar el future_returns de una fila de la primera fase
+    def _resolve(self, target, close):
+        target_close, row = target
+        future_returns = (close / target_close - 1) * 100
+        self.mean_future_returns.update(future_returns)
+
+        if row is not None:
+            self.history.resolve(row, future_returns)
+
+    # función para obtener la tabla de las señales generales (alcista, larga, corta) con el umbral de position actual
+    # las métricas generales solo usan la frecuencia de cada estado, así que se cuentan en future_bullish 0 y future_position 2
+    def _general_table(self):
+        returns = self.history.returns[:len(self.history)]
+        signals = metrics_calculation.general_signals(data_preparation.get_bullish(returns),
+                                                      threshold_position(returns, self.mean_returns.mean()))
+
+        table = np.zeros((8, 2, 3), dtype='int64')
+        table[:, 0, 2] = np.bincount(sum(signal.astype('int64') << i for i, signal in enumerate(signals)), minlength=8)
+
+        return table
+
+    # función para obtener los p-values generales (diferencia de retornos según tendencia y según posición)
+    def _general_p_values(self):
+        if not self.p_values:
+            return [np.nan, np.nan]
+
+        returns = self.history.returns[:len(self.history)]
+        bullish = data_preparation.get_bullish(returns)
+        position = threshold_position(returns, self.mean_returns.mean())
+
+        return [
+            sm.p_value(returns[bullish == 1], np.abs(returns[bullish == 0])),
+            sm.p_value(returns[position == 1], np.abs(returns[position == 0])),
+        ]
+
+    # función para obtener las métricas del horizonte, con el mismo formato que calculate_fh_metrics
+    def metrics(self):
+        fh_metrics = {'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+
+        def append(indicator, parameter, metrics):
+            fh_metrics['indicator'] += ([indicator] * len(metrics['value']))
+            fh_metrics['parameter'] += ([parameter] * len(metrics['value']))
+            fh_metrics['metric'] += metrics['metric']
+            fh_metrics['value'] += metrics['value']
+
+        mean_returns = self.returns_mean if self.returns_count > 0 else np.nan
+        volatility = np.sqrt(self.returns_m2 / (self.returns_count - 1)) if self.returns_count > 1 else np.nan
+        mean_volume = self.volume_total / len(self.history) if len(self.history) > 0 else np.nan
+
+        general_table = sm.SignalTable.from_counts(self._general_table())
+        append('general', 'NA', metrics_calculation.general_table_metrics(
+            general_table, mean_returns, volatility, mean_volume, self._general_p_values()))
+
+        future_returns = self.history.future_returns[:len(self.history)]
+        ranks = sm.MannWhitneyRanks(future_returns) if self.p_values else None
+        mean_future_returns = self.mean_future_returns.mean()
+
+        for i, (indicator, parameter) in enumerate(self.configs):
+            state = self.history.states[:len(self.history), i]
+            counts = signal_counts(state, future_returns, mean_future_returns, N_SIGNALS[indicator])
+            if not self.p_values:
+                table = sm.SignalTable.from_counts(counts)
+                p_values = [np.nan] * len(metrics_calculation.HYPOTHESES[indicator])
+            else:
+                table = sm.SignalTable.from_counts(counts, state.astype('int64'))
+                p_values = metrics_calculation.table_p_values(table, indicator, None, ranks)
+
+            append(indicator, parameter, metrics_calculation.TABLE_METRICS[indicator](table, p_values))
+
+        return fh_metrics
+
+
+# Motor incremental de todos los horizontes temporales de un stock
+class StreamingEngine:
+
+    def __init__(self, params, p_values=True):
+        self.params = params
+        self.horizons = [StreamingHorizon(fh, params, p_values) for fh in params['forecast_horizons']]
+
+    # función para crear el motor a partir de la historia de precios (dataframe de get_stock_prices)
+    # la historia se procesa barra a barra, así que el estado es el mismo que si las barras hubieran llegado en vivo
+    @classmethod
+    def from_prices(cls, stock_prices, params, p_values=True):
+        return cls(params, p_values).extend(stock_prices)
+
+    # función para añadir una barra nueva (cierre y volumen)
+    def update(self, close, volume):
+        for horizon in self.horizons:
+            horizon.update(float(close), float(volume))
+
+        return self
+
+    # función para añadir varias barras (dataframe con columnas close y volume)
+    def extend(self, stock_prices):
+        for close, volume in zip(stock_prices.close.values, stock_prices.volume.values):
+            self.update(close, volume)
+
+        return self
+
+    # función para obtener las métricas del stock, con el mismo formato que calculate_stock_metrics
+    def metrics(self):
+        stock_metrics = {'forecast_horizon': [], 'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+        for horizon in self.horizons:
+            metrics_calculation.append_fh_metrics(stock_metrics, horizon.forecast_horizon, horizon.metrics())
+
+        return stock_metrics
+
+
+# función para comprobar que el motor incremental da las mismas métricas que el camino batch
+# se añaden las barras de stock_prices una a una y en cada checkpoint (número de barras) se compara con
+# calculate_fh_metrics sobre ese prefijo; las diferencias de redondeo se toleran con rtol y atol
+def replay(stock_prices, params, checkpoints, rtol=1e-7, atol=1e-9):
+    engine = StreamingEngine(params)
+    n_bars = 0
+
+    for checkpoint in sorted(checkpoints):
+        engine.extend(stock_prices.iloc[n_bars:checkpoint])
+        n_bars = checkpoint
+
+        for horizon in engine.horizons:
+            expected = metrics_calculation.calculate_fh_metrics(stock_prices.iloc[:checkpoint].copy(), horizon.forecast_horizon, params)
+            result = horizon.metrics()
+
+            if [result[key] for key in ['indicator', 'parameter', 'metric']] != [expected[key] for key in ['indicator', 'parameter', 'metric']]:
+                raise AssertionError(f'las métricas no coinciden (checkpoint={checkpoint}, fh={horizon.forecast_horizon})')
+
+            close = np.isclose(result['value'], expected['value'], rtol=rtol, atol=atol, equal_nan=True)
+            if not close.all():
+                i = np.flatnonzero(~close)[0]
+                raise AssertionError(
+                    f'{expected["indicator"][i]} {expected["parameter"][i]} {expected["metric"][i]} no coincide '
+                    f'(checkpoint={checkpoint}, fh={horizon.forecast_horizon}): {result["value"][i]} != {expected["value"][i]}'
+                )
+
+    return True
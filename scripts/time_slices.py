@@ -0,0 +1,229 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import talib
+
+from . import data_preparation
+from . import instrumentation
+from . import metrics_calculation
+from . import stock_metrics as sm
+from .indicator_cache import IndicatorCache, indicator_parameters
+from .streaming import SIGNALS
+
+logger = logging.getLogger(__name__)
+
+
+# Métricas por ventanas de tiempo (años, ventanas móviles, regímenes) sin volver a ejecutar explore_stocks por fechas
+# cada horizonte temporal de un ticker se prepara una sola vez sobre toda la historia (returns, outliers, targets e
+# indicadores, igual que en calculate_fh_metrics) y se guardan los conteos acumulados de cada tabla de contingencia y las
+# sumas acumuladas de returns y volume; la tabla de una ventana es la resta de dos filas de los acumulados (O(1))
+# una ventana es (etiqueta, [(inicio, fin), ...]) con intervalos de fechas [inicio, fin); los regímenes tienen varios
+# los p-values se calculan con las filas de cada ventana (un ordenamiento por ventana), o no se calculan con p_values=False
+# a diferencia de llamar a explore_stocks con start_date/end_date, los umbrales de position, los outliers y el
+# calentamiento de los indicadores son los de la historia completa
+
+
+# función para pasar una fecha a la zona horaria del índice
+def localize(date, dates):
+    date = pd.Timestamp(date)
+    if dates.tz is not None and date.tz is None:
+        date = date.tz_localize(dates.tz)
+    return date
+
+
+# función para obtener las ventanas de cada año natural de los precios
+def yearly_windows(stock_prices):
+    dates = stock_prices.index
+    return [(str(year), [(localize(f'{year}-01-01', dates), localize(f'{year + 1}-01-01', dates))])
+            for year in range(dates[0].year, dates[-1].year + 1)]
+
+
+# función para obtener ventanas móviles completas de length, desplazadas step (p.ej. 2 años cada año)
+def rolling_windows(stock_prices, length=pd.DateOffset(years=2), step=pd.DateOffset(years=1)):
+    dates = stock_prices.index
+    windows = []
+    start = dates[0].normalize()
+    while start + length <= dates[-1] + pd.Timedelta(days=1):
+        windows.append((start.strftime('%Y-%m-%d'), [(start, start + length)]))
+        start = start + step
+
+    return windows
+
+
+# función para obtener las ventanas de cada régimen a partir de una etiqueta por fecha (None o NaN para las fechas sin régimen)
+# cada tramo consecutivo de fechas con la misma etiqueta es un intervalo de la ventana de esa etiqueta
+def regime_windows(labels):
+    dates = labels.index
+    values = labels.values
+    change = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.concatenate([change, [len(values)]])
+    bounds = dates.append(pd.DatetimeIndex([dates[-1] + pd.Timedelta(days=1)]))
+
+    windows = {}
+    for start, end in zip(starts, ends):
+        if not pd.isna(values[start]):
+            windows.setdefault(values[start], []).append((bounds[start], bounds[end]))
+
+    return list(windows.items())
+
+
+# función para obtener los regímenes alcista ('bull', cierre por encima de su sma) y bajista ('bear')
+def trend_regime_windows(stock_prices, timeperiod=200):
+    sma = talib.SMA(stock_prices['close'].values, timeperiod=timeperiod)
+    labels = np.where(np.isnan(sma), None, np.where(stock_prices['close'].values >= sma, 'bull', 'bear'))
+    return regime_windows(pd.Series(labels, index=stock_prices.index))
+
+
+# Acumulados de un horizonte temporal de un ticker para obtener sus métricas en cualquier ventana
+class SlicedHorizon:
+
+    def __init__(self, stock_prices, forecast_horizon, params):
+        stock_prices = data_preparation.create_price_change_vars(stock_prices.copy(), forecast_horizon)
+        stock_prices = data_preparation.create_target_features(stock_prices, forecast_horizon)
+        indicators = IndicatorCache(stock_prices.close).warm(params)
+
+        self.dates = stock_prices.index
+        self.returns = stock_prices.returns.values
+        self.bullish = stock_prices.bullish.values
+        self.position = stock_prices.position.values
+        self.future_returns = stock_prices.future_returns.values
+        future_bullish = stock_prices.future_bullish.values
+        future_position = stock_prices.future_position.values
+
+        # estado de cada fila y conteos acumulados (filas + 1 x celdas de la tabla) de cada (indicador, parámetro)
+        self.cells = [('general', 'NA')] + [(indicator, parameter) for indicator in metrics_calculation.CALCULATE_METRICS
+                                            for parameter in params[f'{indicator}_timeperiods']]
+        self.states = []
+        self.counts = []
+        with instrumentation.stage('slices.counts', len(stock_prices)):
+            for indicator, parameter in self.cells:
+                if indicator == 'general':
+                    signals = metrics_calculation.general_signals(self.bullish, self.position)
+                else:
+                    values = indicators.get(indicator, **indicator_parameters(parameter))
+                    signals = SIGNALS[indicator](stock_prices.close, values)
+
+                table = sm.SignalTable(signals, future_bullish, future_position)
+                cells = (table.state * 2 + future_bullish) * 3 + future_position
+                counts = np.zeros((len(cells) + 1, table.table.size), dtype='int32')
+                counts[np.arange(1, len(cells) + 1), cells] = 1
+                self.states.append(table.state)
+                self.counts.append(np.cumsum(counts, axis=0, dtype='int32'))
+
+        # sumas acumuladas de returns (centrados en su media para no perder precisión) y de volume
+        defined = ~np.isnan(self.returns)
+        self.center = np.nanmean(self.returns) if defined.any() else 0.0
+        centered = np.where(defined, self.returns - self.center, 0.0)
+        self.returns_count = np.concatenate([[0], np.cumsum(defined)])
+        self.returns_sum = np.concatenate([[0.0], np.cumsum(centered)])
+        self.returns_squares = np.concatenate([[0.0], np.cumsum(centered ** 2)])
+        self.volume_sum = np.concatenate([[0.0], np.cumsum(stock_prices.volume.values)])
+
+    # función para pasar los intervalos de fechas de una ventana a intervalos de filas (inicios y finales)
+    def rows(self, intervals):
+        starts = self.dates.searchsorted([localize(start, self.dates) for start, _ in intervals])
+        ends = self.dates.searchsorted([localize(end, self.dates) for _, end in intervals])
+        return starts, ends
+
+    # función para obtener la suma de unos acumulados en los intervalos de filas
+    @staticmethod
+    def _total(cumulative, starts, ends):
+        return (cumulative[ends] - cumulative[starts]).sum(axis=0)
+
+    # función para obtener las métricas de una ventana, con el mismo formato que calculate_fh_metrics
+    def metrics(self, intervals, p_values=True):
+        starts, ends = self.rows(intervals)
+        n = (ends - starts).sum()
+
+        fh_metrics = {'indicator': [], 'parameter': [], 'metric': [], 'value': []}
+        if n == 0:
+            return fh_metrics
+
+        # filas de la ventana, solo para los p-values
+        ranks = None
+        if p_values:
+            rows = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+            ranks = sm.MannWhitneyRanks(self.future_returns[rows])
+
+        for (indicator, parameter), state, counts in zip(self.cells, self.states, self.counts):
+            table = sm.SignalTable.from_counts(self._total(counts, starts, ends).reshape(-1, 2, 3),
+                                               state[rows] if p_values else None)
+
+            if indicator == 'general':
+                count = self._total(self.returns_count, starts, ends)
+                total = self._total(self.returns_sum, starts, ends)
+                squares = self._total(self.returns_squares, starts, ends)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean_returns = self.center + total / count if count else np.nan
+                    volatility = np.sqrt(max(squares - total ** 2 / count, 0) / (count - 1)) if count > 1 else np.nan
+                mean_volume = self._total(self.volume_sum, starts, ends) / n
+
+                general_p_values = [np.nan, np.nan]
+                if p_values:
+                    general_p_values = metrics_calculation.general_p_values(self.returns[rows], self.bullish[rows], self.position[rows])
+                metrics = metrics_calculation.general_table_metrics(table, mean_returns, volatility, mean_volume, general_p_values)
+            else:
+                if p_values:
+                    table_p_values = metrics_calculation.table_p_values(table, indicator, None, ranks)
+                else:
+                    table_p_values = [np.nan] * len(metrics_calculation.HYPOTHESES[indicator])
+                metrics = metrics_calculation.TABLE_METRICS[indicator](table, table_p_values)
+
+            fh_metrics['indicator'] += ([indicator] * len(metrics['value']))
+            fh_metrics['parameter'] += ([parameter] * len(metrics['value']))
+            fh_metrics['metric'] += metrics['metric']
+            fh_metrics['value'] += metrics['value']
+
+        return fh_metrics
+
+
+# función para obtener las métricas de un ticker en cada ventana
+# windows es una lista de ventanas o una función que las obtiene a partir de los precios (p.ej. yearly_windows)
+# devuelve el diccionario de calculate_stock_metrics con las columnas window, start y end
+def calculate_sliced_metrics(stock_prices, params, windows=yearly_windows, p_values=True):
+    if callable(windows):
+        windows = windows(stock_prices)
+
+    stock_metrics = {'window': [], 'start': [], 'end': [], 'forecast_horizon': [], 'indicator': [], 'parameter': [],
+                     'metric': [], 'value': []}
+
+    for fh in params['forecast_horizons']:
+        with instrumentation.context(forecast_horizon=fh):
+            sliced_horizon = SlicedHorizon(stock_prices, fh, params)
+
+            with instrumentation.stage('slices.metrics', len(windows)):
+                for label, intervals in windows:
+                    fh_metrics = sliced_horizon.metrics(intervals, p_values)
+                    n = len(fh_metrics['value'])
+                    stock_metrics['window'] += ([label] * n)
+                    stock_metrics['start'] += ([localize(intervals[0][0], sliced_horizon.dates)] * n)
+                    stock_metrics['end'] += ([localize(intervals[-1][1], sliced_horizon.dates)] * n)
+                    metrics_calculation.append_fh_metrics(stock_metrics, fh, fh_metrics)
+
+    return stock_metrics
+
+
+# función para crear el dataset de métricas por ventanas de todos los stocks (stocks_metrics con window, start y end)
+# los precios de cada ticker se descargan una sola vez (o se leen de cache, una price_cache.PriceCache)
+def explore_sliced(tickers, start_date, end_date, params, windows=yearly_windows, p_values=True, cache=None):
+    frames = []
+    for ticker in tickers:
+        try:
+            with instrumentation.context(ticker=ticker):
+                stock_prices = data_preparation.get_stock_prices(ticker, start_date, end_date, cache)
+                stock_metrics = calculate_sliced_metrics(stock_prices, params, windows, p_values)
+        except Exception:
+            logger.exception('No se han podido calcular las métricas por ventanas de %s', ticker)
+            continue
+
+        frame = pd.DataFrame(data=stock_metrics)
+        frame.insert(0, 'ticker', ticker)
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=['ticker', 'window', 'start', 'end', 'forecast_horizon', 'indicator', 'parameter',
+                                     'metric', 'value'])
+
+    return pd.concat(frames, ignore_index=True)
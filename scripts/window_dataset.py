@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import talib
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import data_preparation
+
+
+# Dataset de ventanas deslizantes para los modelos con lookback (RNN, GRU, LSTM del notebook parte4)
+# las variables se guardan una sola vez en un buffer contiguo (filas x variables), en memoria o en un memmap,
+# y las ventanas (muestras x lookback x variables) son vistas sobre él, así que la memoria no crece con lookback
+# la ventana que termina en la fila i tiene como objetivo el target de la fila i, como en el notebook
+
+
+# variables independientes del notebook parte4
+FEATURES = ['returns', 'volume', 'adx', 'nvi', 'smad_10', 'smad_20', 'rsi_14', 'rsi_28', 'bbd', 'ppo']
+
+
+# función para crear las variables del notebook parte4 a partir de los precios (sin pasar por data/stock_prices.csv)
+def create_features(stock_prices, forecast_horizon=5):
+    stock_prices = data_preparation.create_price_change_vars(stock_prices)
+    stock_prices = data_preparation.create_target_features(stock_prices, forecast_horizon)
+    stock_prices['smad_10'] = data_preparation.SMAD(stock_prices.close, timeperiod=10)
+    stock_prices['smad_20'] = data_preparation.SMAD(stock_prices.close, timeperiod=20)
+    stock_prices['rsi_14'] = talib.RSI(stock_prices.close, timeperiod=14)
+    stock_prices['rsi_28'] = talib.RSI(stock_prices.close, timeperiod=28)
+    stock_prices['bbd'] = data_preparation.BBD(stock_prices.close, timeperiod=20, nbdevup=2, nbdevdn=2, matype=0)
+    stock_prices['ppo'] = talib.PPO(stock_prices.close, fastperiod=12, slowperiod=26, matype=0)
+    stock_prices['adx'] = talib.ADX(stock_prices.high, stock_prices.low, stock_prices.close, timeperiod=14)
+    stock_prices['nvi'] = talib.NATR(stock_prices.high, stock_prices.low, stock_prices.close, timeperiod=14)
+
+    return stock_prices
+
+
+# función para obtener los parámetros de escalado (desplazamiento y escala de cada columna) con las filas de entrenamiento
+# 'minmax' equivale a MinMaxScaler y 'standard' a StandardScaler de sklearn
+def fit_scaler(values, scaler='minmax'):
+    if scaler == 'minmax':
+        offset = np.nanmin(values, axis=0)
+        scale = np.nanmax(values, axis=0) - offset
+    elif scaler == 'standard':
+        offset = np.nanmean(values, axis=0)
+        scale = np.nanstd(values, axis=0)
+    else:
+        raise ValueError(f'scaler desconocido: {scaler}')
+
+    # las columnas constantes no se escalan, como en sklearn
+    return offset, np.where(scale == 0, 1, scale)
+
+
+# función para escalar un buffer sin copiarlo, por bloques de filas (los memmap no se cargan enteros)
+def scale_inplace(values, offset, scale, chunk_size=1_000_000):
+    for start in range(0, len(values), chunk_size):
+        block = values[start:start + chunk_size]
+        block -= offset.astype(values.dtype)
+        block /= scale.astype(values.dtype)
+
+
+# Dataset de ventanas de un ticker
+# stock_prices es el dataframe con las variables (p.ej. de create_features); las filas con NaN se descartan
+# test_date separa entrenamiento (fechas anteriores) y test (fechas desde test_date); las ventanas de test
+# toman las lookback-1 filas anteriores de entrenamiento, y el escalado se ajusta solo con las de entrenamiento
+# con memmap_path el buffer se guarda en un .npy en disco y las ventanas se leen de él bajo demanda
+class WindowDataset:
+
+    def __init__(self, stock_prices, features=FEATURES, target='future_returns', lookback=15, test_date=None,
+                 scaler='minmax', scale_target=False, dtype='float32', memmap_path=None):
+        frame = stock_prices[list(features) + [target]].dropna()
+
+        self.features = list(features)
+        self.target = target
+        self.lookback = lookback
+        self.dates = frame.index
+
+        shape = (len(frame), len(self.features))
+        if memmap_path is not None:
+            self.values = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=dtype, shape=shape)
+        else:
+            self.values = np.empty(shape, dtype=dtype)
+        self.values[:] = frame[self.features].values
+        self.targets = frame[target].values.astype(dtype)
+
+        # primera fila de test (todas las filas son de entrenamiento si no hay test_date)
+        self.split = len(frame) if test_date is None else self.dates.searchsorted(self._timestamp(test_date))
+
+        self.scaler = None
+        self.target_scaler = None
+        if scaler is not None:
+            self.scaler = fit_scaler(self.values[:self.split], scaler)
+            scale_inplace(self.values, *self.scaler)
+            if scale_target:
+                self.target_scaler = fit_scaler(self.targets[:self.split], scaler)
+                scale_inplace(self.targets, *self.target_scaler)
+
+    # fecha de corte con la misma zona horaria que el índice
+    def _timestamp(self, date):
+        date = pd.Timestamp(date)
+        if self.dates.tz is not None and date.tz is None:
+            date = date.tz_localize(self.dates.tz)
+        return date
+
+    # vista (muestras x lookback x variables) de todas las ventanas, la muestra j termina en la fila j + lookback - 1
+    def windows(self):
+        return sliding_window_view(self.values, self.lookback, axis=0).transpose(0, 2, 1)
+
+    # filas finales de las ventanas de entrenamiento o de test
+    def _rows(self, part):
+        first = self.lookback - 1
+        if part == 'train':
+            return slice(first, max(first, self.split))
+        if part == 'test':
+            return slice(max(first, self.split), len(self.values))
+        if part is None:
+            return slice(first, len(self.values))
+
+        raise ValueError(f'parte desconocida: {part}')
+
+    # función para obtener las ventanas y los targets de una parte ('train', 'test' o None para todas) como vistas
+    def arrays(self, part=None):
+        rows = self._rows(part)
+        windows = self.windows()[rows.start - self.lookback + 1:rows.stop - self.lookback + 1]
+        return windows, self.targets[rows]
+
+    # fechas de los targets de una parte
+    def target_dates(self, part=None):
+        return self.dates[self._rows(part)]
+
+    # generador de mini-batches (X, y) de una parte; solo se copian las ventanas del batch
+    def batches(self, part='train', batch_size=32, shuffle=False, seed=None):
+        windows, targets = self.arrays(part)
+        order = np.arange(len(targets))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            if not shuffle:
+                rows = slice(rows[0], rows[-1] + 1)
+            yield np.ascontiguousarray(windows[rows]), targets[rows]
+
+    # función para deshacer el escalado de los targets (p.ej. de las predicciones)
+    def inverse_transform_target(self, values):
+        if self.target_scaler is None:
+            return values
+
+        offset, scale = self.target_scaler
+        return np.asarray(values) * scale + offset
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# los tests importan los módulos como paquete (from scripts import ...) desde la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
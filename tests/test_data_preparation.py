@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from scripts import data_preparation
+from scripts.benchmark import drop_outliers_reference, get_position_reference, synthetic_returns
+
+
+# returns sintéticos con outliers forzados y valores repetidos para cubrir los casos límite
+@pytest.fixture(params=[(seed, fh) for seed in range(3) for fh in (1, 5, 30)], ids=lambda p: f'seed{p[0]}-fh{p[1]}')
+def stock_prices(request):
+    seed, fh = request.param
+    stock_prices = synthetic_returns(5_000, seed, fh)
+    stock_prices.iloc[::97, stock_prices.columns.get_loc('returns')] *= 50
+    stock_prices.iloc[::89, stock_prices.columns.get_loc('returns')] = 0.0
+    return stock_prices
+
+
+def test_drop_outliers_matches_reference(stock_prices):
+    expected = drop_outliers_reference(stock_prices)
+    result = data_preparation.drop_outliers(stock_prices)
+
+    assert len(result) < len(stock_prices)
+    assert result.equals(expected)
+
+
+@pytest.mark.parametrize('kind', ['series', 'array', 'empty'])
+def test_get_position_matches_reference(stock_prices, kind):
+    returns = {'series': stock_prices.returns, 'array': stock_prices.returns.values,
+               'empty': stock_prices.returns.iloc[:0]}[kind]
+
+    expected = get_position_reference(returns)
+    result = data_preparation.get_position(returns)
+
+    assert result.dtype == expected.dtype
+    np.testing.assert_array_equal(result, expected)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import data_preparation
+from scripts import metrics_calculation
+from scripts.benchmark import PARAMS, synthetic_prices
+from scripts.indicator_cache import IndicatorCache
+
+
+# diferencia máxima admitida entre el modo lean y el normal en cada métrica (documentada en explore_stocks): con precios
+# en float32 un return justo en un umbral puede cambiar de lado y las frecuencias cambian en 1/n por observación
+LEAN_TOLERANCE = 0.01
+
+
+# función para calcular las métricas de un horizonte con los precios y los indicadores guardados en el modo indicado
+def fh_metrics(prices, forecast_horizon, lean, cache_indicators):
+    stock_prices = data_preparation.clean_data(prices, lean)
+    indicators = None
+    if cache_indicators:
+        indicators = IndicatorCache(stock_prices.close, metrics_calculation.indicator_dtype(lean)).warm(PARAMS)
+
+    return pd.DataFrame(data=metrics_calculation.calculate_fh_metrics(stock_prices, forecast_horizon, PARAMS, indicators,
+                                                                      lean=lean))
+
+
+@pytest.mark.parametrize('cache_indicators', [False, True], ids=['horizon', 'series'])
+@pytest.mark.parametrize('forecast_horizon', [1, 5, 30])
+@pytest.mark.parametrize('seed', range(3))
+def test_lean_matches_default(seed, forecast_horizon, cache_indicators):
+    prices = synthetic_prices(5_000, seed)
+    expected = fh_metrics(prices, forecast_horizon, False, cache_indicators)
+    result = fh_metrics(prices, forecast_horizon, True, cache_indicators)
+
+    assert result.drop(columns='value').equals(expected.drop(columns='value'))
+    assert (result['value'].isna() == expected['value'].isna()).all()
+    assert np.nanmax(np.abs(result['value'] - expected['value'])) <= LEAN_TOLERANCE
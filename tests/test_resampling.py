@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import data_preparation
+from scripts import metrics_calculation
+from scripts import resampling
+from scripts.benchmark import resampling_calibration, synthetic_prices
+from scripts.resampling import Resampler, ResamplingTest
+
+
+# número de remuestreos de los tests de invarianza (no es múltiplo de SEED_BLOCK, así que el último grupo está incompleto)
+N_RESAMPLES = 420
+
+# parámetros con una sola familia de indicadores para las métricas de un horizonte con remuestreo
+PARAMS = {'sma_timeperiods': [20, 50], 'rsi_timeperiods': [], 'macd_timeperiods': [], 'ppo_timeperiods': [],
+          'bbands_timeperiods': []}
+
+
+# future_returns solapados (fh=5) de un paseo aleatorio, con los últimos a NaN, y máscaras de varias hipótesis:
+# señales persistentes de medias móviles (con muestras complementarias), una máscara aleatoria y una con muestras
+# explícitas que no cubren todas las observaciones
+@pytest.fixture
+def hypotheses():
+    rng = np.random.default_rng(0)
+    close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.02, 3_000))))
+    values = (close.shift(-5) / close - 1).values
+    samples1 = np.stack([close.values > close.rolling(timeperiod).mean().values for timeperiod in (5, 20, 50)]
+                        + [rng.random(len(close)) < 0.3, close.values > close.shift(1).values])
+    samples2 = ~samples1
+    samples2[-1] &= rng.random(len(close)) < 0.5
+    return values, samples1, samples2
+
+
+def p_values(hypotheses, **kwargs):
+    values, samples1, samples2 = hypotheses
+    return ResamplingTest(values, n_resamples=N_RESAMPLES, seed=[7, 5], min_block_length=5, **kwargs).p_values(samples1, samples2)
+
+
+@pytest.mark.parametrize('batch_size', [50, 100, 2_000])
+def test_p_values_do_not_depend_on_batch_size(hypotheses, batch_size):
+    expected = p_values(hypotheses)
+    result = p_values(hypotheses, batch_size=batch_size)
+
+    assert not np.isnan(expected).any()
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_p_values_do_not_depend_on_batch_elements(hypotheses, monkeypatch):
+    expected = p_values(hypotheses)
+    monkeypatch.setattr(resampling, 'BATCH_ELEMENTS', 3_000)
+    result = p_values(hypotheses)
+
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('pool', [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_p_values_do_not_depend_on_executor(hypotheses, pool):
+    expected = p_values(hypotheses)
+    with pool(max_workers=2) as executor:
+        result = p_values(hypotheses, batch_size=100, executor=executor)
+
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_p_values_do_not_depend_on_other_hypotheses(hypotheses):
+    values, samples1, samples2 = hypotheses
+    expected = p_values(hypotheses)
+    result = p_values((values, samples1[1:3], samples2[1:3]))
+
+    np.testing.assert_array_equal(result, np.asarray(expected)[:, 1:3])
+
+
+def test_p_values_depend_on_seed(hypotheses):
+    values, samples1, samples2 = hypotheses
+    expected = p_values(hypotheses)
+    result = ResamplingTest(values, n_resamples=N_RESAMPLES, seed=[8, 5], min_block_length=5).p_values(samples1, samples2)
+
+    assert not np.array_equal(result, expected)
+
+
+# las métricas de un horizonte con remuestreo son las mismas con cualquier batch_size y repartiendo los lotes entre procesos
+@pytest.mark.parametrize('kwargs', [{'batch_size': 50}, {'max_workers': 2}], ids=['batch_size', 'max_workers'])
+def test_resampler_does_not_depend_on_batches(kwargs):
+    stock_prices = data_preparation.clean_data(synthetic_prices(2_000, drift=0.0))
+    with Resampler(N_RESAMPLES) as resampler:
+        expected = pd.DataFrame(data=metrics_calculation.calculate_fh_metrics(stock_prices.copy(), 10, PARAMS, resampler=resampler))
+    with Resampler(N_RESAMPLES, **kwargs) as resampler:
+        result = pd.DataFrame(data=metrics_calculation.calculate_fh_metrics(stock_prices.copy(), 10, PARAMS, resampler=resampler))
+
+    assert expected['metric'].str.endswith('bootstrap_p-value').any()
+    assert result.equals(expected)
+
+
+# rechazo bajo la hipótesis nula con pocos ensayos (benchmark --resampling hace la medida completa): a nivel 5% y con
+# fh=20 los p-values por bloques rechazan alrededor de un 5-10%, mientras que con bloques de una barra, más cortos
+# que el solapamiento de los future_returns, rechazan alrededor de la mitad de los ensayos
+def calibration(**kwargs):
+    return resampling_calibration(40, 5_000, forecast_horizons=(20,), sma_timeperiods=(20, 50), n_resamples=200, **kwargs)
+
+
+def test_resampling_calibration():
+    rejections = calibration().values
+
+    assert rejections.mean() <= 0.1
+    assert rejections.max() <= 0.2
+
+
+def test_resampling_calibration_detects_short_blocks():
+    assert calibration(block_length=1).values.mean() > 0.2